@@ -26,21 +26,26 @@ api_router = APIRouter()
 public_api_router = APIRouter()
 public_api_router.include_router(allocation.public_router)
 
-api_router.include_router(agent_chat.router)
-api_router.include_router(contracts.router, tags=["合同管理"])
-api_router.include_router(customers.router, tags=["客户管理"])
-api_router.include_router(deliveries.router, tags=["销售台账/报货订单"])
-api_router.include_router(delivery_contract_prices.router)
-api_router.include_router(delivery_plans.router, tags=["报货计划"])
-api_router.include_router(order_plans.router, tags=["订货计划"])
-api_router.include_router(weighbills.router, tags=["磅单管理"])
-api_router.include_router(balances.router, tags=["磅单结余管理"])
-api_router.include_router(payment.router, tags=["收款明细管理"])
-api_router.include_router(product_categories.router, tags=["品类管理"])
-api_router.include_router(exception_types.router, tags=["异常审核"])
-api_router.include_router(exception_reports.router, tags=["异常审核"])
-api_router.include_router(allocation.router, tags=["分配规划"])
-api_router.include_router(t1_compat.router)
+# 各业务路由自带 prefix/tags，这里不再重复传 tags（否则 OpenAPI 中每个接口的标签会重复一份）。
+# Starlette 按注册顺序线性匹配，高频模块（结余/磅单/报单/收款）放在前面；
+# 同前缀的 deliveries 与 delivery_contract_prices 须保持原有先后顺序。
+for _router in (
+    balances.router,
+    weighbills.router,
+    deliveries.router,
+    delivery_contract_prices.router,
+    payment.router,
+    contracts.router,
+    customers.router,
+    delivery_plans.router,
+    order_plans.router,
+    product_categories.router,
+    exception_types.router,
+    exception_reports.router,
+    allocation.router,
+    agent_chat.router,
+    t1_compat.router,
+    tl.router,
+):
+    api_router.include_router(_router)
 api_router.include_router(intelligent_prediction_router, tags=["智能预测模块"])
-api_router.include_router(tl.router)
-
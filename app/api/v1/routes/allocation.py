@@ -22,7 +22,7 @@ from app.services.allocation_service import (
     get_filter_options,
     query_ai_purchase_quantity,
 )
-from app.services.contract_service import get_conn
+from app.services.contract_service import get_conn, invalidate_contract_cache
 
 
 router = APIRouter(prefix="/allocation", tags=["分配规划"])
@@ -376,6 +376,7 @@ def _insert_test_contracts(num_contracts: int, prefix: str) -> list:
                     "end_date": end_date
                 })
 
+    invalidate_contract_cache()
     return inserted
 
 
@@ -469,6 +470,7 @@ def _cleanup_test_data(prefix: str = "TEST") -> dict:
             cur.execute("DELETE FROM pd_contracts WHERE contract_no LIKE %s", (f'{prefix}%',))
             deleted["contracts"] = cur.rowcount
 
+    invalidate_contract_cache()
     return deleted
 
 
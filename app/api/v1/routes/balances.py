@@ -1,48 +1,72 @@
 """
 磅单结余管理 + 支付回单路由（优化版）
 """
-import json
-import mimetypes
+import asyncio
+import hashlib
 import os
 import re
-import shutil
 from decimal import Decimal
-from pathlib import Path
 from typing import List, Optional, Dict
-from fastapi.responses import FileResponse
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Body, Form
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Body, Form, Request
 from pydantic import BaseModel, Field, ValidationError
 
 from app.core.paths import UPLOADS_DIR
+from app.core.responses import ORJSONResponse
 from app.services.balance_service import BalanceService, get_balance_service, UPLOAD_DIR
 from app.services.contract_service import get_conn
+from app.utils.file_responses import conditional_file_response
+from app.utils.ocr_pool import run_ocr_limited
+from app.utils.uploads import remove_files, save_upload_file, sniff_image_mime, unique_name_suffix
 
-router = APIRouter(prefix="/balances", tags=["磅单结余管理"])
+router = APIRouter(prefix="/balances", tags=["磅单结余管理"], default_response_class=ORJSONResponse)
 
+# 文件名中收款人的非法字符替换
+_SAFE_PAYEE_RE = re.compile(r'[^\w\-]')
 
-def _resolve_payment_receipt_image_path(image_path: str) -> Optional[Path]:
-    raw_path = Path(str(image_path))
-    candidates: List[Path] = []
+# 回单图片扩展名 -> MIME（仅服务 jpg/png/bmp/webp，免去 mimetypes 查表）
+_IMAGE_MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".bmp": "image/bmp",
+    ".webp": "image/webp",
+}
 
-    if raw_path.is_absolute():
+# 图片查找候选目录（字符串形式，供 os.path 直接拼接）
+_UPLOAD_DIR_STR = str(UPLOAD_DIR)
+_UPLOADS_DIR_STR = str(UPLOADS_DIR)
+_PROJECT_ROOT_STR = str(UPLOADS_DIR.parent)
+
+# 回单图片允许的类型（按文件头魔数判定）
+_ALLOWED_RECEIPT_MIME = frozenset({"image/jpeg", "image/png", "image/bmp"})
+
+_PAYMENT_STATUS_MAP = {0: "待支付", 1: "部分支付", 2: "已结清"}
+_OCR_STATUS_MAP = {0: "待确认", 1: "已确认", 2: "已核销"}
+
+
+def _resolve_payment_receipt_image_path(image_path: str) -> Optional[str]:
+    """按候选目录查找回单图片，返回存在的文件路径（纯字符串运算，避免构造 Path）"""
+    raw_path = str(image_path)
+    candidates: List[str] = []
+
+    if os.path.isabs(raw_path):
         candidates.append(raw_path)
     else:
         candidates.extend([
             raw_path,
-            UPLOAD_DIR / raw_path,
-            UPLOADS_DIR / raw_path,
-            UPLOAD_DIR / raw_path.name,
+            os.path.join(_UPLOAD_DIR_STR, raw_path),
+            os.path.join(_UPLOADS_DIR_STR, raw_path),
+            os.path.join(_UPLOAD_DIR_STR, os.path.basename(raw_path)),
         ])
-        if raw_path.parts and raw_path.parts[0] == "uploads":
-            candidates.append(UPLOADS_DIR.parent / raw_path)
+        if raw_path.replace("\\", "/").split("/", 1)[0] == "uploads":
+            candidates.append(os.path.join(_PROJECT_ROOT_STR, raw_path))
 
     seen = set()
     for candidate in candidates:
-        candidate_key = str(candidate)
-        if candidate_key in seen:
+        if candidate in seen:
             continue
-        seen.add(candidate_key)
-        if candidate.exists() and candidate.is_file():
+        seen.add(candidate)
+        if os.path.isfile(candidate):
             return candidate
 
     return None
@@ -71,6 +95,15 @@ class PaymentReceiptOCRResponse(BaseModel):
     ocr_success: bool = True
 
 
+class PaymentReceiptOCRBatchItem(BaseModel):
+    """批量OCR单张结果"""
+    index: int
+    filename: Optional[str] = None
+    success: bool
+    error: Optional[str] = None
+    data: Optional[PaymentReceiptOCRResponse] = None
+
+
 class PaymentReceiptCreateRequest(BaseModel):
     """创建支付回单请求模型"""
     receipt_no: Optional[str] = Field(None, description="回单编号")
@@ -121,7 +154,6 @@ class BalanceOut(BaseModel):
     payment_status_name: Optional[str] = None  # 新增
     payout_status: Optional[int] = None
     payout_status_name: Optional[str] = None
-    schedule_date: Optional[str] = None
     schedule_status: Optional[int] = None
     schedule_status_name: Optional[str] = None
     created_at: Optional[str] = None
@@ -213,8 +245,6 @@ class PayeeDetailSummary(BaseModel):
 
 class PayeeBalanceDetailOut(BalanceOut):
     """收款人下的结余明细"""
-    weighbill_image: Optional[str] = None
-    weigh_date: Optional[str] = None
     weigh_vehicle_no: Optional[str] = None
     weigh_product_name: Optional[str] = None
     weigh_net_weight: Optional[float] = None
@@ -238,7 +268,7 @@ async def generate_balance(
         raise HTTPException(status_code=400, detail=result.get("error"))
 
 
-@router.get("/", summary="查询结余明细列表", response_model=dict)
+@router.get("/", summary="查询结余明细列表")
 async def list_balances(
         exact_contract_no: Optional[str] = Query(None, description="精确合同编号"),
         exact_driver_name: Optional[str] = Query(None, description="精确司机姓名"),
@@ -259,7 +289,7 @@ async def list_balances(
     )
 
 
-@router.get("/grouped", summary="查询打款分组列表", response_model=dict)
+@router.get("/grouped", summary="查询打款分组列表")
 async def list_balances_grouped(
         exact_contract_no: Optional[str] = Query(None, description="精确合同编号"),
         exact_driver_name: Optional[str] = Query(None, description="精确司机姓名"),
@@ -308,7 +338,7 @@ async def list_balances_grouped(
         raise HTTPException(status_code=400, detail=result.get("error"))
 
 
-@router.put("/{balance_id}/payment", summary="录入打款信息", response_model=dict)
+@router.put("/{balance_id}/payment", summary="录入打款信息")
 async def update_balance_payment(
         balance_id: int,
         paid_amount: float = Form(..., description="已打款金额"),
@@ -321,7 +351,7 @@ async def update_balance_payment(
     仅需上传已打款金额、打款日期和支付回单，收款人相关字段自动从结余明细匹配。
     """
     try:
-        if receipt_image.content_type not in ["image/jpeg", "image/jpg", "image/png", "image/bmp"]:
+        if await sniff_image_mime(receipt_image) not in _ALLOWED_RECEIPT_MIME:
             raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式的支付回单")
 
         balance = service.get_balance_detail(balance_id)
@@ -349,16 +379,17 @@ async def update_balance_payment(
         if not payee_name:
             raise HTTPException(status_code=400, detail="该结余明细未匹配到收款人，无法自动创建支付回单")
 
-        file_ext = Path(receipt_image.filename or "").suffix.lower() or ".jpg"
-        safe_payee = re.sub(r'[^\w\-]', '_', payee_name)
-        filename = f"receipt_{safe_payee}_{payout_date}_{os.urandom(4).hex()[:8]}{file_ext}"
+        file_ext = os.path.splitext(receipt_image.filename or "")[1].lower() or ".jpg"
+        safe_payee = _SAFE_PAYEE_RE.sub('_', payee_name)
+        filename = f"receipt_{safe_payee}_{payout_date}_{unique_name_suffix()}{file_ext}"
         file_path = UPLOAD_DIR / filename
-        file_path.parent.mkdir(parents=True, exist_ok=True)
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(receipt_image.file, buffer)
+        image_hash = await save_upload_file(receipt_image, file_path)
 
-        receipt_result = service.recognize_payment_receipt(str(file_path))
+        receipt_result = service.get_cached_receipt_ocr(image_hash)
+        if receipt_result is None:
+            receipt_result = await run_ocr_limited(service.recognize_payment_receipt, str(file_path))
+            service.cache_receipt_ocr(image_hash, receipt_result)
         receipt_data = receipt_result.get("data", {}) if isinstance(receipt_result, dict) else {}
         payment_receipt_data = {
             "receipt_no": receipt_data.get("receipt_no"),
@@ -377,7 +408,9 @@ async def update_balance_payment(
             "raw_text": receipt_data.get("raw_text"),
         }
 
-        created_receipt = service.create_payment_receipt(payment_receipt_data, str(file_path), is_manual=True)
+        created_receipt = service.create_payment_receipt(
+            payment_receipt_data, [str(file_path)], is_manual=True, image_hash=image_hash
+        )
         if not created_receipt.get("success"):
             if file_path.exists():
                 os.remove(file_path)
@@ -436,7 +469,7 @@ async def update_balance_payment(
                 "payout_status": payout_status,
                 "payout_status_name": "已打款" if payout_status == 1 else "待打款",
                 "payment_status": payment_status,
-                "payment_status_name": {0: "待支付", 1: "部分支付", 2: "已结清"}.get(payment_status, "未知"),
+                "payment_status_name": _PAYMENT_STATUS_MAP.get(payment_status, "未知"),
                 "receipt_id": receipt_id,
                 "receipt_image": str(file_path),
                 "settled_amount": float(settle_amount),
@@ -449,6 +482,21 @@ async def update_balance_payment(
         raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
 
 
+async def _ocr_one(file: UploadFile, service: BalanceService) -> Dict:
+    """
+    在内存中识别单张回单（小图先免预处理识别），返回 service.recognize_payment_receipt 的结果。
+    不落盘临时文件：上传字节直接解码交给 OCR；同一图片（按 SHA-256）命中缓存时跳过识别。
+    """
+    data = await file.read()
+    image_hash = hashlib.sha256(data).hexdigest()
+    cached = service.get_cached_receipt_ocr(image_hash)
+    if cached is not None:
+        return cached
+    result = await run_ocr_limited(service.recognize_payment_receipt_bytes, data)
+    service.cache_receipt_ocr(image_hash, result)
+    return result
+
+
 @router.post("/payment-receipts/ocr", summary="OCR 识别支付回单", response_model=PaymentReceiptOCRResponse)
 async def ocr_payment_receipt(
         file: UploadFile = File(..., description="支付回单图片"),
@@ -457,23 +505,11 @@ async def ocr_payment_receipt(
     """
     OCR识别支付回单
     """
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
-    if file.content_type not in allowed_types:
+    if await sniff_image_mime(file) not in _ALLOWED_RECEIPT_MIME:
         raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式")
 
-    temp_path = Path("uploads/temp") / f"receipt_{os.urandom(4).hex()}.jpg"
-    temp_path.parent.mkdir(parents=True, exist_ok=True)
-
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        processed_path = service.preprocess_image(str(temp_path))
-        result = service.recognize_payment_receipt(processed_path)
-
-        if processed_path != str(temp_path) and os.path.exists(processed_path):
-            os.remove(processed_path)
-        os.remove(temp_path)
+        result = await _ocr_one(file, service)
 
         if not result["success"]:
             raise HTTPException(status_code=400, detail=result.get("error"))
@@ -483,12 +519,50 @@ async def ocr_payment_receipt(
     except HTTPException:
         raise
     except Exception as e:
-        if temp_path.exists():
-            os.remove(temp_path)
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
 
-@router.post("/payment-receipts", summary="保存支付回单", response_model=dict)
+@router.post("/payment-receipts/ocr/batch", summary="批量 OCR 识别支付回单", response_model=List[PaymentReceiptOCRBatchItem])
+async def ocr_payment_receipts_batch(
+        files: List[UploadFile] = File(..., description="支付回单图片，最多20张"),
+        service: BalanceService = Depends(get_balance_service)
+):
+    """
+    批量OCR识别支付回单
+    各图片并发识别（受 OCR 并发上限约束），单张失败不影响其它图片，按上传顺序返回。
+    """
+    if len(files) == 0:
+        raise HTTPException(status_code=400, detail="至少上传一张回单图片")
+    if len(files) > 20:
+        raise HTTPException(status_code=400, detail="最多上传20张回单图片")
+
+    for file in files:
+        if await sniff_image_mime(file) not in _ALLOWED_RECEIPT_MIME:
+            raise HTTPException(status_code=400, detail=f"文件 {file.filename} 格式不支持，仅支持jpg/png/bmp")
+
+    results = await asyncio.gather(
+        *[_ocr_one(f, service) for f in files], return_exceptions=True
+    )
+
+    items = []
+    for idx, (file, result) in enumerate(zip(files, results)):
+        if isinstance(result, Exception):
+            items.append(PaymentReceiptOCRBatchItem(
+                index=idx, filename=file.filename, success=False, error=f"处理失败: {str(result)}"
+            ))
+        elif not result["success"]:
+            items.append(PaymentReceiptOCRBatchItem(
+                index=idx, filename=file.filename, success=False, error=result.get("error")
+            ))
+        else:
+            items.append(PaymentReceiptOCRBatchItem(
+                index=idx, filename=file.filename, success=True,
+                data=PaymentReceiptOCRResponse(**result["data"]),
+            ))
+    return items
+
+
+@router.post("/payment-receipts", summary="保存支付回单")
 async def create_payment_receipt(
         request: Optional[str] = Form(None, description="回单数据JSON字符串（与request_json二选一）"),
         request_json: Optional[str] = Form(None, description="回单数据JSON字符串（与request二选一）"),
@@ -508,15 +582,13 @@ async def create_payment_receipt(
         if not json_str:
             raise HTTPException(status_code=422, detail="缺少回单数据，请提供 request 或 request_json")
 
+        # 解析 + 验证一步完成（pydantic-core 直接解析 JSON，不经中间 dict）
         try:
-            data_dict = json.loads(json_str)
-        except json.JSONDecodeError as exc:
-            raise HTTPException(status_code=400, detail=f"JSON解析失败: {exc.msg}")
-
-        # 验证数据模型
-        try:
-            create_request = PaymentReceiptCreateRequest(**data_dict)
+            create_request = PaymentReceiptCreateRequest.model_validate_json(json_str)
         except ValidationError as exc:
+            errors = exc.errors()
+            if any(err.get("type") == "json_invalid" for err in errors):
+                raise HTTPException(status_code=400, detail=f"JSON解析失败: {errors[0].get('msg')}")
             raise HTTPException(status_code=422, detail=exc.errors())
 
         # 检查文件数量
@@ -526,27 +598,36 @@ async def create_payment_receipt(
             raise HTTPException(status_code=400, detail="最多上传6张回单图片")
 
         # 验证文件类型
-        allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
         for file in files:
-            if file.content_type not in allowed_types:
+            if await sniff_image_mime(file) not in _ALLOWED_RECEIPT_MIME:
                 raise HTTPException(status_code=400, detail=f"文件 {file.filename} 格式不支持，仅支持jpg/png/bmp")
 
-        data = create_request.dict()
+        data = create_request.model_dump(exclude_unset=True, exclude_none=True)
 
         # 保存所有图片
+        safe_payee = _SAFE_PAYEE_RE.sub('_', create_request.payee_name)
+        image_hashes = []
         for idx, file in enumerate(files):
-            file_ext = Path(file.filename).suffix.lower() or ".jpg"
-            safe_payee = re.sub(r'[^\w\-]', '_', create_request.payee_name)
-            filename = f"receipt_{safe_payee}_{create_request.payment_date}_{idx}_{os.urandom(4).hex()[:8]}{file_ext}"
+            file_ext = os.path.splitext(file.filename or "")[1].lower() or ".jpg"
+            filename = f"receipt_{safe_payee}_{create_request.payment_date}_{idx}_{unique_name_suffix()}{file_ext}"
             file_path = UPLOAD_DIR / filename
-            file_path.parent.mkdir(parents=True, exist_ok=True)
 
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
             saved_paths.append(str(file_path))
+            image_hashes.append(await save_upload_file(file, file_path))
+
+        # 所有图片都与已有回单完全相同：视为重复提交，直接返回已有记录
+        existing = await asyncio.to_thread(service.find_payment_receipt_by_image_hashes, image_hashes)
+        if existing:
+            await remove_files(*saved_paths)
+            return {
+                "success": True,
+                "message": "该回单图片已上传过，返回已有记录",
+                "duplicate": True,
+                "data": existing,
+            }
 
         # 调用服务创建记录
-        result = service.create_payment_receipt(data, saved_paths, is_manual)
+        result = service.create_payment_receipt(data, saved_paths, is_manual, image_hash=image_hashes[0])
 
         if result["success"]:
             return result
@@ -586,7 +667,7 @@ async def match_pending(
     }
 
 
-@router.post("/verify-payment", summary="核销支付回单", response_model=dict)
+@router.post("/verify-payment", summary="核销支付回单")
 async def verify_payment(
         receipt_id: int = Form(..., description="支付回单ID"),
         items: List[SettlementItem] = Body(..., description="核销明细列表"),
@@ -604,9 +685,10 @@ async def verify_payment(
         ]
     }
     """
-    balance_items = [{"balance_id": item.balance_id, "amount": item.amount} for item in items]
+    # SettlementItem 字段与 service 所需的键一致，直接由 pydantic-core 导出
+    balance_items = [item.model_dump() for item in items]
 
-    result = service.verify_payment(receipt_id, balance_items)
+    result = await asyncio.to_thread(service.verify_payment, receipt_id, balance_items)
     if result["success"]:
         return result
     else:
@@ -629,6 +711,7 @@ async def verify_payment(
     },
 )
 async def get_payment_receipt_image(
+        request: Request,
         receipt_id: int,
         index: int = Query(0, ge=0, description="图片索引，从0开始"),
         service: BalanceService = Depends(get_balance_service)
@@ -659,29 +742,18 @@ async def get_payment_receipt_image(
         )
 
     image_path = image_paths[index]
-    full_path = _resolve_payment_receipt_image_path(image_path)
-    if not full_path or not full_path.exists():
+    full_path = await asyncio.to_thread(_resolve_payment_receipt_image_path, image_path)
+    if not full_path:
         raise HTTPException(status_code=404, detail="图片文件不存在")
 
-    # 自动识别 MIME 类型
-    mime_type, _ = mimetypes.guess_type(str(full_path))
-    if not mime_type:
-        mime_type = "image/jpeg"
+    mime_type = _IMAGE_MIME.get(os.path.splitext(full_path)[1].lower(), "image/jpeg")
 
-    # 对中文文件名进行 RFC 5987/RFC 6266 编码
-    from urllib.parse import quote
-    filename = full_path.name
-    try:
-        filename.encode('ascii')
-        disposition = f'inline; filename="{filename}"'
-    except UnicodeEncodeError:
-        encoded_filename = quote(filename, safe='')
-        disposition = f"inline; filename*=UTF-8''{encoded_filename}"
-
-    return FileResponse(
-        path=str(full_path),
+    # 中文文件名由 FileResponse 按 RFC 5987/RFC 6266 编码
+    return await conditional_file_response(
+        request,
+        full_path,
         media_type=mime_type,
-        headers={"Content-Disposition": disposition}
+        filename=os.path.basename(full_path),
     )
 
 @router.get("/payment-receipts/{receipt_id}", summary="查看支付回单详情")
@@ -695,8 +767,7 @@ async def get_payment_receipt(
         raise HTTPException(status_code=404, detail="支付回单不存在")
 
     # 转换状态
-    status_map = {0: "待确认", 1: "已确认", 2: "已核销"}
-    receipt['ocr_status_label'] = status_map.get(receipt.get('ocr_status'), "未知")
+    receipt['ocr_status_label'] = _OCR_STATUS_MAP.get(receipt.get('ocr_status'), "未知")
 
     return receipt
 
@@ -737,7 +808,7 @@ async def list_payment_receipts(
         raise HTTPException(status_code=500, detail=result.get("error"))
 
 
-@router.get("/summary/by-payee", summary="按收款人汇总结余", response_model=dict)
+@router.get("/summary/by-payee", summary="按收款人汇总结余")
 async def list_balance_by_payee(
     payee_name: Optional[str] = Query(None, description="精确收款人姓名"),
     driver_phone: Optional[str] = Query(None, description="精确司机电话"),
@@ -792,7 +863,7 @@ async def list_balance_by_payee(
         raise HTTPException(status_code=400, detail=result.get("error"))
 
 
-@router.get("/summary/by-shipper", summary="按报单人汇总结余", response_model=dict)
+@router.get("/summary/by-shipper", summary="按报单人汇总结余")
 async def list_balance_by_reporter(
     reporter_name: Optional[str] = Query(None, description="精确报单人/发货人"),
     fuzzy_keywords: Optional[str] = Query(None, description="模糊关键词（姓名/电话/车牌/合同号）"),
@@ -827,7 +898,7 @@ async def list_balance_by_reporter(
         raise HTTPException(status_code=400, detail=result.get("error"))
 
 
-@router.get("/summary/by-payee/{payee_name}/details", summary="查看收款人结余明细", response_model=dict)
+@router.get("/summary/by-payee/{payee_name}/details", summary="查看收款人结余明细")
 async def get_payee_balance_details(
         payee_name: str,
         driver_phone: Optional[str] = Query(None, description="司机电话（精确匹配）"),
@@ -855,7 +926,7 @@ async def get_payee_balance_details(
         raise HTTPException(status_code=404, detail=result.get("error"))
 
 
-@router.post("/summary/by-payee/{payee_name}/batch-verify", summary="按收款人批量核销", response_model=dict)
+@router.post("/summary/by-payee/{payee_name}/batch-verify", summary="按收款人批量核销")
 async def batch_verify_by_payee(
         payee_name: str,
         receipt_id: int = Form(..., description="支付回单ID"),
@@ -882,7 +953,7 @@ async def batch_verify_by_payee(
         raise HTTPException(status_code=400, detail=result.get("error"))
 
 
-@router.get("/summary/by-shipper/{reporter_name}/details", summary="查看报单人结余明细", response_model=dict)
+@router.get("/summary/by-shipper/{reporter_name}/details", summary="查看报单人结余明细")
 async def get_reporter_balance_details(
         reporter_name: str,
         payment_status: Optional[int] = Query(None, description="0=待支付, 1=部分支付"),
@@ -917,7 +988,6 @@ async def get_balance(
         raise HTTPException(status_code=404, detail="结余明细不存在")
 
     # 转换状态为可读字符串
-    status_map = {0: "待支付", 1: "部分支付", 2: "已结清"}
-    balance['payment_status_label'] = status_map.get(balance.get('payment_status'), "未知")
+    balance['payment_status_label'] = _PAYMENT_STATUS_MAP.get(balance.get('payment_status'), "未知")
 
     return balance
\ No newline at end of file
@@ -2,27 +2,50 @@
 合同管理路由 - 完整版
 支持OCR识别、手动录入、查看、编辑、导出
 """
+import asyncio
+import codecs
 import csv
 import os
 import re
-import shutil
-import json
 from io import StringIO
+from itertools import islice
 from decimal import Decimal
-from typing import List, Optional
+from functools import lru_cache
+from typing import List, Optional, Type, TypeVar
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Body, Form
-from fastapi.responses import StreamingResponse, FileResponse
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, HTTPException, Depends, Query, Body, Form, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from datetime import date
 
-from app.core.paths import UPLOADS_DIR
+from app.core.paths import CONTRACT_UPLOADS_DIR
 from app.services.contract_service import ContractService, get_contract_service
+from app.utils.file_responses import conditional_file_response
+from app.utils.ocr_pool import run_ocr, run_ocr_limited
+from app.utils.uploads import UploadGuard, remove_files, save_upload_file, sniff_image_mime, unique_name_suffix
 
 router = APIRouter(prefix="/contracts", tags=["合同管理"])
 
-UPLOAD_DIR = UPLOADS_DIR / "contracts"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+UPLOAD_DIR = CONTRACT_UPLOADS_DIR
+
+# 合同图片允许的类型（按文件头魔数判定）/ 文件名安全化正则（模块级常量，避免每次请求重建）
+_ALLOWED_IMAGE_TYPES = frozenset({"image/jpeg", "image/png", "image/bmp"})
+_SAFE_NAME_RE = re.compile(r"[^\w\-]")
+_SAFE_EXPORT_NAME_RE = re.compile(r"[^A-Za-z0-9_-]")
+
+# 流式导出时每批写出的行数
+_EXPORT_BATCH_ROWS = 500
+
+
+def _contract_image_path(contract_no: str) -> str:
+    """合同图片保存路径（按合同编号生成安全文件名，同名覆盖）"""
+    return str(UPLOAD_DIR / f"{_SAFE_NAME_RE.sub('_', contract_no)}.jpg")
+
+
+@lru_cache(maxsize=4096, typed=True)
+def _dec(value) -> Decimal:
+    """数值转 Decimal（经 str 保留十进制表示）；重复的单价、比例直接命中缓存"""
+    return Decimal(str(value))
 
 
 # ============ 请求/响应模型 ============
@@ -61,6 +84,14 @@ class ContractOCRResponse(BaseModel):
     image_filename: Optional[str] = None
     raw_text: Optional[str] = None
 
+class ContractOCRBatchItem(BaseModel):
+    """批量OCR单张结果"""
+    index: int
+    filename: Optional[str] = None
+    success: bool
+    error: Optional[str] = None
+    data: Optional[ContractOCRResponse] = None
+
 class ContractCreateRequest(BaseModel):
     contract_no: str
     plan_no: str = Field(
@@ -122,6 +153,31 @@ class ContractOut(BaseModel):
 
 # ============ 路由 ============
 
+def _products_payload(products: List[ProductItem]) -> List[dict]:
+    """请求中的品种列表 -> service 所需的品种明细"""
+    return [
+        {
+            "product_name": p.product_name,
+            "unit_price": _dec(p.unit_price) if p.unit_price else None,
+        }
+        for p in products
+    ]
+
+
+_RequestModel = TypeVar("_RequestModel", ContractCreateRequest, ContractUpdateRequest)
+
+
+def _parse_contract_json(model: Type[_RequestModel], raw: str) -> _RequestModel:
+    """解析 + 验证表单中的合同 JSON（pydantic-core 直接解析，不经中间 dict）"""
+    try:
+        return model.model_validate_json(raw)
+    except ValidationError as exc:
+        errors = exc.errors()
+        if any(err.get("type") == "json_invalid" for err in errors):
+            raise HTTPException(status_code=400, detail=f"JSON解析失败: {errors[0].get('msg')}")
+        raise HTTPException(status_code=400, detail=f"参数格式错误: {str(exc)}")
+
+
 @router.post("/ocr", summary="OCR 识别合同", response_model=ContractOCRResponse)
 async def ocr_recognize(
     file: UploadFile = File(..., description="合同图片"),
@@ -134,21 +190,14 @@ async def ocr_recognize(
     service: ContractService = Depends(get_contract_service),
 ):
     """OCR识别合同 - 支持不完整识别，用户后续补充"""
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
-    if file.content_type not in allowed_types:
+    if await sniff_image_mime(file) not in _ALLOWED_IMAGE_TYPES:
         raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式")
 
-    temp_path = UPLOAD_DIR / f"temp_{os.urandom(4).hex()}.jpg"
-
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        processed_path = service.preprocess_image(str(temp_path))
-        result = service.recognize_contract(processed_path)
-
-        if processed_path != str(temp_path) and os.path.exists(processed_path):
-            os.remove(processed_path)
+        # 上传字节直接在内存中预处理并识别，不落盘临时文件
+        content = await file.read()
+        image = await run_ocr(service.preprocess_image_bytes, content)
+        result = await run_ocr_limited(service.recognize_contract, image)
 
         data = result["data"]
         contract_no = data.get("contract_no")
@@ -159,22 +208,18 @@ async def ocr_recognize(
         image_filename = None
 
         if save_image and contract_no:
-            safe_name = re.sub(r'[^\w\-]', '_', contract_no)
+            safe_name = _SAFE_NAME_RE.sub('_', contract_no)
             image_filename = f"{safe_name}.jpg"
             final_path = UPLOAD_DIR / image_filename
 
-            if final_path.exists():
-                os.remove(final_path)
-
-            os.rename(temp_path, final_path)
+            # 仅在需要保存图片时落盘
+            await asyncio.to_thread(final_path.write_bytes, content)
             image_saved = True
             image_path = str(final_path)
-        else:
-            os.remove(temp_path)
 
         # 自动保存逻辑
         if auto_save and contract_no:
-            existing = service.get_contract_detail_by_no(contract_no)
+            existing = await asyncio.to_thread(service.get_contract_detail_by_no, contract_no)
             if existing:
                 data["saved_to_db"] = False
                 data["db_message"] = f"合同 {contract_no} 已存在"
@@ -191,20 +236,21 @@ async def ocr_recognize(
                     "contract_date": data.get("contract_date"),
                     "end_date": data.get("end_date"),
                     "smelter_company": data.get("smelter_company"),
-                    "total_quantity": Decimal(str(data["total_quantity"])) if data.get("total_quantity") else None,
-                    "arrival_payment_ratio": Decimal(str(data["arrival_payment_ratio"])),
-                    "final_payment_ratio": Decimal(str(data["final_payment_ratio"])),
+                    "total_quantity": _dec(data["total_quantity"]) if data.get("total_quantity") else None,
+                    "arrival_payment_ratio": _dec(data["arrival_payment_ratio"]),
+                    "final_payment_ratio": _dec(data["final_payment_ratio"]),
                     "contract_image_path": image_path,
                 }
 
-                products_data = []
-                for p in data.get("products", []):
-                    products_data.append({
+                products_data = [
+                    {
                         "product_name": p["product_name"],
-                        "unit_price": Decimal(str(p["unit_price"])) if p.get("unit_price") else None,
-                    })
+                        "unit_price": _dec(p["unit_price"]) if p.get("unit_price") else None,
+                    }
+                    for p in data.get("products", [])
+                ]
 
-                result_db = service.create_contract(save_data, products_data)
+                result_db = await asyncio.to_thread(service.create_contract, save_data, products_data)
 
                 if result_db["success"]:
                     data["saved_to_db"] = True
@@ -232,15 +278,54 @@ async def ocr_recognize(
         return ContractOCRResponse(**data)
 
     except HTTPException:
-        if temp_path.exists():
-            os.remove(temp_path)
         raise
     except Exception as e:
-        if temp_path.exists():
-            os.remove(temp_path)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _ocr_contract_one(file: UploadFile, service: ContractService) -> dict:
+    """在内存中预处理并识别单张合同图片，返回 service.recognize_contract 的结果"""
+    content = await file.read()
+    image = await run_ocr(service.preprocess_image_bytes, content)
+    return await run_ocr_limited(service.recognize_contract, image)
+
+
+@router.post("/ocr/batch", summary="批量 OCR 识别合同", response_model=List[ContractOCRBatchItem])
+async def ocr_recognize_batch(
+    files: List[UploadFile] = File(..., description="合同图片，最多20张"),
+    service: ContractService = Depends(get_contract_service),
+):
+    """
+    批量OCR识别合同（仅识别，不保存图片、不写库）
+    各图片并发识别（受 OCR 并发上限约束），单张失败不影响其它图片，按上传顺序返回。
+    """
+    if len(files) == 0:
+        raise HTTPException(status_code=400, detail="至少上传一张合同图片")
+    if len(files) > 20:
+        raise HTTPException(status_code=400, detail="最多上传20张合同图片")
+
+    for file in files:
+        if await sniff_image_mime(file) not in _ALLOWED_IMAGE_TYPES:
+            raise HTTPException(status_code=400, detail=f"文件 {file.filename} 格式不支持，仅支持jpg/png/bmp")
+
+    results = await asyncio.gather(
+        *[_ocr_contract_one(f, service) for f in files], return_exceptions=True
+    )
+
+    items = []
+    for idx, (file, result) in enumerate(zip(files, results)):
+        if isinstance(result, Exception):
+            items.append(ContractOCRBatchItem(
+                index=idx, filename=file.filename, success=False, error=f"处理失败: {str(result)}"
+            ))
+        else:
+            items.append(ContractOCRBatchItem(
+                index=idx, filename=file.filename, success=True,
+                data=ContractOCRResponse(**result["data"]),
+            ))
+    return items
+
+
 @router.post("/manual", summary="手动录入合同", response_model=ContractOut)
 async def create_manual(
     contract_data: str = Form(..., description="合同数据JSON字符串"),
@@ -265,85 +350,56 @@ async def create_manual(
         "remarks": "备注信息"
     }
     """
-    try:
-        # 解析JSON数据
-        request_data = json.loads(contract_data)
-        request = ContractCreateRequest(**request_data)
-    except json.JSONDecodeError as e:
-        raise HTTPException(status_code=400, detail=f"JSON解析失败: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"参数格式错误: {str(e)}")
+    # 解析JSON数据
+    request = _parse_contract_json(ContractCreateRequest, contract_data)
+
+    # 先按文件头校验图片，格式不符时不再查库
+    if file and await sniff_image_mime(file) not in _ALLOWED_IMAGE_TYPES:
+        raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式")
 
     # 检查合同编号是否已存在
     existing = service.get_contract_detail_by_no(request.contract_no)
     if existing:
         raise HTTPException(status_code=400, detail=f"合同编号 {request.contract_no} 已存在")
 
-    # 处理图片上传
+    # 处理图片上传：生成安全文件名（同名文件直接覆盖）
     image_path = None
     if file:
-        allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
-        if file.content_type not in allowed_types:
-            raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式")
-
-        # 生成安全文件名
-        safe_name = re.sub(r'[^\w\-]', '_', request.contract_no)
-        image_filename = f"{safe_name}.jpg"
-        image_path = UPLOAD_DIR / image_filename
-
-        # 如果文件已存在，先删除
-        if image_path.exists():
-            os.remove(image_path)
-
-        # 保存图片
-        with open(image_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        image_path = str(image_path)
+        image_path = _contract_image_path(request.contract_no)
 
     try:
-        data = {
-            "contract_no": request.contract_no,
-            "plan_no": request.plan_no,
-            "contract_date": request.contract_date,
-            "end_date": request.end_date,
-            "smelter_company": request.smelter_company,
-            "total_quantity": Decimal(str(request.total_quantity)) if request.total_quantity else None,
-            "prepayment_ratio": Decimal(str(request.prepayment_ratio)) if request.prepayment_ratio else Decimal("0"),
-            "arrival_payment_ratio": Decimal(str(request.arrival_payment_ratio)),
-            "final_payment_ratio": Decimal(str(request.final_payment_ratio)),
-            "status": request.status,
-            "remarks": request.remarks,
-            "contract_image_path": image_path,
-        }
-
-        products = []
-        for p in request.products:
-            products.append({
-                "product_name": p.product_name,
-                "unit_price": Decimal(str(p.unit_price)) if p.unit_price else None,
-            })
-
-        result = service.create_contract(data, products)
-
-        if result["success"]:
-            detail = service.get_contract_detail(result["data"]["id"])
-            return detail
-        else:
-            # 如果创建失败，删除已上传的图片
-            if image_path and os.path.exists(image_path):
-                os.remove(image_path)
-            raise HTTPException(status_code=400, detail=result.get("error"))
+        # 创建失败（含异常）时自动删除已上传的图片
+        with UploadGuard(image_path) as guard:
+            if file:
+                await save_upload_file(file, image_path, compute_hash=False)
+
+            data = {
+                "contract_no": request.contract_no,
+                "plan_no": request.plan_no,
+                "contract_date": request.contract_date,
+                "end_date": request.end_date,
+                "smelter_company": request.smelter_company,
+                "total_quantity": _dec(request.total_quantity) if request.total_quantity else None,
+                "prepayment_ratio": _dec(request.prepayment_ratio) if request.prepayment_ratio else Decimal("0"),
+                "arrival_payment_ratio": _dec(request.arrival_payment_ratio),
+                "final_payment_ratio": _dec(request.final_payment_ratio),
+                "status": request.status,
+                "remarks": request.remarks,
+                "contract_image_path": image_path,
+            }
+
+            products = _products_payload(request.products)
+
+            result = await asyncio.to_thread(service.create_contract, data, products)
+            if not result["success"]:
+                raise HTTPException(status_code=400, detail=result.get("error"))
+            guard.commit()
+
+        return service.get_contract_detail(result["data"]["id"])
 
     except HTTPException:
-        # 如果创建失败，删除已上传的图片
-        if image_path and os.path.exists(image_path):
-            os.remove(image_path)
         raise
     except Exception as e:
-        # 如果创建失败，删除已上传的图片
-        if image_path and os.path.exists(image_path):
-            os.remove(image_path)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -387,6 +443,7 @@ async def get_contract(
 @router.put("/id/{contract_id:int}", summary="编辑合同", response_model=dict)
 async def update_contract(
     contract_id: int,
+    background: BackgroundTasks,
     contract_data: Optional[str] = Form(None, description="合同数据JSON字符串"),
     file: Optional[UploadFile] = File(None, description="新的合同图片（可选）"),
     service: ContractService = Depends(get_contract_service)
@@ -412,122 +469,104 @@ async def update_contract(
     # 解析JSON数据（如果提供）
     request = None
     if contract_data:
-        try:
-            request_data = json.loads(contract_data)
-            request = ContractUpdateRequest(**request_data)
-        except json.JSONDecodeError as e:
-            raise HTTPException(status_code=400, detail=f"JSON解析失败: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"参数格式错误: {str(e)}")
-
-    # 获取原合同信息
-    old_contract = service.get_contract_detail(contract_id)
-    if not old_contract:
-        raise HTTPException(status_code=404, detail="合同不存在")
-
-    # 处理图片上传
-    new_image_path = None
-    old_image_path = old_contract.get("contract_image_path")
-
-    if file:
-        allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
-        if file.content_type not in allowed_types:
-            raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式")
+        request = _parse_contract_json(ContractUpdateRequest, contract_data)
 
-        # 确定合同编号（可能变更）
-        contract_no = request.contract_no if request and request.contract_no else old_contract["contract_no"]
-
-        # 生成安全文件名
-        safe_name = re.sub(r'[^\w\-]', '_', contract_no)
-        image_filename = f"{safe_name}.jpg"
-        new_image_path = UPLOAD_DIR / image_filename
-
-        # 如果新路径与旧路径不同且旧文件存在，先删除旧文件
-        if old_image_path and str(new_image_path) != old_image_path and os.path.exists(old_image_path):
-            os.remove(old_image_path)
-
-        # 如果新文件已存在（可能是其他合同的文件），先删除
-        if new_image_path.exists():
-            os.remove(new_image_path)
-
-        # 保存新图片
-        with open(new_image_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    if file and await sniff_image_mime(file) not in _ALLOWED_IMAGE_TYPES:
+        raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式")
 
-        new_image_path = str(new_image_path)
+    # 新图片先写到唯一的临时文件名（可与原合同查询并行写盘），更新成功后再改名为正式文件名：
+    # 正式文件名按合同编号生成，可能属于其它合同，不能在确认合同存在、更新成功前覆盖
+    temp_image_path = str(UPLOAD_DIR / f"tmp_{unique_name_suffix()}.jpg") if file else None
+    new_image_path = None
 
     try:
-        # 构建更新数据
-        data = {}
-        if request:
-            if request.contract_no is not None:
-                data["contract_no"] = request.contract_no
-            if request.contract_date is not None:
-                data["contract_date"] = request.contract_date
-            if request.end_date is not None:
-                data["end_date"] = request.end_date
-            if request.smelter_company is not None:
-                data["smelter_company"] = request.smelter_company
-            if request.total_quantity is not None:
-                data["total_quantity"] = Decimal(str(request.total_quantity))
-            if request.prepayment_ratio is not None:
-                data["prepayment_ratio"] = Decimal(str(request.prepayment_ratio))
-            if request.arrival_payment_ratio is not None:
-                data["arrival_payment_ratio"] = Decimal(str(request.arrival_payment_ratio))
-            if request.final_payment_ratio is not None:
-                data["final_payment_ratio"] = Decimal(str(request.final_payment_ratio))
-            if request.status is not None:
-                data["status"] = request.status
-            if request.remarks is not None:
-                data["remarks"] = request.remarks
-            patch = request.model_dump(exclude_unset=True)
-            if "plan_no" in patch:
-                data["plan_no"] = patch["plan_no"]
-
-        # 如果有新图片，添加到更新数据
-        if new_image_path:
-            data["contract_image_path"] = new_image_path
-
-        # 处理品种明细
-        products = None
-        if request and request.products is not None:
-            products = []
-            for p in request.products:
-                products.append({
-                    "product_name": p.product_name,
-                    "unit_price": Decimal(str(p.unit_price)) if p.unit_price else None,
-                })
-
-        result = service.update_contract(contract_id, data, products)
-
-        if result["success"]:
-            return {"success": True, "message": "更新成功", "data": result.get("data")}
-        else:
-            # 如果更新失败且上传了新图片，删除新图片
-            if new_image_path and os.path.exists(new_image_path):
-                os.remove(new_image_path)
-            raise HTTPException(status_code=400, detail=result.get("error"))
+        # 更新失败（含异常、合同不存在）时自动删除临时图片
+        with UploadGuard(temp_image_path) as guard:
+            if temp_image_path:
+                results = await asyncio.gather(
+                    asyncio.to_thread(service.get_contract_detail, contract_id),
+                    save_upload_file(file, temp_image_path, compute_hash=False),
+                    return_exceptions=True,
+                )
+                for item in results:
+                    if isinstance(item, BaseException):
+                        raise item
+                old_contract = results[0]
+            else:
+                old_contract = await asyncio.to_thread(service.get_contract_detail, contract_id)
+
+            if not old_contract:
+                raise HTTPException(status_code=404, detail="合同不存在")
+
+            if temp_image_path:
+                final_contract_no = (request.contract_no if request else None) or old_contract["contract_no"]
+                new_image_path = _contract_image_path(final_contract_no)
+
+            # 构建更新数据
+            data = {}
+            if request:
+                if request.contract_no is not None:
+                    data["contract_no"] = request.contract_no
+                if request.contract_date is not None:
+                    data["contract_date"] = request.contract_date
+                if request.end_date is not None:
+                    data["end_date"] = request.end_date
+                if request.smelter_company is not None:
+                    data["smelter_company"] = request.smelter_company
+                if request.total_quantity is not None:
+                    data["total_quantity"] = _dec(request.total_quantity)
+                if request.prepayment_ratio is not None:
+                    data["prepayment_ratio"] = _dec(request.prepayment_ratio)
+                if request.arrival_payment_ratio is not None:
+                    data["arrival_payment_ratio"] = _dec(request.arrival_payment_ratio)
+                if request.final_payment_ratio is not None:
+                    data["final_payment_ratio"] = _dec(request.final_payment_ratio)
+                if request.status is not None:
+                    data["status"] = request.status
+                if request.remarks is not None:
+                    data["remarks"] = request.remarks
+                patch = request.model_dump(exclude_unset=True)
+                if "plan_no" in patch:
+                    data["plan_no"] = patch["plan_no"]
+
+            # 如果有新图片，添加到更新数据
+            if new_image_path:
+                data["contract_image_path"] = new_image_path
+
+            # 处理品种明细
+            products = None
+            if request and request.products is not None:
+                products = _products_payload(request.products)
+
+            result = await asyncio.to_thread(service.update_contract, contract_id, data, products)
+            if not result["success"]:
+                raise HTTPException(status_code=400, detail=result.get("error"))
+            if temp_image_path:
+                await asyncio.to_thread(os.replace, temp_image_path, new_image_path)
+            guard.commit()
+
+        # 更新成功后再删除路径已变化的旧图片
+        old_image_path = old_contract.get("contract_image_path")
+        if new_image_path and old_image_path and old_image_path != new_image_path:
+            background.add_task(remove_files, old_image_path)
+
+        return {"success": True, "message": "更新成功", "data": result.get("data")}
 
     except HTTPException:
-        # 如果更新失败且上传了新图片，删除新图片
-        if new_image_path and os.path.exists(new_image_path):
-            os.remove(new_image_path)
         raise
     except Exception as e:
-        # 如果更新失败且上传了新图片，删除新图片
-        if new_image_path and os.path.exists(new_image_path):
-            os.remove(new_image_path)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/id/{contract_id:int}/image", summary="查看合同图片")
 async def get_contract_image(
         contract_id: int,
+        request: Request,
         service: ContractService = Depends(get_contract_service)
 ):
     """
     查看合同图片
-    直接返回图片文件
+    直接返回图片文件；支持 ETag / Last-Modified 条件请求，未变化时返回 304
     """
     try:
         contract = service.get_contract_detail(contract_id)
@@ -538,13 +577,12 @@ async def get_contract_image(
         if not image_path:
             raise HTTPException(status_code=404, detail="该合同没有上传图片")
 
-        if not os.path.exists(image_path):
-            raise HTTPException(status_code=404, detail="图片文件不存在")
-
-        return FileResponse(
-            path=image_path,
+        return await conditional_file_response(
+            request,
+            image_path,
             media_type="image/jpeg",
-            filename=f"contract_{contract.get('contract_no')}.jpg"
+            filename=f"contract_{contract.get('contract_no')}.jpg",
+            content_disposition_type="attachment",
         )
 
     except HTTPException:
@@ -556,54 +594,68 @@ async def get_contract_image(
 @router.delete("/id/{contract_id:int}", summary="删除合同")
 async def delete_contract(
     contract_id: int,
+    background: BackgroundTasks,
     service: ContractService = Depends(get_contract_service)
 ):
     """删除合同"""
     # 获取合同信息（用于删除图片）
-    contract = service.get_contract_detail(contract_id)
-    if contract:
-        image_path = contract.get("contract_image_path")
-        if image_path and os.path.exists(image_path):
-            os.remove(image_path)
+    contract = await asyncio.to_thread(service.get_contract_detail, contract_id)
 
-    result = service.delete_contract(contract_id)
-    if result["success"]:
-        return {"success": True, "message": "删除成功"}
-    else:
+    result = await asyncio.to_thread(service.delete_contract, contract_id)
+    if not result["success"]:
         raise HTTPException(status_code=400, detail=result.get("error"))
 
+    # 删除成功后在响应发出后删除图片（删除失败时保留图片）
+    if contract and contract.get("contract_image_path"):
+        background.add_task(remove_files, contract["contract_image_path"])
+    return {"success": True, "message": "删除成功"}
+
 
 @router.post("/export", summary="导出合同")
 async def export_contracts(
     contract_ids: List[int] = Body(None, description="要导出的合同ID列表，空则导出全部"),
     service: ContractService = Depends(get_contract_service)
 ):
-    """导出合同"""
-    data = service.export_contracts(contract_ids)
-    columns: List[str] = []
-    for row in data:
-        for key in row.keys():
-            if key not in columns:
-                columns.append(key)
-
-    buffer = StringIO()
-    writer = csv.writer(buffer)
-    if columns:
-        writer.writerow(columns)
-        for row in data:
-            writer.writerow([row.get(col) for col in columns])
+    """导出合同（流式输出 CSV，不在内存中拼接整个文件）"""
+    rows = service.iter_export_contracts(contract_ids)
+    # 先取列名和首行：首行用于单合同导出时确定文件名；查询失败在响应开始前返回 500。
+    # 之后读取出错则异常直接抛出、中止流式响应，客户端不会把截断的文件当成完整导出
+    try:
+        columns = await asyncio.to_thread(next, rows, None)
+        first_row = await asyncio.to_thread(next, rows, None) if columns is not None else None
+    except Exception:
+        raise HTTPException(status_code=500, detail="导出失败")
 
     filename = "contracts_export.csv"
-    if contract_ids and len(contract_ids) == 1 and data:
-        contract_no = str(data[0].get("contract_no") or "").strip()
+    if contract_ids and len(contract_ids) == 1 and first_row is not None:
+        contract_no = str(first_row[columns.index("contract_no")] or "").strip()
         if contract_no:
-            safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", contract_no)
+            safe_name = _SAFE_EXPORT_NAME_RE.sub("_", contract_no)
             filename = f"{safe_name}.csv"
 
-    csv_bytes = buffer.getvalue().encode("utf-8-sig")
+    def generate():
+        yield codecs.BOM_UTF8
+        if columns is None:
+            return
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        if first_row is not None:
+            writer.writerow(first_row)
+            # 行已是按列序排列的元组，整批交给 writerows（C 实现循环），每批输出一次
+            while True:
+                batch = list(islice(rows, _EXPORT_BATCH_ROWS))
+                if not batch:
+                    break
+                writer.writerows(batch)
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode("utf-8")
+
     headers = {"Content-Disposition": f"attachment; filename=\"{filename}\""}
     return StreamingResponse(
-        iter([csv_bytes]),
+        generate(),
         media_type="text/csv; charset=utf-8",
         headers=headers,
-    )
\ No newline at end of file
+    )
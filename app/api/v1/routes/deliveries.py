@@ -1,27 +1,45 @@
 """
 销售台账/报货订单路由
 """
+import asyncio
+import functools
 import json
 import os
 import re
-from typing import List, Dict,Optional, Any
+from typing import Annotated, Callable, List, Dict,Optional, Any, TypeVar
 import logging
+import anyio
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
-from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field
-from datetime import datetime
 import mimetypes
-from fastapi import Request, Response
-from fastapi import Body
-from urllib.parse import quote
-from fastapi import Query
+from fastapi import Request
+from app.core.config import settings
+from app.core.responses import ORJSONResponse
+from app.utils.file_responses import conditional_file_response
+from app.utils.uploads import sniff_image_mime, upload_stream
 from app.services.delivery_service import DeliveryService, get_delivery_service
 from core.auth import get_current_user
-from core.database import get_conn
 
-router = APIRouter(prefix="/deliveries", tags=["销售台账/报货订单"])
+router = APIRouter(prefix="/deliveries", tags=["销售台账/报货订单"], default_response_class=ORJSONResponse)
 logger = logging.getLogger(__name__)
 
+
+T = TypeVar("T")
+
+# 上传落盘（分块拷贝 + 写库）在线程池中执行，限制同时占用的线程数，
+# 避免大量并发上传挤占默认线程池、拖慢图片查看等其他接口
+_UPLOAD_LIMITER = anyio.CapacityLimiter(settings.upload_max_concurrency)
+
+# 批量上传联单图片允许的类型：按文件头判定（sniff_image_mime），不信任客户端声明的 Content-Type
+_ALLOWED_ORDER_IMAGE_TYPES = frozenset({"image/jpeg", "image/png", "image/bmp", "image/webp"})
+
+
+async def _run_upload(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """在受限线程池中执行带文件拷贝的同步服务调用"""
+    return await anyio.to_thread.run_sync(
+        functools.partial(func, *args, **kwargs), limiter=_UPLOAD_LIMITER
+    )
+
 # ============ 请求/响应模型 ============
 
 class DeliveryCreateRequest(BaseModel):
@@ -58,6 +76,54 @@ class DeliveryUpdateRequest(BaseModel):
     reporter_name: Optional[str] = None  # 新增
     contract_no: Optional[str] = None
 
+class DeliveryCreateJsonRequest(BaseModel):
+    """创建报货订单请求体（JSON 接口直接使用，表单接口作为 Form 模型使用）"""
+    report_date: str = Field(..., description="报货日期")
+    target_factory_id: Optional[int] = Field(None, description="目标工厂ID")
+    target_factory_name: str = Field(..., description="目标工厂名称")
+    product_name: str = Field(..., description="主品种")
+    products: Optional[str] = Field(None, description="品种列表，逗号分隔")
+    quantity: float = Field(..., description="数量（吨）")
+    vehicle_no: str = Field(..., description="车牌号")
+    driver_name: str = Field(..., description="司机姓名")
+    driver_phone: str = Field(..., description="司机电话")
+    driver_id_card: Optional[str] = Field(None, description="身份证号")
+    has_delivery_order: str = Field("无", description="是否有联单：有/无")
+    status: str = Field("待审核", description="审核状态：待审核/审核通过/审核未通过")
+    uploaded_by: Optional[str] = Field(None, description="上传者身份：司机/公司")
+    reporter_id: Optional[int] = Field(None, description="报单人ID")
+    reporter_name: Optional[str] = Field(None, description="报单人姓名")
+    position: Optional[str] = Field(None, description="岗位")
+    confirm_flag: bool = Field(False, description="二次确认标志")
+
+
+class DeliveryCreateForm(DeliveryCreateJsonRequest):
+    """表单方式创建报货订单（multipart，字段同 JSON 请求体，另含图片）"""
+    delivery_order_image: Optional[UploadFile] = Field(None, description="有联单时上传的联单图片")
+    voucher_images: List[UploadFile] = Field(default_factory=list, description="无联单时上传的凭证图片（最多6张）")
+
+
+class DeliveryListFilters(BaseModel):
+    """报货订单列表查询参数（作为 Query 模型整体解析）"""
+    exact_delivery_id: Optional[int] = Field(None, description="精确报单ID")
+    exact_shipper: Optional[str] = Field(None, description="精确发货人/报单人")
+    exact_contract_no: Optional[str] = Field(None, description="精确合同编号")
+    exact_report_date: Optional[str] = Field(None, description="精确报单日期")
+    exact_driver_name: Optional[str] = Field(None, description="精确司机姓名")
+    exact_vehicle_no: Optional[str] = Field(None, description="精确车号")
+    exact_has_delivery_order: Optional[str] = Field(None, description="是否自带联单：有/无")
+    exact_upload_status: Optional[str] = Field(None, description="是否上传联单：已上传/未上传")
+    exact_reporter_name: Optional[str] = Field(None, description="精确报单人姓名")
+    exact_reporter_id: Optional[int] = Field(None, description="精确报单人ID")
+    exact_factory_name: Optional[str] = Field(None, description="精确目标工厂")
+    exact_status: Optional[str] = Field(None, description="精确状态")
+    exact_driver_phone: Optional[str] = Field(None, description="精确司机电话")
+    fuzzy_keywords: Optional[str] = Field(None, description="模糊关键词")
+    date_from: Optional[str] = Field(None, description="开始日期")
+    date_to: Optional[str] = Field(None, description="结束日期")
+    page: int = Field(1, ge=1)
+    page_size: int = Field(20, ge=1, le=100)
+
 class DeliveryOut(BaseModel):
     id: int
     report_date: Optional[str] = None
@@ -233,68 +299,27 @@ async def parse_delivery_text(
         logger.exception(f"解析报单文本失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/", summary="新增报货订单", response_model=dict)
+@router.post("/", summary="新增报货订单")
 async def create_delivery(
-    report_date: str = Form(...),
-    target_factory_id: Optional[int] = Form(None),
-    target_factory_name: str = Form(...),
-    product_name: str = Form(..., description="主品种，随便填"),
-    products: Optional[str] = Form(None, description="品种列表，逗号分隔，最多4个，用于计算品种数量"),
-    quantity: float = Form(...),
-    vehicle_no: str = Form(...),
-    driver_name: str = Form(...),
-    driver_phone: str = Form(...),
-    driver_id_card: Optional[str] = Form(None),
-    has_delivery_order: str = Form("无"),
-    status: str = Form("待审核"),
-    uploaded_by: Optional[str] = Form(None),
-    reporter_id: Optional[int] = Form(None, description="报单人ID"),
-    reporter_name: Optional[str] = Form(None, description="报单人姓名"),
-    position: Optional[str] = Form(None, description="岗位"),
-    confirm_flag: bool = Form(False, description="二次确认标志"),
-    delivery_order_image: Optional[UploadFile] = File(None, description="有联单时上传的联单图片"),
-    voucher_images: List[UploadFile] = File(None, description="无联单时上传的凭证图片（最多6张）"),
+    body: Annotated[DeliveryCreateForm, Form(media_type="multipart/form-data")],
     service: DeliveryService = Depends(get_delivery_service),
     current_user: dict = Depends(get_current_user)
 ):
     """创建报货订单（支持联单图片或凭证图片）"""
     try:
-        data = {
-            "report_date": report_date,
-            "target_factory_id": target_factory_id,
-            "target_factory_name": target_factory_name,
-            "product_name": product_name,
-            "products": products,
-            "quantity": quantity,
-            "vehicle_no": vehicle_no,
-            "driver_name": driver_name,
-            "driver_phone": driver_phone,
-            "driver_id_card": driver_id_card,
-            "has_delivery_order": has_delivery_order,
-            "status": status,
-            "uploaded_by": uploaded_by,
-            "reporter_id": reporter_id,
-            "reporter_name": reporter_name,
-            "position": position,
-        }
-
-        # 读取联单图片
-        delivery_img_bytes = None
-        if delivery_order_image:
-            delivery_img_bytes = await delivery_order_image.read()
+        data = body.model_dump(exclude={"confirm_flag", "delivery_order_image", "voucher_images"})
 
-        # 读取多张凭证图片
-        voucher_bytes_list = []
-        if voucher_images:
-            for f in voucher_images:
-                voucher_bytes_list.append(await f.read())
+        # 联单图片、凭证图片以文件对象传给服务层，落盘时分块拷贝
+        delivery_img_file = upload_stream(body.delivery_order_image)
+        voucher_files = [f.file for f in body.voucher_images]
 
-        result = service.create_delivery(
+        result = await _run_upload(
+            service.create_delivery,
             data,
-            delivery_order_image=delivery_img_bytes,
-            voucher_images=voucher_bytes_list,
+            delivery_order_image=delivery_img_file,
+            voucher_images=voucher_files,
             current_user=current_user,
-            confirm_flag=confirm_flag
+            confirm_flag=body.confirm_flag
         )
 
         if result.get("need_confirm"):
@@ -317,28 +342,6 @@ async def create_delivery(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# ============ JSON 专用接口 ============
-
-class DeliveryCreateJsonRequest(BaseModel):
-    """JSON 格式创建报货订单请求体"""
-    report_date: str = Field(..., description="报货日期")
-    target_factory_id: Optional[int] = Field(None, description="目标工厂ID")
-    target_factory_name: str = Field(..., description="目标工厂名称")
-    product_name: str = Field(..., description="主品种")
-    products: Optional[str] = Field(None, description="品种列表，逗号分隔")
-    quantity: float = Field(..., description="数量（吨）")
-    vehicle_no: str = Field(..., description="车牌号")
-    driver_name: str = Field(..., description="司机姓名")
-    driver_phone: str = Field(..., description="司机电话")
-    driver_id_card: Optional[str] = Field(None, description="身份证号")
-    has_delivery_order: str = Field("无", description="是否有联单：有/无")
-    status: str = Field("待审核", description="审核状态：待审核/审核通过/审核未通过")
-    uploaded_by: Optional[str] = Field(None, description="上传者身份：司机/公司")
-    reporter_id: Optional[int] = Field(None, description="报单人ID")
-    reporter_name: Optional[str] = Field(None, description="报单人姓名")
-    position: Optional[str] = Field(None, description="岗位")
-    confirm_flag: bool = Field(False, description="二次确认标志")
-
 @router.post("/{delivery_id}/vouchers/append", summary="追加凭证图片")
 async def append_voucher_images(
     delivery_id: int,
@@ -347,8 +350,7 @@ async def append_voucher_images(
 ):
     """追加凭证图片（不会删除原有图片）"""
     try:
-        img_bytes_list = [await f.read() for f in images]
-        result = service.add_voucher_images(delivery_id, img_bytes_list)
+        result = await _run_upload(service.add_voucher_images, delivery_id, [f.file for f in images])
         if result["success"]:
             return result
         else:
@@ -399,6 +401,7 @@ async def list_voucher_images(
 )
 async def view_voucher_image(
     delivery_id: int,
+    request: Request,
     index: int = Query(0, ge=0, description="图片索引，从0开始（默认第一张）"),
     service: DeliveryService = Depends(get_delivery_service)
 ):
@@ -407,7 +410,7 @@ async def view_voucher_image(
     """
     try:
         # 获取订单详情（包含 voucher_images 列表）
-        delivery = service.get_delivery(delivery_id)
+        delivery = await asyncio.to_thread(service.get_delivery, delivery_id)
         if not delivery:
             raise HTTPException(status_code=404, detail="订单不存在")
 
@@ -424,7 +427,7 @@ async def view_voucher_image(
             )
 
         image_path = voucher_paths[index]
-        if not image_path or not os.path.exists(image_path):
+        if not image_path:
             raise HTTPException(status_code=404, detail="图片文件不存在")
 
         # 自动识别 MIME 类型
@@ -432,21 +435,13 @@ async def view_voucher_image(
         if not mime_type:
             mime_type = "image/jpeg"  # 默认
 
-        # 对文件名进行 RFC 5987 编码（支持中文）
-        filename = os.path.basename(image_path)
-        try:
-            # 尝试 ASCII 编码
-            filename.encode('ascii')
-            disposition = f'inline; filename="{filename}"'
-        except UnicodeEncodeError:
-            # 非 ASCII 文件名，使用 UTF-8 编码
-            encoded_filename = quote(filename, safe='')
-            disposition = f"inline; filename*=UTF-8''{encoded_filename}"
-
-        return FileResponse(
-            path=image_path,
+        # 非 ASCII 文件名由 FileResponse 按 RFC 5987 编码（filename*=utf-8''...）
+        return await conditional_file_response(
+            request,
+            image_path,
             media_type=mime_type,
-            headers={"Content-Disposition": disposition}
+            filename=os.path.basename(image_path),
+            not_found_detail="图片文件不存在",
         )
 
     except HTTPException:
@@ -463,12 +458,12 @@ async def replace_voucher_images(
 ):
     """整体替换凭证图片（会删除原有所有凭证图片）"""
     try:
-        voucher_bytes_list = [await f.read() for f in voucher_images]
-        result = service.update_delivery(
+        result = await _run_upload(
+            service.update_delivery,
             delivery_id,
             data={},
             delivery_order_image=None,
-            voucher_images=voucher_bytes_list,
+            voucher_images=[f.file for f in voucher_images],
             uploaded_by=current_user.get('name') if current_user else None
         )
         if result["success"]:
@@ -480,7 +475,9 @@ async def replace_voucher_images(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/json", summary="JSON 新增报货订单", response_model=dict)
+# ============ JSON 专用接口 ============
+
+@router.post("/json", summary="JSON 新增报货订单")
 async def create_delivery_json(
         body: DeliveryCreateJsonRequest,
         service: DeliveryService = Depends(get_delivery_service),
@@ -513,49 +510,15 @@ async def create_delivery_json(
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-@router.get("/", summary="查询报货订单列表", response_model=dict)
+@router.get("/", summary="查询报货订单列表")
 async def list_deliveries(
-    exact_delivery_id: Optional[int] = Query(None, description="精确报单ID"),
-    exact_shipper: Optional[str] = Query(None, description="精确发货人/报单人"),
-    exact_contract_no: Optional[str] = Query(None, description="精确合同编号"),
-    exact_report_date: Optional[str] = Query(None, description="精确报单日期"),
-    exact_driver_name: Optional[str] = Query(None, description="精确司机姓名"),
-    exact_vehicle_no: Optional[str] = Query(None, description="精确车号"),
-    exact_has_delivery_order: Optional[str] = Query(None, description="是否自带联单：有/无"),
-    exact_upload_status: Optional[str] = Query(None, description="是否上传联单：已上传/未上传"),
-    exact_reporter_name: Optional[str] = Query(None, description="精确报单人姓名"),  # 新增
-    exact_reporter_id: Optional[int] = Query(None, description="精确报单人ID"),  # 新增
-    exact_factory_name: Optional[str] = Query(None, description="精确目标工厂"),
-    exact_status: Optional[str] = Query(None, description="精确状态"),
-    exact_driver_phone: Optional[str] = Query(None, description="精确司机电话"),
-    fuzzy_keywords: Optional[str] = Query(None, description="模糊关键词"),
-        date_from: Optional[str] = Query(None, description="开始日期"),
-        date_to: Optional[str] = Query(None, description="结束日期"),
-        page: int = Query(1, ge=1),
-        page_size: int = Query(20, ge=1, le=100),
-        service: DeliveryService = Depends(get_delivery_service)
+    filters: Annotated[DeliveryListFilters, Query()],
+    service: DeliveryService = Depends(get_delivery_service)
 ):
     """查询报货订单列表"""
-    return service.list_deliveries(
-        exact_delivery_id=exact_delivery_id,
-        exact_shipper=exact_shipper,
-        exact_contract_no=exact_contract_no,
-        exact_report_date=exact_report_date,
-        exact_driver_name=exact_driver_name,
-        exact_vehicle_no=exact_vehicle_no,
-        exact_has_delivery_order=exact_has_delivery_order,
-        exact_upload_status=exact_upload_status,
-        exact_reporter_name=exact_reporter_name,  # 新增
-        exact_reporter_id=exact_reporter_id,      # 新增
-        exact_factory_name=exact_factory_name,
-        exact_status=exact_status,
-        exact_driver_phone=exact_driver_phone,
-        fuzzy_keywords=fuzzy_keywords,
-        date_from=date_from,
-        date_to=date_to,
-        page=page,
-        page_size=page_size
-    )
+    result = await asyncio.to_thread(service.list_deliveries, **filters.model_dump())
+    # 直接交给 orjson 序列化，跳过 jsonable_encoder 对每行每个字段的递归遍历
+    return ORJSONResponse(result)
 
 
 @router.get("/{delivery_id}", summary="查看报货订单详情", response_model=DeliveryOut)
@@ -564,13 +527,13 @@ async def get_delivery(
         service: DeliveryService = Depends(get_delivery_service)
 ):
     """查看订单详情"""
-    delivery = service.get_delivery(delivery_id)
+    delivery = await asyncio.to_thread(service.get_delivery, delivery_id)
     if not delivery:
         raise HTTPException(status_code=404, detail="订单不存在")
     return delivery
 
 
-@router.put("/{delivery_id}", summary="编辑报货订单", response_model=dict)
+@router.put("/{delivery_id}", summary="编辑报货订单")
 async def update_delivery(
         delivery_id: int,
         request: DeliveryUpdateRequest,
@@ -578,7 +541,7 @@ async def update_delivery(
         current_user: dict = Depends(get_current_user)   # 注入当前用户
 ):
     try:
-        data = {k: v for k, v in request.dict().items() if v is not None}
+        data = request.model_dump(exclude_unset=True, exclude_none=True)
         if not data:
             raise HTTPException(status_code=400, detail="没有要更新的字段")
 
@@ -637,14 +600,14 @@ async def upload_delivery_order(
                 detail="该订单已上传联单，如需修改请使用 modify-order 接口"
             )
 
-        image_bytes = await image.read()
-
         data = {}
         if has_delivery_order:
             data['has_delivery_order'] = has_delivery_order
             data['uploaded_by'] = uploaded_by
 
-        result = service.update_delivery(delivery_id, data, image_bytes, uploaded_by=uploaded_by)
+        result = await _run_upload(
+            service.update_delivery, delivery_id, data, upload_stream(image), uploaded_by=uploaded_by
+        )
 
         if result["success"]:
             return {"success": True, "message": "联单上传成功", "data": result["data"]}
@@ -696,14 +659,14 @@ async def modify_delivery_order(
                 detail="该订单未上传联单，请使用 upload-order 接口"
             )
 
-        image_bytes = await image.read()
-
         data = {}
         if has_delivery_order:
             data['has_delivery_order'] = has_delivery_order
             data['uploaded_by'] = uploaded_by
 
-        result = service.update_delivery(delivery_id, data, image_bytes, uploaded_by=uploaded_by)
+        result = await _run_upload(
+            service.update_delivery, delivery_id, data, upload_stream(image), uploaded_by=uploaded_by
+        )
 
         if result["success"]:
             return {"success": True, "message": "联单修改成功", "data": result["data"]}
@@ -732,11 +695,12 @@ async def delete_delivery_image(
 @router.get("/{delivery_id}/view-order", summary="查看联单图片")
 async def view_delivery_order(
     delivery_id: int,
+    request: Request,
     service: DeliveryService = Depends(get_delivery_service)
 ):
     """查看联单图片（仅支持图片格式，PDF 请使用 /view-pdf 接口）"""
     try:
-        delivery = service.get_delivery(delivery_id)
+        delivery = await asyncio.to_thread(service.get_delivery, delivery_id)
         if not delivery:
             raise HTTPException(status_code=404, detail="订单不存在")
 
@@ -744,9 +708,6 @@ async def view_delivery_order(
         if not image_path:
             raise HTTPException(status_code=404, detail="该订单没有上传联单文件")
 
-        if not os.path.exists(image_path):
-            raise HTTPException(status_code=404, detail="联单文件不存在")
-
         # 获取文件扩展名（小写）
         ext = os.path.splitext(image_path)[1].lower()
 
@@ -760,18 +721,24 @@ async def view_delivery_order(
                 detail="该联单为 PDF 格式，请使用 /view-pdf 接口预览"
             )
         elif ext in image_exts:
-            # 图片格式，正常返回
-            return FileResponse(
-                path=image_path,
+            # 图片格式，浏览器内直接显示；一次 stat 同时完成存在性校验和响应头（ETag/长度）
+            return await conditional_file_response(
+                request,
+                image_path,
                 media_type=f"image/{ext[1:]}",  # 如 image/jpeg
-                filename=f"delivery_order_{delivery_id}{ext}"
+                filename=f"delivery_order_{delivery_id}{ext}",
+                not_found_detail="联单文件不存在",
+                cache_in_memory=True,
             )
         else:
-            # 其他未知格式，作为通用二进制文件返回
-            return FileResponse(
-                path=image_path,
+            # 其他未知格式，作为通用二进制文件下载
+            return await conditional_file_response(
+                request,
+                image_path,
                 media_type="application/octet-stream",
-                filename=f"delivery_order_{delivery_id}{ext}"
+                filename=f"delivery_order_{delivery_id}{ext}",
+                content_disposition_type="attachment",
+                not_found_detail="联单文件不存在",
             )
 
     except HTTPException:
@@ -783,10 +750,11 @@ async def view_delivery_order(
 @router.get("/{delivery_id}/image", summary="查看联单图片（兼容旧接口）")
 async def get_delivery_image(
     delivery_id: int,
+    request: Request,
     service: DeliveryService = Depends(get_delivery_service)
 ):
     """查看联单图片（兼容旧接口）"""
-    return await view_delivery_order(delivery_id, service)
+    return await view_delivery_order(delivery_id, request, service)
 
 
 @router.post("/batch-upload-orders", summary="批量上传联单图片", response_model=BatchDeliveryOrderResponse)
@@ -845,8 +813,6 @@ async def batch_upload_delivery_orders(
     - `failed_count`: 失败的数量
     - `results`: 每个文件的详细处理结果
     """
-    import json
-
     # 限制单次上传数量
     MAX_BATCH_SIZE = 50
     if len(files) > MAX_BATCH_SIZE:
@@ -933,8 +899,7 @@ async def batch_upload_delivery_orders(
 
             for idx, (file, delivery_id) in enumerate(zip(files, delivery_id_list)):
                 # 验证文件类型
-                allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp", "image/webp"]
-                if file.content_type not in allowed_types:
+                if await sniff_image_mime(file) not in _ALLOWED_ORDER_IMAGE_TYPES:
                     pre_check_results.append({
                         "index": idx,
                         "delivery_id": delivery_id,
@@ -1048,8 +1013,7 @@ async def batch_upload_delivery_orders(
             for idx, (file, delivery_id) in enumerate(zip(files, delivery_id_list)):
                 try:
                     # 验证文件类型
-                    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp", "image/webp"]
-                    if file.content_type not in allowed_types:
+                    if await sniff_image_mime(file) not in _ALLOWED_ORDER_IMAGE_TYPES:
                         results.append(BatchUploadResult(
                             index=idx,
                             delivery_id=delivery_id,
@@ -1210,21 +1174,29 @@ async def modify_delivery_pdf(
 @router.get("/{delivery_id}/view-pdf", summary="预览联单PDF")
 async def view_delivery_pdf(
     delivery_id: int,
+    request: Request,
     service: DeliveryService = Depends(get_delivery_service),
     current_user: dict = Depends(get_current_user)
 ):
     """预览已上传的联单 PDF 文件"""
-    delivery = service.get_delivery(delivery_id)
+    delivery = await asyncio.to_thread(service.get_delivery, delivery_id)
     if not delivery:
         raise HTTPException(status_code=404, detail="订单不存在")
     pdf_path = delivery.get("delivery_order_pdf")  # 如果您已分离字段
     # 或暂时仍从 delivery_order_image 读取，但要校验扩展名
-    if not pdf_path or not os.path.exists(pdf_path):
+    if not pdf_path:
         raise HTTPException(status_code=404, detail="PDF 文件不存在")
     ext = os.path.splitext(pdf_path)[1].lower()
     if ext != '.pdf':
         raise HTTPException(status_code=400, detail="文件不是 PDF 格式")
-    return FileResponse(pdf_path, media_type="application/pdf", filename=f"delivery_{delivery_id}.pdf")
+    return await conditional_file_response(
+        request,
+        pdf_path,
+        media_type="application/pdf",
+        filename=f"delivery_{delivery_id}.pdf",
+        content_disposition_type="attachment",
+        not_found_detail="PDF 文件不存在",
+    )
 
 @router.delete("/{delivery_id}/pdf", summary="删除联单PDF")
 async def delete_delivery_pdf(
@@ -1237,7 +1209,7 @@ async def delete_delivery_pdf(
     if not result["success"]:
         raise HTTPException(status_code=400, detail=result["error"])
     return result
-@router.get("/by-manager", summary="按大区经理查询报单", response_model=dict)
+@router.get("/by-manager", summary="按大区经理查询报单")
 async def list_deliveries_by_manager(
     manager_name: str = Query(..., description="大区经理姓名（必填）"),
     audit_status: Optional[str] = Query(None, description="审核状态筛选：待审核/已审核(审核通过)/全部"),
@@ -1,21 +1,19 @@
+import asyncio
 import pandas as pd
-import io
-import re
 import os
-import shutil
 import uuid
 import json
-from datetime import datetime
 from pathlib import Path
 from fastapi import HTTPException, APIRouter, Depends, Query, UploadFile, File, Form
 from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List
+from typing import Annotated, Optional, List
 from datetime import date, datetime
 from decimal import Decimal
 from enum import IntEnum
 
 from app.core.paths import UPLOADS_DIR
+from app.core.responses import ORJSONResponse
 from app.services.payment_services import PaymentExcelProcessor
 from core.database import get_conn
 from core.logging import get_logger
@@ -24,8 +22,6 @@ from app.services.payment_services import (
     PaymentService,
     PaymentStage,
     calculate_payment_amount,
-    WEIGHBILL_NO_PATTERNS,  # 从 services 导入
-    AMOUNT_PATTERNS,       # 从 services 导入
 )
 
 logger = get_logger(__name__)
@@ -46,6 +42,10 @@ class PaymentStageEnum(IntEnum):
     FINAL = 2        # 尾款（10%）
 
 
+# 请求枚举 -> 服务层枚举，模块加载时建好，请求内直接查表
+_STAGE_MAP = {stage: PaymentStage(stage.value) for stage in PaymentStageEnum}
+
+
 class CreatePaymentReq(BaseModel):
     """创建收款明细请求"""
     model_config = ConfigDict(json_schema_extra={
@@ -63,8 +63,8 @@ class CreatePaymentReq(BaseModel):
     sales_order_id: int = Field(..., description="销售订单ID")
     smelter_name: str = Field(..., description="冶炼厂名称")
     contract_no: str = Field(..., description="合同编号")
-    unit_price: float = Field(..., gt=0, description="合同单价（元/吨）")
-    net_weight: float = Field(..., gt=0, description="净重（吨）")
+    unit_price: Decimal = Field(..., gt=0, description="合同单价（元/吨）")
+    net_weight: Decimal = Field(..., gt=0, description="净重（吨）")
     material_name: Optional[str] = Field(None, description="物料名称")
     remark: Optional[str] = Field(None, description="备注")
 
@@ -92,7 +92,7 @@ class RecordPaymentReq(BaseModel):
     contract_no: Optional[str] = Field(None, description="合同编号，用于自动匹配")
     vehicle_no: Optional[str] = Field(None, description="车号，用于自动匹配")
     product_name: Optional[str] = Field(None, description="品种，用于自动匹配")
-    payment_amount: float = Field(..., gt=0, description="回款金额")
+    payment_amount: Decimal = Field(..., gt=0, description="回款金额")
     payment_stage: PaymentStageEnum = Field(PaymentStageEnum.DELIVERY, description="回款阶段：0-定金, 1-到货款(90%), 2-尾款(10%)")
     payment_date: Optional[date] = Field(None, description="回款日期，默认今天")
     payment_method: Optional[str] = Field(None, description="支付方式")
@@ -124,6 +124,7 @@ class PaymentListQuery(BaseModel):
     start_date: Optional[date] = Field(None, description="开始日期")
     end_date: Optional[date] = Field(None, description="结束日期")
     keyword: Optional[str] = Field(None, description="关键词搜索（冶炼厂/合同号/物料）")
+    collection_status: Optional[int] = Field(None, ge=0, le=2, description="回款状态筛选：0-待回款, 1-已回首笔待回尾款, 2-已回尾款")
 
 
 class PaymentResp(BaseModel):
@@ -357,7 +358,7 @@ class PaymentExcelImportResp(BaseModel):
     details: List[dict]
 # ========== 路由定义 ==========
 
-router = APIRouter(tags=["收款明细管理"])
+router = APIRouter(tags=["收款明细管理"], default_response_class=ORJSONResponse)
 
 
 def register_pd_payment_routes(app):
@@ -365,26 +366,30 @@ def register_pd_payment_routes(app):
     app.include_router(router, prefix="/api/v1/payment")
 
 
-def check_finance_permission(current_user: dict):
-    """检查是否为财务人员（财务/会计/管理员）"""
-    allowed_roles = ["管理员", "财务", "会计"]
-    if current_user.get("role") not in allowed_roles:
+_FINANCE_ROLES = frozenset({"管理员", "财务", "会计"})
+_ADMIN_OR_FINANCE_ROLES = frozenset({"管理员", "财务"})
+
+
+async def require_finance(current_user: dict = Depends(get_current_user)) -> dict:
+    """依赖：仅财务人员（财务/会计/管理员）可访问，返回当前用户"""
+    if current_user.get("role") not in _FINANCE_ROLES:
         raise HTTPException(status_code=403, detail="仅财务人员可操作")
+    return current_user
 
 
-def check_admin_or_finance_permission(current_user: dict):
-    """检查是否为管理员或财务"""
-    allowed_roles = ["管理员", "财务"]
-    if current_user.get("role") not in allowed_roles:
+async def require_admin_or_finance(current_user: dict = Depends(get_current_user)) -> dict:
+    """依赖：仅管理员或财务可访问，返回当前用户"""
+    if current_user.get("role") not in _ADMIN_OR_FINANCE_ROLES:
         raise HTTPException(status_code=403, detail="权限不足，需要管理员或财务权限")
+    return current_user
 
 
 # ========== 收款明细管理接口 ==========
 
-@router.post("/details", summary="创建收款明细", response_model=dict)
-def create_payment_detail(
+@router.post("/details", summary="创建收款明细")
+async def create_payment_detail(
     body: CreatePaymentReq,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     创建收款明细台账（根据销售业务数据生成）
@@ -393,25 +398,21 @@ def create_payment_detail(
     - 自动计算回款总额 = 合同单价 × 净重
     - 初始状态为"未回款"
     """
-    check_finance_permission(current_user)
-
     try:
-        payment_id = PaymentService.create_payment_detail(
+        payment_id = await asyncio.to_thread(
+            PaymentService.create_payment_detail,
             sales_order_id=body.sales_order_id,
             smelter_name=body.smelter_name,
             contract_no=body.contract_no,
-            unit_price=Decimal(str(body.unit_price)),
-            net_weight=Decimal(str(body.net_weight)),
+            unit_price=body.unit_price,
+            net_weight=body.net_weight,
             material_name=body.material_name,
             remark=body.remark,
             created_by=current_user.get("id")
         )
 
         # 计算总额用于返回
-        total_amount = calculate_payment_amount(
-            Decimal(str(body.unit_price)),
-            Decimal(str(body.net_weight))
-        )
+        total_amount = calculate_payment_amount(body.unit_price, body.net_weight)
 
         return {
             "msg": "创建收款明细成功",
@@ -428,19 +429,10 @@ def create_payment_detail(
         raise HTTPException(status_code=500, detail="创建收款明细失败")
 
 
-@router.get("/details", summary="回款信息列表", response_model=dict)
-def list_payment_details(
-    page: int = Query(1, ge=1, description="页码"),
-    size: int = Query(20, ge=1, le=100, description="每页数量"),
-    status: Optional[int] = Query(None, ge=0, le=3, description="回款明细状态筛选"),
-    smelter_name: Optional[str] = Query(None, description="冶炼厂名称"),
-    contract_no: Optional[str] = Query(None, description="合同编号"),
-    start_date: Optional[date] = Query(None, description="开始日期"),
-    end_date: Optional[date] = Query(None, description="结束日期"),
-    keyword: Optional[str] = Query(None, description="关键词搜索"),
-    # 回款列表筛选参数
-    collection_status: Optional[int] = Query(None, ge=0, le=2, description="回款状态筛选：0-待回款, 1-已回首笔待回尾款, 2-已回尾款"),
-    current_user: dict = Depends(get_current_user)
+@router.get("/details", summary="回款信息列表")
+async def list_payment_details(
+    query: Annotated[PaymentListQuery, Query()],
+    current_user: dict = Depends(require_finance)
 ):
     """
     获取回款信息列表
@@ -456,28 +448,19 @@ def list_payment_details(
     - 1: 已回首笔待回尾款
     - 2: 已回尾款
     """
-    check_finance_permission(current_user)
-
     try:
-        result = PaymentService.list_payment_details(
-            page=page,
-            size=size,
-            status=status,
-            smelter_name=smelter_name,
-            contract_no=contract_no,
-            start_date=start_date,
-            end_date=end_date,
-            keyword=keyword,
-            collection_status=collection_status
+        result = await asyncio.to_thread(
+            PaymentService.list_payment_details, **query.model_dump()
         )
-        return result
+        # 直接交给 orjson 序列化，跳过 jsonable_encoder 对每行每个字段的递归遍历
+        return ORJSONResponse(result)
 
     except Exception:
         logger.exception("查询回款信息列表异常")
         raise HTTPException(status_code=500, detail="查询失败")
     
-@router.get("/payment-out", summary="打款信息列表（打款排期列表）", response_model=dict)
-def list_payment_out_details(
+@router.get("/payment-out", summary="打款信息列表（打款排期列表）")
+async def list_payment_out_details(
     page: int = Query(1, ge=1, description="页码"),
     size: int = Query(20, ge=1, le=100, description="每页数量"),
     status: Optional[int] = Query(None, ge=0, le=3, description="状态筛选"),
@@ -490,7 +473,7 @@ def list_payment_out_details(
     is_paid_out: Optional[int] = Query(None, ge=0, le=1, description="打款状态筛选：0-待打款, 1-已打款"),
     payment_schedule_date: Optional[str] = Query(None, description="排期日期筛选"),
     has_schedule: Optional[int] = Query(None, ge=0, le=1, description="排期状态筛选：0-待排期, 1-已排期"),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     获取打款信息列表（打款排期列表）
@@ -511,10 +494,9 @@ def list_payment_out_details(
     - 已排期：已设置排款日期
     - 待排期：未设置排款日期
     """
-    check_finance_permission(current_user)
-
     try:
-        result = PaymentService.list_payment_out_details(
+        result = await asyncio.to_thread(
+            PaymentService.list_payment_out_details,
             page=page,
             size=size,
             status=status,
@@ -534,11 +516,11 @@ def list_payment_out_details(
         raise HTTPException(status_code=500, detail="查询失败")
 
 
-@router.put("/details/{payment_id}/collection", summary="编辑回款信息", response_model=dict)
-def update_collection_payment(
+@router.put("/details/{payment_id}/collection", summary="编辑回款信息")
+async def update_collection_payment(
         payment_id: int,
         body: UpdateCollectionReq,
-        current_user: dict = Depends(get_current_user)
+        current_user: dict = Depends(require_finance)
 ):
     """
     编辑回款信息（金利分阶段日期，豫光单一日期）
@@ -576,10 +558,9 @@ def update_collection_payment(
         "remark": "一次性回款"
     }
     """
-    check_finance_permission(current_user)
-
     try:
-        result = PaymentService.update_collection_payment(
+        result = await asyncio.to_thread(
+            PaymentService.update_collection_payment,
             payment_id=payment_id,
             arrival_paid_amount=body.arrival_paid_amount,
             final_paid_amount=body.final_paid_amount,
@@ -604,16 +585,14 @@ def update_collection_payment(
 
 
 @router.get("/details/{payment_id}", summary="收款明细详情", response_model=PaymentDetailResp)
-def get_payment_detail(
+async def get_payment_detail(
     payment_id: int,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     获取收款明细详情（包含所有回款记录）
     """
-    check_finance_permission(current_user)
-
-    detail = PaymentService.get_payment_detail(payment_id)
+    detail = await asyncio.to_thread(PaymentService.get_payment_detail, payment_id)
     if not detail:
         raise HTTPException(status_code=404, detail="收款明细不存在")
 
@@ -621,10 +600,10 @@ def get_payment_detail(
 
 
 @router.put("/details/{payment_id}", summary="更新收款明细")
-def update_payment_detail(
+async def update_payment_detail(
     payment_id: int,
     body: UpdatePaymentReq,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     更新收款明细基础信息
@@ -632,10 +611,9 @@ def update_payment_detail(
     注意：不允许修改金额相关字段（单价、重量、总额等）
     如需修改金额，请删除后重新创建或联系管理员
     """
-    check_finance_permission(current_user)
-
     try:
-        PaymentService.update_payment_detail(
+        await asyncio.to_thread(
+            PaymentService.update_payment_detail,
             payment_id=payment_id,
             smelter_name=body.smelter_name,
             contract_no=body.contract_no,
@@ -653,10 +631,10 @@ def update_payment_detail(
 
 
 @router.put("/details/{payment_id}/status", summary="手动更新付款状态")
-def update_payment_status(
+async def update_payment_status(
     payment_id: int,
     body: UpdatePaymentStatusReq,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     手动更新付款状态（支持人工干预）
@@ -666,10 +644,9 @@ def update_payment_status(
     
     注意：此接口用于人工修正状态，正常情况下状态由系统自动更新
     """
-    check_finance_permission(current_user)
-
     try:
-        result = PaymentService.update_payment_status(
+        result = await asyncio.to_thread(
+            PaymentService.update_payment_status,
             payment_id=payment_id,
             is_paid=body.is_paid,
             is_paid_out=body.is_paid_out,
@@ -685,19 +662,17 @@ def update_payment_status(
 
 
 @router.delete("/details/{payment_id}", summary="删除收款明细")
-def delete_payment_detail(
+async def delete_payment_detail(
     payment_id: int,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_admin_or_finance)
 ):
     """
     删除收款明细
 
     注意：已有回款记录的明细无法删除
     """
-    check_admin_or_finance_permission(current_user)
-
     try:
-        PaymentService.delete_payment_detail(payment_id)
+        await asyncio.to_thread(PaymentService.delete_payment_detail, payment_id)
         return {"msg": "删除成功"}
 
     except ValueError as e:
@@ -709,13 +684,13 @@ def delete_payment_detail(
 
 # ========== 合同发运进度接口（静态路由放在动态路由之前） ==========
 
-@router.get("/contracts/shipping-progress", summary="合同发运进度列表", response_model=dict)
-def list_contract_shipping_progress(
+@router.get("/contracts/shipping-progress", summary="合同发运进度列表")
+async def list_contract_shipping_progress(
     contract_no: Optional[str] = Query(None, description="合同编号筛选"),
     smelter_name: Optional[str] = Query(None, description="冶炼厂名称筛选"),
     page: int = Query(1, ge=1, description="页码"),
     size: int = Query(20, ge=1, le=100, description="每页数量"),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     获取合同发运进度列表
@@ -728,10 +703,9 @@ def list_contract_shipping_progress(
     
     关联逻辑：合同 -> 销售订单 -> 磅单
     """
-    check_finance_permission(current_user)
-    
     try:
-        result = PaymentService.get_contract_shipping_progress(
+        result = await asyncio.to_thread(
+            PaymentService.get_contract_shipping_progress,
             contract_no=contract_no,
             smelter_name=smelter_name,
             page=page,
@@ -748,14 +722,14 @@ def list_contract_shipping_progress(
 
 # ========== 合同回款汇总接口（静态路由放在动态路由之前） ==========
 
-@router.get("/contracts/payment-summary", summary="合同回款汇总列表", response_model=dict)
-def list_contract_payment_summary(
+@router.get("/contracts/payment-summary", summary="合同回款汇总列表")
+async def list_contract_payment_summary(
     contract_no: Optional[str] = Query(None, description="合同编号筛选"),
     smelter_name: Optional[str] = Query(None, description="冶炼厂名称筛选"),
     status: Optional[int] = Query(None, ge=0, le=3, description="状态筛选"),
     page: int = Query(1, ge=1, description="页码"),
     size: int = Query(20, ge=1, le=100, description="每页数量"),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     获取合同回款汇总列表（按合同编号分组统计）
@@ -769,10 +743,9 @@ def list_contract_payment_summary(
     
     用于财务快速查看各合同的整体回款情况
     """
-    check_finance_permission(current_user)
-    
     try:
-        result = PaymentService.get_contract_payment_summary(
+        result = await asyncio.to_thread(
+            PaymentService.get_contract_payment_summary,
             contract_no=contract_no,
             smelter_name=smelter_name,
             status=status,
@@ -790,12 +763,12 @@ def list_contract_payment_summary(
 
 # ========== 合同回款明细接口（动态路由放在静态路由之后） ==========
 
-@router.get("/contracts/{contract_no}/payment-details", summary="合同回款明细", response_model=dict)
-def get_contract_payment_details(
+@router.get("/contracts/{contract_no}/payment-details", summary="合同回款明细")
+async def get_contract_payment_details(
     contract_no: str,
     page: int = Query(1, ge=1, description="页码"),
     size: int = Query(20, ge=1, le=100, description="每页数量"),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     获取单个合同的回款明细
@@ -807,18 +780,17 @@ def get_contract_payment_details(
     
     用于查看单个合同的详细回款情况
     """
-    check_finance_permission(current_user)
-    
     try:
-        result = PaymentService.get_contract_payment_details(
+        result = await asyncio.to_thread(
+            PaymentService.get_contract_payment_details,
             contract_no=contract_no,
             page=page,
             size=size
         )
-        return {
+        return ORJSONResponse({
             "msg": "查询成功",
             "data": result
-        }
+        })
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception:
@@ -828,10 +800,10 @@ def get_contract_payment_details(
 
 # ========== 回款录入接口（核心功能） ==========
 
-@router.post("/records", summary="录入回款记录", response_model=dict)
-def record_payment(
+@router.post("/records", summary="录入回款记录")
+async def record_payment(
     body: RecordPaymentReq,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     录入回款记录（支持分段收款）
@@ -848,10 +820,9 @@ def record_payment(
     返回:
         录入结果信息（含完整收款明细）
     """
-    check_finance_permission(current_user)
-
     try:
-        resolved_payment_detail_id = PaymentService.resolve_payment_detail_id(
+        resolved_payment_detail_id = await asyncio.to_thread(
+            PaymentService.resolve_payment_detail_id,
             payment_detail_id=body.payment_detail_id,
             weighbill_id=body.weighbill_id,
             delivery_id=body.delivery_id,
@@ -860,10 +831,11 @@ def record_payment(
             product_name=body.product_name,
         )
 
-        result = PaymentService.record_payment(
+        result = await asyncio.to_thread(
+            PaymentService.record_payment,
             payment_detail_id=resolved_payment_detail_id,
-            payment_amount=Decimal(str(body.payment_amount)),
-            payment_stage=PaymentStage(body.payment_stage),
+            payment_amount=body.payment_amount,
+            payment_stage=_STAGE_MAP[body.payment_stage],
             payment_date=body.payment_date,
             payment_method=body.payment_method,
             transaction_no=body.transaction_no,
@@ -872,7 +844,7 @@ def record_payment(
         )
         
         # 返回完整的收款明细信息
-        full_detail = PaymentService.get_payment_detail(resolved_payment_detail_id)
+        full_detail = await asyncio.to_thread(PaymentService.get_payment_detail, resolved_payment_detail_id)
         
         return {
             "msg": "回款记录录入成功",
@@ -901,17 +873,15 @@ class CreatePaymentByWeighbillReq(BaseModel):
     product_name: Optional[str] = Field(None, description="品种，用于自动匹配")
 
 
-@router.post("/details/create-by-weighbill", summary="根据磅单手动创建回款信息", response_model=dict)
+@router.post("/details/create-by-weighbill", summary="根据磅单手动创建回款信息")
 def create_payment_by_weighbill(
         body: CreatePaymentByWeighbillReq,
-        current_user: dict = Depends(get_current_user)
+        current_user: dict = Depends(require_finance)
 ):
     """
     手动为已上传的磅单创建回款信息
     （用于自动创建失败时的补救）
     """
-    check_finance_permission(current_user)
-
     try:
         resolved_weighbill_id = PaymentService.resolve_weighbill_id_for_payment(
             weighbill_id=body.weighbill_id,
@@ -944,9 +914,6 @@ def create_payment_by_weighbill(
                     return {"msg": "该磅单已存在回款信息，无需重复创建"}
 
                 # 创建回款信息
-                from decimal import Decimal
-                from app.services.payment_services import PaymentService, calculate_payment_amount
-
                 unit_price = Decimal(str(weighbill['unit_price'])) if weighbill.get('unit_price') else None
                 net_weight = Decimal(str(weighbill['net_weight'])) if weighbill.get('net_weight') else None
 
@@ -1082,7 +1049,7 @@ async def upload_payment_excel(
     )
 
 
-@router.get("/uploads", summary="查询已上传文件", response_model=dict)
+@router.get("/uploads", summary="查询已上传文件")
 async def list_uploaded_files(
     page: int = 1,
     page_size: int = 20,
@@ -1180,10 +1147,10 @@ async def delete_uploaded_file(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
 
-@router.post("/import-excel", summary="Excel批量导入回款数据", response_model=dict)
+@router.post("/import-excel", summary="Excel批量导入回款数据")
 async def import_payment_excel(
     body: PaymentExcelImportReq,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """
     批量导入回款明细Excel文件
@@ -1204,8 +1171,6 @@ async def import_payment_excel(
         "company_type": "jinli"  // 可选，不传则自动检测
     }
     """
-    check_finance_permission(current_user)
-    
     try:
         # ========== 1. 查找并读取Excel文件 ==========
         file_path = PAYMENT_UPLOAD_DIR / body.file_id
@@ -1411,11 +1376,9 @@ async def list_import_records(
     status: Optional[str] = Query(None, description="处理状态：success/failed"),
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """查询Excel导入的历史记录（包含原始数据）"""
-    check_finance_permission(current_user)
-    
     try:
         with get_conn() as conn:
             with conn.cursor() as cur:
@@ -1504,11 +1467,9 @@ async def export_import_records(
     status: Optional[str] = Query(None),
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(require_finance)
 ):
     """导出Excel导入记录为Excel文件"""
-    check_finance_permission(current_user)
-    
     try:
         with get_conn() as conn:
             with conn.cursor() as cur:
@@ -1,19 +1,34 @@
 """
 磅单管理路由 - 支持一报单多品种（最多4个）
 """
+import asyncio
 import logging
 import os
-import shutil
 from typing import Dict, List, Optional
 
+from celery.result import AsyncResult
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Form
 from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field
 
-from app.core.paths import TEMP_UPLOADS_DIR
 from app.core.logging import get_logger
+from app.core.paths import TEMP_UPLOADS_DIR
+from app.intelligent_prediction.tasks.celery_app import celery_app
 from app.services.weighbill_service import WeighbillService, get_weighbill_service
 from app.services.contract_service import get_conn
+from app.tasks.weighbill_ocr import (
+    OCR_JOB_EXPIRES_SECONDS,
+    OCR_JOB_IMAGE_PREFIX,
+    recognize_weighbill_task,
+)
+from app.utils.ocr_pool import run_ocr, run_ocr_limited
+from app.utils.uploads import (
+    remove_files,
+    save_upload_file,
+    sniff_image_mime,
+    unique_name_suffix,
+    upload_stream,
+)
 from core.auth import get_current_user
 
 router = APIRouter(prefix="/weighbills", tags=["磅单管理"])
@@ -56,6 +71,23 @@ class WeighbillOCRResponse(BaseModel):
     price_message: Optional[str] = None
 
 
+class WeighbillOCRBatchItem(BaseModel):
+    """批量OCR单张结果"""
+    index: int
+    filename: Optional[str] = None
+    success: bool
+    error: Optional[str] = None
+    data: Optional[WeighbillOCRResponse] = None
+
+
+class WeighbillOCRJobOut(BaseModel):
+    """异步OCR任务状态：pending/processing/success/failed"""
+    job_id: str
+    status: str
+    error: Optional[str] = None
+    data: Optional[WeighbillOCRResponse] = None
+
+
 class WeighbillUploadRequest(BaseModel):
     delivery_id: int
     product_name: str
@@ -160,6 +192,10 @@ class WeighbillContractUpdateRequest(BaseModel):
     contract_id: int = Field(..., description="新合同ID")
 
 
+class WeighbillBatchConfirmRequest(BaseModel):
+    weighbill_ids: List[int] = Field(..., min_length=1, max_length=500, description="待确认的磅单ID列表")
+
+
 class PayeeOption(BaseModel):
     """收款人选项"""
     id: int
@@ -193,6 +229,34 @@ class BatchPriceUpdateRequest(BaseModel):
     prices: List[BatchPriceUpdateItem] = Field(..., description="单价更新列表")
 # ============ 路由 ============
 
+# 按文件头判定的类型（sniff_image_mime），不信任客户端声明的 Content-Type
+_ALLOWED_WEIGHBILL_TYPES = frozenset({"image/jpeg", "image/png", "image/bmp"})
+
+
+async def _ocr_one(file: UploadFile, service: WeighbillService, auto_match: bool) -> Dict:
+    """
+    在内存中预处理并识别单张磅单（不落盘临时文件），返回 service.recognize_weighbill 的结果；
+    auto_match 时用识别结果自动关联报单并补全单价。
+    """
+    content = await file.read()
+    # 预处理与识别放到 OCR 线程池，避免阻塞事件循环
+    image = await run_ocr(service.preprocess_image_bytes, content)
+    result = await run_ocr_limited(service.recognize_weighbill, image)
+
+    if result["success"] and auto_match:
+        result["data"] = await _auto_fill(service, result["data"])
+    return result
+
+
+async def _auto_fill(service: WeighbillService, data: Dict) -> Dict:
+    """service.auto_fill_data 的并发版本：报单匹配与合同单价两次查询互不依赖，同时发出"""
+    delivery_fields, price_fields = await asyncio.gather(
+        asyncio.to_thread(service.match_delivery_fields, data),
+        asyncio.to_thread(service.contract_price_fields, data),
+    )
+    return {**data, **delivery_fields, **price_fields}
+
+
 @router.post("/ocr", summary="OCR 识别磅单", response_model=WeighbillOCRResponse)
 async def ocr_weighbill(
         file: UploadFile = File(..., description="磅单图片"),
@@ -200,42 +264,150 @@ async def ocr_weighbill(
         service: WeighbillService = Depends(get_weighbill_service)
 ):
     """OCR识别磅单"""
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
-    if file.content_type not in allowed_types:
+    if await sniff_image_mime(file) not in _ALLOWED_WEIGHBILL_TYPES:
         raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式")
 
-    temp_path = TEMP_UPLOADS_DIR / f"weighbill_{os.urandom(4).hex()}.jpg"
-    temp_path.parent.mkdir(parents=True, exist_ok=True)
-
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        processed_path = service.preprocess_image(str(temp_path))
-        result = service.recognize_weighbill(processed_path)
-
-        if processed_path != str(temp_path) and os.path.exists(processed_path):
-            os.remove(processed_path)
-        os.remove(temp_path)
+        result = await _ocr_one(file, service, auto_match)
 
         if not result["success"]:
             raise HTTPException(status_code=400, detail=result.get("error", "识别失败"))
 
-        ocr_data = result["data"]
-
-        if auto_match:
-            ocr_data = service.auto_fill_data(ocr_data)
-
-        return WeighbillOCRResponse(**ocr_data)
+        # 直接返回 dict，由 response_model 校验并序列化一次，不再先构造模型再二次校验
+        return result["data"]
 
     except HTTPException:
         raise
     except Exception as e:
-        if temp_path.exists():
-            os.remove(temp_path)
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
 
+@router.post("/ocr/batch", summary="批量 OCR 识别磅单", response_model=List[WeighbillOCRBatchItem])
+async def ocr_weighbills_batch(
+        files: List[UploadFile] = File(..., description="磅单图片，最多20张"),
+        auto_match: bool = Query(True, description="是否自动关联匹配"),
+        service: WeighbillService = Depends(get_weighbill_service)
+):
+    """
+    批量OCR识别磅单（如一天的磅单集中录入）
+    各图片并发识别（受 OCR 并发上限约束），单张失败不影响其它图片，按上传顺序返回。
+    """
+    if len(files) == 0:
+        raise HTTPException(status_code=400, detail="至少上传一张磅单图片")
+    if len(files) > 20:
+        raise HTTPException(status_code=400, detail="最多上传20张磅单图片")
+
+    for file in files:
+        if await sniff_image_mime(file) not in _ALLOWED_WEIGHBILL_TYPES:
+            raise HTTPException(status_code=400, detail=f"文件 {file.filename} 格式不支持，仅支持jpg/png/bmp")
+
+    results = await asyncio.gather(
+        *[_ocr_one(f, service, auto_match) for f in files], return_exceptions=True
+    )
+
+    items = []
+    for idx, (file, result) in enumerate(zip(files, results)):
+        if isinstance(result, Exception):
+            items.append(WeighbillOCRBatchItem(
+                index=idx, filename=file.filename, success=False, error=f"处理失败: {str(result)}"
+            ))
+        elif not result["success"]:
+            items.append(WeighbillOCRBatchItem(
+                index=idx, filename=file.filename, success=False, error=result.get("error", "识别失败")
+            ))
+        else:
+            items.append(WeighbillOCRBatchItem(
+                index=idx, filename=file.filename, success=True,
+                data=WeighbillOCRResponse.model_validate(result["data"]),
+            ))
+    return items
+
+
+# 异步OCR任务等待上限（wait=true 时），超过后返回当前状态由客户端继续轮询
+_OCR_JOB_WAIT_SECONDS = 30.0
+_OCR_JOB_POLL_INTERVAL = 0.5
+_OCR_JOB_STATUS = {
+    "PENDING": "pending",
+    "RECEIVED": "pending",
+    "STARTED": "processing",
+    "RETRY": "processing",
+    "SUCCESS": "success",
+    "FAILURE": "failed",
+    "REVOKED": "failed",
+}
+
+
+def _ocr_job_out(job_id: str) -> WeighbillOCRJobOut:
+    async_result = AsyncResult(job_id, app=celery_app)
+    status = _OCR_JOB_STATUS.get(async_result.state, "processing")
+    if status == "failed":
+        return WeighbillOCRJobOut(job_id=job_id, status=status, error=str(async_result.result))
+    if status != "success":
+        return WeighbillOCRJobOut(job_id=job_id, status=status)
+
+    result = async_result.result
+    if not result.get("success"):
+        return WeighbillOCRJobOut(job_id=job_id, status="failed", error=result.get("error", "识别失败"))
+    return WeighbillOCRJobOut(
+        job_id=job_id, status=status, data=WeighbillOCRResponse.model_validate(result["data"])
+    )
+
+
+async def _wait_ocr_job(job_id: str) -> WeighbillOCRJobOut:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + _OCR_JOB_WAIT_SECONDS
+    while True:
+        job = await asyncio.to_thread(_ocr_job_out, job_id)
+        if job.status in ("success", "failed") or loop.time() >= deadline:
+            return job
+        await asyncio.sleep(_OCR_JOB_POLL_INTERVAL)
+
+
+@router.post("/ocr/jobs", summary="提交异步 OCR 识别磅单", response_model=WeighbillOCRJobOut)
+async def submit_ocr_job(
+        file: UploadFile = File(..., description="磅单图片"),
+        auto_match: bool = Query(True, description="是否自动关联匹配"),
+        wait: bool = Query(False, description="是否在接口内等待结果（最多约30秒）"),
+):
+    """
+    异步OCR识别磅单：图片落盘后入队 Celery，由 Worker 识别，请求不占用 OCR 时长。
+    返回 job_id，客户端用 GET /weighbills/ocr/jobs/{job_id} 轮询；wait=true 时接口内等待结果。
+    """
+    if await sniff_image_mime(file) not in _ALLOWED_WEIGHBILL_TYPES:
+        raise HTTPException(status_code=400, detail="仅支持jpg/png/bmp格式")
+
+    # Worker 可能在其他进程/主机，图片放在共享的 uploads/temp 而不是本机 tmpfs，由任务识别后删除
+    # 任务设置过期时间；过期/丢失未执行的任务留下的图片由定时任务 sweep_stale_ocr_job_images 清理
+    image_path = TEMP_UPLOADS_DIR / f"{OCR_JOB_IMAGE_PREFIX}{unique_name_suffix()}.jpg"
+    await save_upload_file(file, image_path, compute_hash=False)
+    try:
+        async_result = await asyncio.to_thread(
+            recognize_weighbill_task.apply_async,
+            (str(image_path), auto_match),
+            expires=OCR_JOB_EXPIRES_SECONDS,
+        )
+    except Exception as e:
+        await remove_files(image_path)
+        logger.exception("weighbill ocr job enqueue failed")
+        raise HTTPException(
+            status_code=503,
+            detail="OCR 任务无法入队，请检查 Celery Broker（CELERY_BROKER_URL）与 Worker 是否已启动",
+        ) from e
+
+    if wait:
+        return await _wait_ocr_job(async_result.id)
+    return WeighbillOCRJobOut(job_id=async_result.id, status="pending")
+
+
+@router.get("/ocr/jobs/{job_id}", summary="查询异步 OCR 任务", response_model=WeighbillOCRJobOut)
+async def get_ocr_job(job_id: str):
+    """查询异步OCR任务状态与结果（未知的 job_id 同样返回 pending）"""
+    try:
+        return await asyncio.to_thread(_ocr_job_out, job_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"查询OCR任务失败: {str(e)}")
+
+
 @router.post("/create", summary="上传磅单", response_model=dict)
 async def upload_weighbill(
         delivery_id: int = Form(..., description="报单ID"),
@@ -313,13 +485,13 @@ async def upload_weighbill(
             "payee": payee,
         }
 
-        image_bytes = await weighbill_image.read()
-
-        result = service.upload_weighbill(
+        # 图片以文件对象传给服务层，落盘时分块拷贝；拷贝与写库在线程池中执行，不阻塞事件循环
+        result = await asyncio.to_thread(
+            service.upload_weighbill,
             delivery_id=delivery_id,
             product_name=product_name,
             data=data,
-            image_file=image_bytes,
+            image_file=upload_stream(weighbill_image),
             current_user=current_user,
             is_manual=is_manual
         )
@@ -430,7 +602,7 @@ async def modify_weighbill(
 ):
     """修改磅单（支持修改信息和图片）"""
     try:
-        existing = service.get_weighbill(weighbill_id)
+        existing = service.get_weighbill_key(weighbill_id)
         if not existing:
             raise HTTPException(status_code=404, detail="磅单不存在")
 
@@ -455,17 +627,14 @@ async def modify_weighbill(
         if 'unit_price' not in data and final_contract and final_product:
             data['unit_price'] = service.get_contract_price_by_product(final_contract, final_product)
 
-        image_bytes = None
-        if weighbill_image:
-            image_bytes = await weighbill_image.read()
-
         target_delivery_id = matched_delivery_id or existing.get('delivery_id')
 
-        result = service.upload_weighbill(
+        result = await asyncio.to_thread(
+            service.upload_weighbill,
             delivery_id=target_delivery_id,
             product_name=final_product,
             data=data,
-            image_file=image_bytes,
+            image_file=upload_stream(weighbill_image),
             current_user=current_user,
             is_manual=True
         )
@@ -473,34 +642,27 @@ async def modify_weighbill(
         if result["success"]:
             # ========== 新增：更新收款明细 ==========
             try:
-                from app.services.payment_services import PaymentService, calculate_payment_amount
+                from app.services.payment_services import PaymentService
                 from decimal import Decimal
-                
-                delivery_id = target_delivery_id
-                delivery_info = service.get_delivery_info(delivery_id)
-                
-                final_unit_price = data.get('unit_price') or existing.get('unit_price')
-                final_net_weight = data.get('net_weight') or existing.get('net_weight')
+
+                # 单价/净重/金额以 upload_weighbill 实际写入的值为准，不再回查磅单与报单
+                saved = result["data"]
+                final_unit_price = saved.get("unit_price")
+                final_net_weight = saved.get("net_weight")
+                final_total_amount = saved.get("total_amount")
                 final_contract_no = data.get('contract_no') or existing.get('contract_no')
-                
-                calculated_amount = None
-                if final_unit_price and final_net_weight:
-                    calculated_amount = calculate_payment_amount(
-                        Decimal(str(final_unit_price)), 
-                        Decimal(str(final_net_weight))
-                    )
-                
+
                 # 更新收款明细
                 PaymentService.create_or_update_by_weighbill(
                     weighbill_id=weighbill_id,
-                    delivery_id=delivery_id,
+                    delivery_id=target_delivery_id,
                     contract_no=final_contract_no,
-                    smelter_name=delivery_info.get("target_factory_name", "") if delivery_info else "",
+                    smelter_name=saved.get("target_factory_name") or "",
                     material_name=final_product,
                     unit_price=Decimal(str(final_unit_price)) if final_unit_price else None,
                     net_weight=Decimal(str(final_net_weight)) if final_net_weight else None,
-                    total_amount=calculated_amount,
-                    payee=delivery_info.get("payee", "") if delivery_info else "",
+                    total_amount=Decimal(str(final_total_amount)) if final_total_amount is not None else None,
+                    payee=saved.get("payee") or "",
                     payee_account="",
                     created_by=current_user.get("id")
                 )
@@ -560,11 +722,16 @@ async def list_weighbills(
         exact_collection_status: Optional[int] = Query(None, description="回款状态：0=待回款, 1=已回首笔, 2=已回款"),
         page: int = Query(1, ge=1),
         page_size: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description="游标分页：传上一页返回的 next_cursor，传入时忽略 page"),
+        with_total: Optional[bool] = Query(None, description="是否返回 total（默认 page 分页返回、游标分页不返回）"),
         service: WeighbillService = Depends(get_weighbill_service)
 ):
     """
     查询磅单列表（按报单ID分组）
 
+    分页：page/page_size 为偏移分页；翻页较深或滚动加载时传 cursor（上一页的 next_cursor），
+    按 (created_at, id) 游标定位，响应中 has_more 表示是否还有下一页。
+
     按司机/车辆筛选（与报单 pd_deliveries 一致）：
     - driver_name、driver_id_card、vehicle_no：模糊查询（LIKE）；
     - exact_driver_name、exact_driver_id_card、exact_vehicle_no：精确匹配；同一维度若同时传模糊与精确，以模糊为准。
@@ -574,8 +741,17 @@ async def list_weighbills(
     - exact_payout_status    : 打款状态（0待打款/1已打款）
     - exact_collection_status: 回款状态（0待回款/1已回首笔/2已回款）
     """
+    after = None
+    if cursor:
+        try:
+            after = WeighbillService.decode_list_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if with_total is None:
+        with_total = after is None
     try:
-        return service.list_weighbills_grouped(
+        return await asyncio.to_thread(
+            service.list_weighbills_grouped,
             exact_delivery_id=exact_delivery_id,
             exact_weighbill_id=exact_weighbill_id,
             exact_shipper=exact_shipper,
@@ -594,6 +770,8 @@ async def list_weighbills(
             exact_collection_status=exact_collection_status,
             page=page,
             page_size=page_size,
+            after=after,
+            with_total=with_total,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -632,6 +810,12 @@ async def get_weighbills_by_delivery(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _delete_weighbill_row(weighbill_id: int) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM pd_weighbills WHERE id = %s", (weighbill_id,))
+
+
 @router.delete("/{weighbill_id}", summary="删除磅单")
 async def delete_weighbill(
         weighbill_id: int,
@@ -639,20 +823,12 @@ async def delete_weighbill(
 ):
     """删除磅单"""
     try:
-        bill = service.get_weighbill(weighbill_id)
+        bill = await asyncio.to_thread(service.get_weighbill, weighbill_id)
         if not bill:
             raise HTTPException(status_code=404, detail="磅单不存在")
 
-        image_path = bill.get("weighbill_image")
-        if image_path and os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except Exception as e:
-                logger.warning(f"删除磅单图片失败: {e}")
-
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM pd_weighbills WHERE id = %s", (weighbill_id,))
+        await remove_files(bill.get("weighbill_image"))
+        await asyncio.to_thread(_delete_weighbill_row, weighbill_id)
 
         return {"success": True, "message": "磅单删除成功"}
 
@@ -737,6 +913,54 @@ async def audit_weighbill(
     raise HTTPException(status_code=400, detail=result.get("error", "审核失败"))
 
 
+@router.post("/batch-confirm", summary="批量确认磅单", response_model=dict)
+async def batch_confirm_weighbills(
+        request: WeighbillBatchConfirmRequest,
+        service: WeighbillService = Depends(get_weighbill_service),
+        current_user: dict = Depends(get_current_user)
+):
+    """
+    批量确认已上传、待确认且有单价的磅单（一条 UPDATE，总价在库内按 单价×净重 重算；已修正的不参与）；
+    总价有变化的磅单同步更新收款明细。返回实际确认条数。
+    """
+    result = await asyncio.to_thread(service.batch_confirm_weighbills, request.weighbill_ids)
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("error", "批量确认失败"))
+
+    changed = result["data"].pop("total_changed")
+    result["data"]["payment_detail_updated"] = await asyncio.to_thread(
+        _sync_confirmed_payment_details, service, changed, current_user.get("id")
+    )
+    return result
+
+
+def _sync_confirmed_payment_details(service: WeighbillService, bills: List[dict], user_id: Optional[int]) -> int:
+    """按批量确认后的新总价更新收款明细（与单张修改磅单一致），单条失败不影响其它；返回成功条数"""
+    from app.services.payment_services import PaymentService
+
+    updated = 0
+    for bill in bills:
+        try:
+            delivery_info = service.get_delivery_info(bill["delivery_id"]) or {}
+            PaymentService.create_or_update_by_weighbill(
+                weighbill_id=bill["weighbill_id"],
+                delivery_id=bill["delivery_id"],
+                contract_no=bill["contract_no"],
+                smelter_name=delivery_info.get("target_factory_name", ""),
+                material_name=bill["product_name"],
+                unit_price=bill["unit_price"],
+                net_weight=bill["net_weight"],
+                total_amount=bill["total_amount"],
+                payee=delivery_info.get("payee", ""),
+                payee_account="",
+                created_by=user_id,
+            )
+            updated += 1
+        except Exception as e:
+            logger.warning(f"批量确认后更新收款明细失败 weighbill_id={bill['weighbill_id']}: {e}")
+    return updated
+
+
 @router.put("/{weighbill_id}/contract", summary="修改磅单合同", response_model=dict)
 async def update_weighbill_contract(
         weighbill_id: int,
@@ -791,8 +1015,7 @@ async def batch_upload_weighbills(
         # 读取所有图片字节
         image_bytes_list = []
         for image_file in weighbill_images:
-            allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
-            if image_file.content_type not in allowed_types:
+            if await sniff_image_mime(image_file) not in _ALLOWED_WEIGHBILL_TYPES:
                 raise HTTPException(
                     status_code=400, 
                     detail=f"不支持的文件格式: {image_file.filename}，仅支持jpg/png/bmp"
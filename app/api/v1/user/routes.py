@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import HTTPException, APIRouter, Depends
 from pydantic import BaseModel, Field
 from typing import Optional, Dict
@@ -135,7 +137,7 @@ def check_manager_permission(current_user: dict):
 # ========== 认证接口 ==========
 
 @router.post("/auth/login", summary="用户登录", response_model=LoginResp)
-def login(body: LoginReq):
+async def login(body: LoginReq):
     """
     用户登录接口
     - 验证账号密码
@@ -143,7 +145,8 @@ def login(body: LoginReq):
     - 返回 JWT Token
     """
     try:
-        user = AuthService.authenticate(body.account, body.password)
+        # bcrypt 校验与查库放到线程中，不占用路由线程池
+        user = await asyncio.to_thread(AuthService.authenticate, body.account, body.password)
         
         # 检查用户状态
         status = user.get("status", 0)
@@ -181,7 +184,7 @@ def login(body: LoginReq):
 
 
 @router.post("/auth/logout", summary="用户登出")
-def logout(current_user: dict = Depends(get_current_user)):
+async def logout(current_user: dict = Depends(get_current_user)):
     """
     用户登出（前端清除token即可，后端可加入黑名单）
     """
@@ -190,7 +193,7 @@ def logout(current_user: dict = Depends(get_current_user)):
 
 
 @router.post("/auth/refresh", summary="刷新Token")
-def refresh_token(current_user: dict = Depends(get_current_user)):
+async def refresh_token(current_user: dict = Depends(get_current_user)):
     """
     刷新访问令牌
     """
@@ -207,11 +210,7 @@ def refresh_token(current_user: dict = Depends(get_current_user)):
 
 # ========== 当前用户接口 ==========
 
-@router.get("/me", summary="获取当前用户信息", response_model=UserResp)
-def get_me(current_user: dict = Depends(get_current_user)):
-    """
-    获取当前登录用户的详细信息
-    """
+def _load_user_profile(user_id: int) -> Optional[dict]:
     with get_conn() as conn:
         with conn.cursor() as cur:
             select_sql = build_dynamic_select(
@@ -220,17 +219,24 @@ def get_me(current_user: dict = Depends(get_current_user)):
                 where_clause="id=%s",
                 select_fields=["id", "name", "account", "role", "phone", "email", "status", "created_at", "updated_at"]
             )
-            cur.execute(select_sql, (current_user["id"],))
-            user = cur.fetchone()
-            
-            if not user:
-                raise HTTPException(status_code=404, detail="用户不存在")
-            
-            return UserResp(**user)
+            cur.execute(select_sql, (user_id,))
+            return cur.fetchone()
+
+
+@router.get("/me", summary="获取当前用户信息", response_model=UserResp)
+async def get_me(current_user: dict = Depends(get_current_user)):
+    """
+    获取当前登录用户的详细信息
+    """
+    user = await asyncio.to_thread(_load_user_profile, current_user["id"])
+    if not user:
+        raise HTTPException(status_code=404, detail="用户不存在")
+
+    return UserResp(**user)
 
 
 @router.put("/me", summary="更新当前用户信息")
-def update_me(body: UpdateUserReq, current_user: dict = Depends(get_current_user)):
+async def update_me(body: UpdateUserReq, current_user: dict = Depends(get_current_user)):
     """
     用户自主更新个人信息（不能修改角色）
     """
@@ -242,19 +248,20 @@ def update_me(body: UpdateUserReq, current_user: dict = Depends(get_current_user
         return {"msg": "无更新内容"}
     
     try:
-        AuthService.update_user(current_user["id"], **update_data)
+        await asyncio.to_thread(AuthService.update_user, current_user["id"], **update_data)
         return {"msg": "更新成功"}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.put("/me/password", summary="修改密码")
-def change_password(body: UpdatePwdReq, current_user: dict = Depends(get_current_user)):
+async def change_password(body: UpdatePwdReq, current_user: dict = Depends(get_current_user)):
     """
     用户自主修改密码
     """
     try:
-        AuthService.change_password(
+        await asyncio.to_thread(
+            AuthService.change_password,
             current_user["id"],
             body.old_password,
             body.new_password
@@ -325,7 +332,7 @@ def list_managers(
 
 
 @router.get("/users", summary="用户列表")
-def list_users(
+async def list_users(
     page: int = 1,
     size: int = 20,
     role: Optional[str] = None,
@@ -339,7 +346,8 @@ def list_users(
     if current_user.get("role") not in ["管理员", "大区经理"]:
         raise HTTPException(status_code=403, detail="无权查看用户列表")
     
-    result = AuthService.list_users(
+    result = await asyncio.to_thread(
+        AuthService.list_users,
         page=page,
         size=size,
         role=role,
@@ -349,21 +357,28 @@ def list_users(
 
 
 @router.get("/users/{user_id}", summary="用户详情")
-def get_user(
+async def get_user(
     user_id: int,
     current_user: dict = Depends(get_current_user)
 ):
     """
     获取指定用户详情
     """
-    user = AuthService.get_user_by_id(user_id)
+    user = await asyncio.to_thread(AuthService.get_user_by_id, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     return user
 
 
+def _reset_role_permissions(user_id: int, role: str) -> None:
+    PermissionService.update_permissions(user_id, role=role)
+    # 重置为角色默认模板
+    PermissionService.delete_permissions(user_id)
+    PermissionService.create_default_permissions(user_id, role)
+
+
 @router.put("/users/{user_id}", summary="更新用户信息")
-def update_user(
+async def update_user(
     user_id: int,
     body: UpdateUserReq,
     current_user: dict = Depends(get_current_user)
@@ -372,7 +387,7 @@ def update_user(
     更新指定用户信息
     """
     # 权限检查：只能管理下级角色
-    target_user = AuthService.get_user_by_id(user_id)
+    target_user = await asyncio.to_thread(AuthService.get_user_by_id, user_id)
     if not target_user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
@@ -393,15 +408,12 @@ def update_user(
         raise HTTPException(status_code=400, detail="不能修改自己的角色")
     
     try:
-        AuthService.update_user(user_id, **body.model_dump(exclude_none=True))
+        await asyncio.to_thread(AuthService.update_user, user_id, **body.model_dump(exclude_none=True))
 
         # 新增：如果修改了角色，同步更新权限表
         if body.role:
             try:
-                PermissionService.update_permissions(user_id, role=body.role)
-                # 重置为角色默认模板
-                PermissionService.delete_permissions(user_id)
-                PermissionService.create_default_permissions(user_id, body.role)
+                await asyncio.to_thread(_reset_role_permissions, user_id, body.role)
             except Exception as e:
                 logger.warning(f"同步更新权限失败: {e}")
 
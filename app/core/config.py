@@ -100,6 +100,10 @@ def load_settings() -> "Settings":
             "INTELLIGENT_PREDICTION_SCHEDULE_CRON_MINUTE", 30
         ),
         enable_manual_db_init=_env_bool("ENABLE_MANUAL_DB_INIT", False),
+        ocr_concurrency=max(1, _env_int("OCR_CONCURRENCY", os.cpu_count() or 4)),
+        ocr_max_concurrency=max(1, _env_int("OCR_MAX_CONCURRENCY", 4)),
+        ocr_min_interval_seconds=max(0.0, _env_float("OCR_MIN_INTERVAL_SECONDS", 0.0)),
+        upload_max_concurrency=max(1, _env_int("UPLOAD_MAX_CONCURRENCY", 16)),
         intelligent_prediction_history_purge_secret=(
             os.getenv("INTELLIGENT_PREDICTION_HISTORY_PURGE_SECRET") or ""
         ).strip(),
@@ -139,6 +143,13 @@ class Settings(BaseModel):
     prediction_prometheus_enabled: bool = False
     # 为 true 时开放 GET /init-db（默认关闭，避免公网误暴露建表能力）
     enable_manual_db_init: bool = False
+    # OCR 线程池大小（预处理/识别在 C 扩展中释放 GIL，线程可并行）
+    ocr_concurrency: int = 4
+    # 同时在途的 OCR 识别任务上限；最小调用间隔（秒，0 表示不限速）
+    ocr_max_concurrency: int = 4
+    ocr_min_interval_seconds: float = 0.0
+    # 同时在线程池中落盘的上传任务上限（报货单联单/凭证图片）
+    upload_max_concurrency: int = 16
 
     intelligent_prediction_schedule_enabled: bool = False
     intelligent_prediction_schedule_horizon_days: int = 30
@@ -1,5 +1,26 @@
+import os
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 UPLOADS_DIR = PROJECT_ROOT / "uploads"
 TEMP_UPLOADS_DIR = UPLOADS_DIR / "temp"
+CONTRACT_UPLOADS_DIR = UPLOADS_DIR / "contracts"
+PAYMENT_RECEIPT_UPLOADS_DIR = UPLOADS_DIR / "payment_receipts"
+
+
+def _default_ocr_temp_dir() -> Path:
+    # Linux 下放到 tmpfs（/dev/shm），识别前后的中间图片只在内存中周转，不落块设备
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm / "pd_ocr"
+    return TEMP_UPLOADS_DIR
+
+
+# OCR 识别用的临时图片目录（上传原图、预处理结果），识别完即删；可用 OCR_TEMP_DIR 覆盖
+OCR_TEMP_DIR = Path(os.getenv("OCR_TEMP_DIR") or _default_ocr_temp_dir())
+
+
+def ensure_upload_dirs() -> None:
+    """启动时创建上传目录（请求处理中不再 mkdir）"""
+    for path in (UPLOADS_DIR, TEMP_UPLOADS_DIR, OCR_TEMP_DIR, CONTRACT_UPLOADS_DIR, PAYMENT_RECEIPT_UPLOADS_DIR):
+        path.mkdir(parents=True, exist_ok=True)
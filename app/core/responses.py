@@ -0,0 +1,45 @@
+"""
+JSON 响应类
+
+ORJSONResponse：列表/汇总等大响应使用 orjson（Rust 实现）序列化，
+比标准库 json 快数倍；未安装 orjson 时回退到 JSONResponse 的默认实现。
+FastAPI 自带的 ORJSONResponse 在新版本中已标记弃用，这里自行维护一份。
+
+路由直接返回 ORJSONResponse(data) 时会跳过 FastAPI 的 jsonable_encoder 递归遍历；
+数据库原样取出的 Decimal / timedelta 由 _default 按 jsonable_encoder 的规则转换。
+"""
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _default(obj: Any) -> Any:
+    """orjson 不支持的类型：与 jsonable_encoder 输出保持一致"""
+    if isinstance(obj, Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    raise TypeError
+
+
+class ORJSONResponse(JSONResponse):
+    """使用 orjson 序列化的 JSON 响应"""
+
+    def render(self, content: Any) -> bytes:
+        if not ORJSON_AVAILABLE:
+            return super().render(jsonable_encoder(content))
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
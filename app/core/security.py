@@ -1,17 +1,65 @@
+import hashlib
+import hmac
+import secrets
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict
 
 import bcrypt
 import jwt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from app.utils.ttl_cache import TTLCache
+
+# 新密码使用 argon2id；已有的 bcrypt 哈希按前缀识别继续用 bcrypt 校验，
+# 登录成功后由调用方按 password_needs_rehash 换成 argon2id
+_argon2_hasher = PasswordHasher()
+_BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+_ARGON2_PREFIX = "$argon2"
+
+# 密码校验结果短时缓存：同一账号短时间内重复登录时跳过 KDF 计算。
+# 键为进程内随机密钥对 (密码, 哈希) 的 HMAC，缓存中不保留明文；改密后哈希变化即不再命中。
+_VERIFY_CACHE = TTLCache(maxsize=10_000, ttl=60)
+_VERIFY_CACHE_KEY = secrets.token_bytes(32)
 
 
 def hash_password(password: str) -> str:
-    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
-    return hashed.decode("utf-8")
+    return _argon2_hasher.hash(password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """旧的 bcrypt 哈希或参数已过时的 argon2 哈希需要在登录成功后重新生成"""
+    if hashed_password.startswith(_BCRYPT_PREFIXES):
+        return True
+    if hashed_password.startswith(_ARGON2_PREFIX):
+        try:
+            return _argon2_hasher.check_needs_rehash(hashed_password)
+        except InvalidHashError:
+            return False
+    return False
+
+
+def _check_password(password: str, hashed_password: str) -> bool:
+    if hashed_password.startswith(_BCRYPT_PREFIXES):
+        return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+    if hashed_password.startswith(_ARGON2_PREFIX):
+        try:
+            return _argon2_hasher.verify(hashed_password, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return False
 
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+    message = password.encode("utf-8") + b"\0" + hashed_password.encode("utf-8")
+    key = hmac.new(_VERIFY_CACHE_KEY, message, hashlib.sha256).digest()
+    cached = _VERIFY_CACHE.get(key)
+    if cached is not None:
+        return cached
+    result = _check_password(password, hashed_password)
+    _VERIFY_CACHE.set(key, result)
+    return result
 
 
 def create_access_token(
@@ -29,5 +77,17 @@ def create_access_token(
     return jwt.encode(payload, secret, algorithm=algorithm)
 
 
+# 已验签 token 的 payload 缓存：同一请求里访问日志中间件与 get_current_user 各解码一次，
+# 同一客户端的后续请求也重复携带相同 token。只缓存验签成功的结果，取用时再核对 exp。
+_DECODE_CACHE = TTLCache(maxsize=4096, ttl=300)
+
+
 def decode_token(token: str, secret: str, algorithm: str) -> Dict[str, Any]:
-    return jwt.decode(token, secret, algorithms=[algorithm])
+    key = (token, secret, algorithm)
+    payload = _DECODE_CACHE.get(key)
+    if payload is not None and payload.get("exp", 0) > time.time():
+        return dict(payload)
+    payload = jwt.decode(token, secret, algorithms=[algorithm])
+    if "exp" in payload:
+        _DECODE_CACHE.set(key, payload)
+    return dict(payload)
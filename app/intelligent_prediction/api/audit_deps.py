@@ -9,6 +9,7 @@ import jwt
 from fastapi import Header, Request
 
 from app.core.config import settings
+from app.core.security import decode_token
 from core.auth import get_user_identity_from_authorization
 
 
@@ -24,11 +25,7 @@ def try_decode_uid(authorization: Optional[str]) -> Optional[int]:
         return None
     token = authorization.split(" ", 1)[1].strip()
     try:
-        payload = jwt.decode(
-            token,
-            settings.jwt_secret,
-            algorithms=[settings.jwt_algorithm],
-        )
+        payload = decode_token(token, settings.jwt_secret, settings.jwt_algorithm)
     except jwt.PyJWTError:
         return None
     uid = payload.get("uid") or payload.get("sub")
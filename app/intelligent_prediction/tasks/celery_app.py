@@ -1,4 +1,4 @@
-"""Celery 应用（智能预测异步导出）。"""
+"""Celery 应用（智能预测异步导出、磅单异步 OCR）。"""
 
 from __future__ import annotations
 
@@ -21,3 +21,4 @@ celery_app.conf.update(
 )
 
 import app.intelligent_prediction.tasks.export_tasks  # noqa: E402,F401
+import app.tasks.weighbill_ocr  # noqa: E402,F401
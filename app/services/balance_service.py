@@ -1,43 +1,68 @@
 """
 磅单结余管理 + 支付回单处理服务（优化版）
 """
+import copy
+import hashlib
+import io
 import json
 import logging
-import tempfile
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Union
 
 from PIL import Image, ImageEnhance, ImageFilter
 
 try:
-    from rapidocr_onnxruntime import RapidOCR
+    import cv2
+    import numpy as np
 
-    RAPIDOCR_AVAILABLE = True
+    CV2_AVAILABLE = True
 except ImportError:
-    RAPIDOCR_AVAILABLE = False
+    CV2_AVAILABLE = False
 
-from app.core.paths import UPLOADS_DIR
+from app.core.paths import PAYMENT_RECEIPT_UPLOADS_DIR
 from app.services.contract_service import get_conn
+from app.utils.ocr_pool import get_ocr_engine
+from app.utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
-UPLOAD_DIR = UPLOADS_DIR / "payment_receipts"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+UPLOAD_DIR = PAYMENT_RECEIPT_UPLOADS_DIR
+
+# 回单识别前图片长边上限（像素）
+_OCR_MAX_SIDE = 2000
+# 小图免预处理直接识别的条件：文件大小上限、首遍平均置信度下限
+_FAST_PASS_MAX_BYTES = 2 * 1024 * 1024
+_FAST_PASS_MIN_CONFIDENCE = 0.9
+
+# 回单识别结果缓存：键为 (OCR 后端, 原图字节 SHA-256)，与 save_upload_file 返回的摘要一致；
+# 同一张回单重复上传/重试时直接复用，免去预处理与识别
+_RECEIPT_OCR_BACKEND = "rapidocr"
+_RECEIPT_OCR_CACHE = TTLCache(maxsize=512, ttl=3600)
+
+def _to_decimal(value: Any) -> Decimal:
+    """
+    转为 Decimal：pymysql 返回的 DECIMAL 列本身就是 Decimal，直接使用，省去 str() 再解析；
+    整数精确转换；浮点等其它类型仍经 str() 转换，避免二进制浮点误差
+    """
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    return Decimal(str(value))
 
 
 class BalanceService:
     """磅单结余服务"""
 
     def __init__(self):
-        self.ocr = None
         self._balance_has_payee_bank_name = None
         self._weighbill_has_warehouse_name = None
-        if RAPIDOCR_AVAILABLE:
-            try:
-                self.ocr = RapidOCR()
-                logger.info("支付回单OCR初始化成功")
-            except Exception as e:
-                logger.error(f"支付回单OCR初始化失败: {e}")
+        self._receipt_has_image_hash = None
+
+    @property
+    def ocr(self):
+        """RapidOCR 引擎（进程内共享、懒加载，不可用时为 None）"""
+        return get_ocr_engine()
 
     def _has_balance_payee_bank_name_column(self) -> bool:
         if self._balance_has_payee_bank_name is not None:
@@ -69,6 +94,22 @@ class BalanceService:
 
         return self._weighbill_has_warehouse_name
 
+    def _has_receipt_image_hash_column(self) -> bool:
+        if self._receipt_has_image_hash is not None:
+            return self._receipt_has_image_hash
+
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SHOW COLUMNS FROM pd_payment_receipts LIKE 'receipt_image_hash'")
+                    self._receipt_has_image_hash = cur.fetchone() is not None
+        except Exception as e:
+            # 查询失败不缓存结果，下次调用重试，避免一次连库异常让去重在进程生命周期内失效
+            logger.warning(f"检查 pd_payment_receipts.receipt_image_hash 字段失败: {e}")
+            return False
+
+        return self._receipt_has_image_hash
+
     @staticmethod
     def _normalize_text(value: Optional[Any]) -> Optional[str]:
         if value is None:
@@ -203,7 +244,20 @@ class BalanceService:
                     columns = [desc[0] for desc in cur.description]
                     rows = cur.fetchall()
 
+                    insert_fields = [
+                        "contract_no", "delivery_id", "weighbill_id", "driver_name", "driver_phone",
+                        "vehicle_no", "payee_id", "payee_name", "payee_account", "purchase_unit_price",
+                        "payable_amount", "paid_amount", "balance_amount", "payment_status"
+                    ]
+                    has_bank_name = self._has_balance_payee_bank_name_column()
+                    if has_bank_name:
+                        insert_fields.insert(9, "payee_bank_name")
+
+                    # 先逐行算好插入值，再一次 executemany（pymysql 合并为多行 INSERT），避免逐条往返
+                    rows_to_insert = []
                     generated = []
+                    payee_cache: Dict[tuple, Dict[str, Any]] = {}
+                    divisor = Decimal('1.048')
                     for row in rows:
                         data = dict(zip(columns, row))
 
@@ -212,22 +266,17 @@ class BalanceService:
                         unit_price = data.get('unit_price') or 0
                         # 应付金额按税率换算并保留两位小数
                         payable = (
-                            Decimal(str(net_weight)) * Decimal(str(unit_price)) / Decimal('1.048')
+                            _to_decimal(net_weight) * _to_decimal(unit_price) / divisor
                         ).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
-                        # 确定收款人姓名：优先payee，否则driver_name
+                        # 确定收款人姓名：优先payee，否则driver_name；同一仓库+收款人只查一次
                         receiver_name = data.get('payee') if data.get('payee') else data.get('driver_name')
-                        payee_fields = self._resolve_balance_payee_fields(
-                            cur,
-                            data.get('warehouse_name'),
-                            receiver_name,
-                        )
+                        payee_key = (data.get('warehouse_name'), receiver_name)
+                        payee_fields = payee_cache.get(payee_key)
+                        if payee_fields is None:
+                            payee_fields = self._resolve_balance_payee_fields(cur, *payee_key)
+                            payee_cache[payee_key] = payee_fields
 
-                        insert_fields = [
-                            "contract_no", "delivery_id", "weighbill_id", "driver_name", "driver_phone",
-                            "vehicle_no", "payee_id", "payee_name", "payee_account", "purchase_unit_price",
-                            "payable_amount", "paid_amount", "balance_amount", "payment_status"
-                        ]
                         insert_values = [
                             data.get('contract_no'),
                             data.get('delivery_id'),
@@ -244,23 +293,12 @@ class BalanceService:
                             payable,
                             self.PAY_STATUS_PENDING
                         ]
-
-                        if self._has_balance_payee_bank_name_column():
-                            insert_fields.insert(9, "payee_bank_name")
+                        if has_bank_name:
                             insert_values.insert(9, payee_fields.get('payee_bank_name'))
-
-                        placeholders = ", ".join(["%s"] * len(insert_values))
-                        cur.execute(
-                            f"""
-                            INSERT INTO pd_balance_details 
-                            ({', '.join(insert_fields)})
-                            VALUES ({placeholders})
-                            """,
-                            tuple(insert_values)
-                        )
+                        rows_to_insert.append(tuple(insert_values))
 
                         generated.append({
-                            'balance_id': cur.lastrowid,
+                            'balance_id': None,
                             'weighbill_id': data.get('weighbill_id'),
                             'driver_name': data.get('driver_name'),
                             'payee_name': payee_fields.get('payee_name'),
@@ -270,6 +308,33 @@ class BalanceService:
                             'payable_amount': float(payable)
                         })
 
+                    if rows_to_insert:
+                        placeholders = ", ".join(["%s"] * len(insert_fields))
+                        conn.begin()
+                        cur.executemany(
+                            f"""
+                            INSERT INTO pd_balance_details 
+                            ({', '.join(insert_fields)})
+                            VALUES ({placeholders})
+                            """,
+                            rows_to_insert
+                        )
+                        # executemany 只给出首行自增ID，且超长语句会被拆分；按磅单ID回查新行ID
+                        weighbill_ids = [item['weighbill_id'] for item in generated]
+                        cur.execute(
+                            f"""
+                            SELECT weighbill_id, MAX(id)
+                            FROM pd_balance_details
+                            WHERE weighbill_id IN ({', '.join(['%s'] * len(weighbill_ids))})
+                            GROUP BY weighbill_id
+                            """,
+                            tuple(weighbill_ids)
+                        )
+                        balance_ids = {r[0]: r[1] for r in cur.fetchall()}
+                        conn.commit()
+                        for item in generated:
+                            item['balance_id'] = balance_ids.get(item['weighbill_id'])
+
                     if not generated:
                         message = "没有符合条件的磅单可生成结余"
                         if weighbill_id:
@@ -358,42 +423,34 @@ class BalanceService:
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    # 获取当前数据
+                    # 结余与状态由已存的应付/已付金额在一条 UPDATE 中算出，无需先读后写
+                    cur.execute("""
+                        UPDATE pd_balance_details 
+                        SET balance_amount = payable_amount - paid_amount,
+                            payment_status = CASE
+                                WHEN paid_amount <= 0 THEN %s
+                                WHEN paid_amount >= payable_amount THEN %s
+                                ELSE %s
+                            END
+                        WHERE id = %s
+                    """, (self.PAY_STATUS_PENDING, self.PAY_STATUS_SETTLED, self.PAY_STATUS_PARTIAL, balance_id))
+
                     cur.execute("""
-                        SELECT payable_amount, paid_amount 
+                        SELECT payable_amount, paid_amount, balance_amount, payment_status
                         FROM pd_balance_details 
                         WHERE id = %s
                     """, (balance_id,))
-
                     row = cur.fetchone()
                     if not row:
                         return {"success": False, "error": "结余明细不存在"}
 
-                    payable, paid = Decimal(str(row[0])), Decimal(str(row[1]))
-                    balance = payable - paid
-
-                    # 确定状态
-                    if paid <= 0:
-                        status = self.PAY_STATUS_PENDING
-                    elif paid >= payable:
-                        status = self.PAY_STATUS_SETTLED
-                    else:
-                        status = self.PAY_STATUS_PARTIAL
-
-                    # 更新
-                    cur.execute("""
-                        UPDATE pd_balance_details 
-                        SET balance_amount = %s, payment_status = %s 
-                        WHERE id = %s
-                    """, (balance, status, balance_id))
-
                     return {
                         "success": True,
                         "data": {
-                            'payable': float(payable),
-                            'paid': float(paid),
-                            'balance': float(balance),
-                            'status': status
+                            'payable': float(row[0]),
+                            'paid': float(row[1]),
+                            'balance': float(row[2]),
+                            'status': row[3]
                         }
                     }
 
@@ -495,34 +552,93 @@ class BalanceService:
 
     # ========== 支付回单OCR（待完善） ==========
 
-    def preprocess_image(self, image_path: str) -> str:
-        """图片预处理"""
-        try:
-            img = Image.open(image_path)
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)
-            img = img.filter(ImageFilter.SHARPEN)
+    @staticmethod
+    def _enhance_image(img: Image.Image) -> Image.Image:
+        """
+        把长边限制在 2000 像素以内，再增强对比度、锐化（无 OpenCV 时的备用路径）。
+        先缩小再增强：对比度/锐化只处理缩小后的像素，大图时工作量成倍减少
+        """
+        if img.mode != "RGB":
+            img = img.convert("RGB")
 
-            max_size = 2000
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+        max_size = _OCR_MAX_SIDE
+        if max(img.size) > max_size:
+            ratio = max_size / max(img.size)
+            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
 
-            temp_path = tempfile.mktemp(suffix=".jpg")
-            img.save(temp_path, "JPEG", quality=95)
-            return temp_path
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(1.5)
+        return img.filter(ImageFilter.SHARPEN)
 
+    @staticmethod
+    def _enhance_gray(gray: "np.ndarray") -> "np.ndarray":
+        """
+        OpenCV 预处理（输入单通道灰度图）：长边超过 2000 像素先按 INTER_AREA 缩小，
+        再做 CLAHE 局部对比度增强和双边滤波去噪；单通道处理的数据量只有 RGB 的 1/3
+        """
+        h, w = gray.shape[:2]
+        if max(h, w) > _OCR_MAX_SIDE:
+            ratio = _OCR_MAX_SIDE / max(h, w)
+            gray = cv2.resize(gray, (int(w * ratio), int(h * ratio)), interpolation=cv2.INTER_AREA)
+        gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+        return cv2.bilateralFilter(gray, 5, 75, 75)
+
+    def preprocess_image_bytes(self, data: bytes) -> Union["np.ndarray", Image.Image, bytes]:
+        """内存中预处理图片，返回可直接交给 OCR 的灰度数组（或 PIL 图像）；失败时原样返回字节"""
+        try:
+            if CV2_AVAILABLE:
+                gray = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+                if gray is not None:
+                    return self._enhance_gray(gray)
+            return self._enhance_image(Image.open(io.BytesIO(data)))
         except Exception as e:
             logger.error(f"预处理失败: {e}")
-            return image_path
+            return data
+
+    @staticmethod
+    def _is_small_clean_image(data: bytes) -> bool:
+        """小图（≤2MB、RGB/灰度、长边不超过上限）：只读文件头判断，不解码像素"""
+        if len(data) > _FAST_PASS_MAX_BYTES:
+            return False
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                return img.mode in ("RGB", "L") and max(img.size) <= _OCR_MAX_SIDE
+        except Exception:
+            return False
+
+    def recognize_payment_receipt_bytes(self, data: bytes) -> Dict[str, Any]:
+        """
+        识别回单图片字节：小而清晰的图先不预处理直接识别，平均置信度达标且识别出金额即返回；
+        否则（或大图）预处理后再识别，避免对干净图片做无谓的解码-增强-编码
+        """
+        if self._is_small_clean_image(data):
+            result = self.recognize_payment_receipt(data)
+            if (
+                result.get("ocr_success")
+                and result.get("ocr_confidence", 0) >= _FAST_PASS_MIN_CONFIDENCE
+                and result["data"].get("amount") is not None
+            ):
+                return result
+        return self.recognize_payment_receipt(self.preprocess_image_bytes(data))
+
+    @staticmethod
+    def get_cached_receipt_ocr(image_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+        """按原图 SHA-256 取缓存的回单识别结果（返回副本），未命中为 None"""
+        if not image_hash:
+            return None
+        cached = _RECEIPT_OCR_CACHE.get((_RECEIPT_OCR_BACKEND, image_hash))
+        return copy.deepcopy(cached) if cached is not None else None
+
+    @staticmethod
+    def cache_receipt_ocr(image_hash: Optional[str], result: Dict[str, Any]) -> None:
+        """缓存回单识别结果；仅缓存识别成功的结果，OCR 未就绪/失败时下次重试"""
+        if image_hash and result.get("ocr_success"):
+            _RECEIPT_OCR_CACHE.set((_RECEIPT_OCR_BACKEND, image_hash), copy.deepcopy(result))
 
-    def recognize_payment_receipt(self, image_path: str) -> Dict[str, Any]:
+    def recognize_payment_receipt(self, image: Union[str, bytes, Image.Image, "np.ndarray"]) -> Dict[str, Any]:
         """
-        OCR识别支付回单
+        OCR识别支付回单（image 可以是文件路径、图片字节、PIL 图像或 OpenCV 数组）
         支持格式：农业银行等标准转账回单格式
         """
         if not self.ocr:
@@ -533,7 +649,7 @@ class BalanceService:
             }
 
         try:
-            result, elapse = self.ocr(image_path)
+            result, elapse = self.ocr(image)
             total_elapse = sum(elapse) if isinstance(elapse, list) else float(elapse or 0)
 
             if not result:
@@ -591,7 +707,8 @@ class BalanceService:
             return {
                 "success": True,
                 "data": data,
-                "ocr_success": True
+                "ocr_success": True,
+                "ocr_confidence": sum(line["confidence"] for line in text_lines) / len(text_lines)
             }
 
         except Exception as e:
@@ -884,21 +1001,26 @@ class BalanceService:
                                date_range: int = 7) -> List[Dict]:
         """
         根据收款人+金额匹配待支付结余
-        使用组合索引 (payee_name, amount) 提高查询效率
+        使用组合索引 idx_balance_match (payment_status, driver_name, payable_amount, created_at)：
+        先按姓名前缀匹配（可走索引范围扫描），无结果再退回包含匹配
         """
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    # 查询待支付数据，允许金额误差0.01
-                    cur.execute("""
+                    # 查询待支付数据，允许金额误差0.01（BETWEEN 写法可用索引，ABS() 不行）
+                    sql = """
                         SELECT * FROM pd_balance_details 
                         WHERE payment_status IN (0, 1)
                         AND driver_name LIKE %s
-                        AND ABS(payable_amount - %s) <= 0.01
+                        AND payable_amount BETWEEN %s - 0.01 AND %s + 0.01
                         AND created_at >= DATE_SUB(NOW(), INTERVAL %s DAY)
                         ORDER BY balance_amount DESC, created_at ASC
                         LIMIT 10
-                    """, (f"%{payee_name}%", amount, date_range))
+                    """
+                    for pattern in (f"{payee_name}%", f"%{payee_name}%"):
+                        cur.execute(sql, (pattern, amount, amount, date_range))
+                        if cur.rowcount:
+                            break
 
                     columns = [desc[0] for desc in cur.description]
                     results = []
@@ -934,7 +1056,7 @@ class BalanceService:
                     if not row:
                         return {"success": False, "error": "支付回单不存在"}
 
-                    receipt_amount, ocr_status = Decimal(str(row[0])), row[1]
+                    receipt_amount, ocr_status = _to_decimal(row[0]), row[1]
 
                     if ocr_status == self.OCR_STATUS_VERIFIED:
                         return {"success": False, "error": "该回单已核销"}
@@ -942,22 +1064,35 @@ class BalanceService:
                     total_settled = Decimal('0')
                     settled_items = []
 
+                    # 一次取出（并锁定）全部涉及的结余明细，金额在内存中按明细顺序逐条计算，
+                    # 再用一条 UPDATE + 一条多行 INSERT 写回，往返次数与明细条数无关
+                    balance_ids = list(dict.fromkeys(
+                        item.get('balance_id') for item in balance_items if item.get('balance_id') is not None
+                    ))
+                    states = {}
+                    conn.begin()
+                    if balance_ids:
+                        cur.execute(f"""
+                            SELECT id, payable_amount, paid_amount
+                            FROM pd_balance_details 
+                            WHERE id IN ({', '.join(['%s'] * len(balance_ids))})
+                            FOR UPDATE
+                        """, tuple(balance_ids))
+                        states = {
+                            r[0]: {'payable': _to_decimal(r[1]), 'paid': _to_decimal(r[2])}
+                            for r in cur.fetchall()
+                        }
+
+                    settlements = {}
                     for item in balance_items:
                         balance_id = item.get('balance_id')
-                        settle_amount = Decimal(str(item.get('amount', 0)))
-
-                        # 获取结余当前状态
-                        cur.execute("""
-                            SELECT payable_amount, paid_amount, payment_status
-                            FROM pd_balance_details 
-                            WHERE id = %s
-                        """, (balance_id,))
+                        settle_amount = _to_decimal(item.get('amount', 0))
 
-                        row = cur.fetchone()
-                        if not row:
+                        state = states.get(balance_id)
+                        if state is None:
                             continue
 
-                        payable, paid, status = Decimal(str(row[0])), Decimal(str(row[1])), row[2]
+                        payable, paid = state['payable'], state['paid']
 
                         # 验证核销金额
                         remaining = payable - paid
@@ -974,21 +1109,8 @@ class BalanceService:
                         else:
                             new_status = self.PAY_STATUS_PENDING
 
-                        # 更新结余明细
-                        new_balance = payable - new_paid
-                        cur.execute("""
-                            UPDATE pd_balance_details 
-                            SET paid_amount = %s, balance_amount = %s, payment_status = %s 
-                            WHERE id = %s
-                        """, (new_paid, new_balance, new_status, balance_id))
-
-                        # 插入关联表
-                        cur.execute("""
-                            INSERT INTO pd_receipt_settlements 
-                            (receipt_id, balance_id, settled_amount)
-                            VALUES (%s, %s, %s)
-                            ON DUPLICATE KEY UPDATE settled_amount = %s
-                        """, (receipt_id, balance_id, settle_amount, settle_amount))
+                        state.update(paid=new_paid, status=new_status)
+                        settlements[balance_id] = settle_amount
 
                         total_settled += settle_amount
                         settled_items.append({
@@ -997,6 +1119,31 @@ class BalanceService:
                             'status': new_status
                         })
 
+                    if settlements:
+                        changed = [(bid, states[bid]) for bid in settlements]
+                        case_params = []
+                        for column in ('paid', 'balance', 'status'):
+                            for bid, state in changed:
+                                value = state['payable'] - state['paid'] if column == 'balance' else state[column]
+                                case_params.extend([bid, value])
+                        when = " ".join(["WHEN %s THEN %s"] * len(changed))
+                        # 更新结余明细
+                        cur.execute(f"""
+                            UPDATE pd_balance_details 
+                            SET paid_amount = CASE id {when} END,
+                                balance_amount = CASE id {when} END,
+                                payment_status = CASE id {when} END
+                            WHERE id IN ({', '.join(['%s'] * len(changed))})
+                        """, tuple(case_params) + tuple(settlements))
+
+                        # 插入关联表（executemany 合并为一条多行 INSERT）
+                        cur.executemany("""
+                            INSERT INTO pd_receipt_settlements 
+                            (receipt_id, balance_id, settled_amount)
+                            VALUES (%s, %s, %s)
+                            ON DUPLICATE KEY UPDATE settled_amount = VALUES(settled_amount)
+                        """, [(receipt_id, bid, amount) for bid, amount in settlements.items()])
+
                     # 更新回单状态
                     new_receipt_status = self.OCR_STATUS_VERIFIED if total_settled >= receipt_amount else self.OCR_STATUS_CONFIRMED
                     cur.execute("""
@@ -1004,6 +1151,7 @@ class BalanceService:
                         SET ocr_status = %s 
                         WHERE id = %s
                     """, (new_receipt_status, receipt_id))
+                    conn.commit()
 
                     return {
                         "success": True,
@@ -1022,9 +1170,64 @@ class BalanceService:
 
     # ========== CRUD操作 ==========
 
+    def find_payment_receipt_by_image_hashes(self, image_hashes: List[str]) -> Optional[Dict]:
+        """
+        所有图片（张数、顺序、内容）都与已有支付回单一致时返回该回单（重复上传判定）。
+        按主图片 SHA-256 走索引取候选，其余图片再对候选已存的文件计算摘要比对
+        """
+        if not image_hashes or not image_hashes[0] or not self._has_receipt_image_hash_column():
+            return None
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT id, receipt_no, payee_name, amount, payment_date, receipt_images
+                        FROM pd_payment_receipts
+                        WHERE receipt_image_hash = %s
+                        ORDER BY id
+                    """, (image_hashes[0],))
+                    rows = cur.fetchall()
+        except Exception as e:
+            logger.error(f"按图片哈希查询支付回单失败: {e}")
+            return None
+
+        for row in rows:
+            if not self._receipt_images_match(row[5], image_hashes):
+                continue
+            return {
+                "id": row[0],
+                "receipt_no": row[1],
+                "payee_name": row[2],
+                "amount": float(row[3]) if row[3] is not None else None,
+                "payment_date": str(row[4]) if row[4] else None,
+            }
+        return None
+
+    @staticmethod
+    def _receipt_images_match(images_json: Optional[str], image_hashes: List[str]) -> bool:
+        """已有回单的图片列表与本次上传逐张一致（主图片已由查询条件保证）"""
+        try:
+            paths = json.loads(images_json) if images_json else []
+        except (TypeError, ValueError):
+            return False
+        if len(paths) != len(image_hashes):
+            return False
+        for path, expected in zip(paths[1:], image_hashes[1:]):
+            hasher = hashlib.sha256()
+            try:
+                with open(path, "rb") as fh:
+                    for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                        hasher.update(chunk)
+            except OSError:
+                return False
+            if hasher.hexdigest() != expected:
+                return False
+        return True
+
     def create_payment_receipt(self, data: Dict, image_paths: List[str],
-                               is_manual: bool = False) -> Dict[str, Any]:
-        """创建支付回单记录，支持多张图片"""
+                               is_manual: bool = False,
+                               image_hash: Optional[str] = None) -> Dict[str, Any]:
+        """创建支付回单记录，支持多张图片；image_hash 为主图片 SHA-256"""
         try:
             # 自动计算合计金额（如果未提供）
             amount = Decimal(str(data.get('amount', 0)))
@@ -1042,40 +1245,49 @@ class BalanceService:
             import json
             images_json = json.dumps(image_paths, ensure_ascii=False)
 
+            columns = [
+                "receipt_no", "receipt_image", "receipt_images", "payment_date", "payment_time",
+                "payer_name", "payer_account", "payee_name", "payee_account",
+                "amount", "fee", "total_amount", "bank_name", "payee_bank_name", "remark",
+                "ocr_status", "ocr_raw_data", "is_manual_corrected",
+            ]
+            values = [
+                data.get('receipt_no'),
+                main_image_path,
+                images_json,
+                data.get('payment_date'),
+                data.get('payment_time'),
+                data.get('payer_name'),
+                data.get('payer_account'),
+                data.get('payee_name'),
+                data.get('payee_account'),
+                amount,
+                fee,
+                total_amount,
+                data.get('bank_name'),
+                data.get('payee_bank_name'),
+                data.get('remark'),
+                self.OCR_STATUS_CONFIRMED if is_manual else self.OCR_STATUS_PENDING,
+                data.get('raw_text'),
+                1 if is_manual else 0,
+            ]
+            if image_hash and self._has_receipt_image_hash_column():
+                columns.append("receipt_image_hash")
+                values.append(image_hash)
+
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        INSERT INTO pd_payment_receipts 
-                        (receipt_no, receipt_image, receipt_images, payment_date, payment_time,
-                         payer_name, payer_account, payee_name, payee_account,
-                         amount, fee, total_amount, bank_name, payee_bank_name, remark, 
-                         ocr_status, ocr_raw_data, is_manual_corrected)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (
-                        data.get('receipt_no'),
-                        main_image_path,
-                        images_json,
-                        data.get('payment_date'),
-                        data.get('payment_time'),
-                        data.get('payer_name'),
-                        data.get('payer_account'),
-                        data.get('payee_name'),
-                        data.get('payee_account'),
-                        amount,
-                        fee,
-                        total_amount,
-                        data.get('bank_name'),
-                        data.get('payee_bank_name'),
-                        data.get('remark'),
-                        self.OCR_STATUS_CONFIRMED if is_manual else self.OCR_STATUS_PENDING,
-                        data.get('raw_text'),
-                        1 if is_manual else 0
-                    ))
+                    cur.execute(
+                        f"INSERT INTO pd_payment_receipts ({', '.join(columns)}) "
+                        f"VALUES ({', '.join(['%s'] * len(columns))})",
+                        values
+                    )
+                    receipt_id = cur.lastrowid
 
                     return {
                         "success": True,
                         "message": "支付回单保存成功",
-                        "data": {"id": cur.lastrowid}
+                        "data": {"id": receipt_id}
                     }
 
         except Exception as e:
@@ -1198,10 +1410,7 @@ class BalanceService:
                             d.has_delivery_order,
                             d.upload_status,
                             d.shipper,
-                            d.service_fee,
-                            (SELECT COUNT(*) FROM pd_receipt_settlements rs 
-                             JOIN pd_payment_receipts pr ON rs.receipt_id = pr.id 
-                             WHERE rs.balance_id = b.id) as receipt_count
+                            d.service_fee
                         FROM pd_balance_details b
                         LEFT JOIN pd_weighbills w ON b.weighbill_id = w.id
                         LEFT JOIN pd_deliveries d ON b.delivery_id = d.id
@@ -1231,6 +1440,21 @@ class BalanceService:
 
                         data.append(item)
 
+                    # 回单数：只对本页结余一次分组统计，替代逐行执行的相关子查询
+                    receipt_counts = {}
+                    if data:
+                        page_ids = [item['id'] for item in data]
+                        cur.execute(f"""
+                            SELECT rs.balance_id, COUNT(*)
+                            FROM pd_receipt_settlements rs
+                            JOIN pd_payment_receipts pr ON rs.receipt_id = pr.id
+                            WHERE rs.balance_id IN ({', '.join(['%s'] * len(page_ids))})
+                            GROUP BY rs.balance_id
+                        """, tuple(page_ids))
+                        receipt_counts = dict(cur.fetchall())
+                    for item in data:
+                        item['receipt_count'] = receipt_counts.get(item['id'], 0)
+
                     return {
                         "success": True,
                         "data": data,
@@ -2469,7 +2693,7 @@ class BalanceService:
                     if not row:
                         return {"success": False, "error": "支付回单不存在"}
 
-                    receipt_amount, ocr_status = Decimal(str(row[0])), row[1]
+                    receipt_amount, ocr_status = _to_decimal(row[0]), row[1]
 
                     if ocr_status == self.OCR_STATUS_VERIFIED:
                         return {"success": False, "error": "该回单已核销"}
@@ -2501,9 +2725,9 @@ class BalanceService:
                         if remaining_amount <= 0:
                             break
 
-                        payable_d = Decimal(str(payable))
-                        paid_d = Decimal(str(paid))
-                        balance_d = Decimal(str(balance))
+                        payable_d = _to_decimal(payable)
+                        paid_d = _to_decimal(paid)
+                        balance_d = _to_decimal(balance)
 
                         # 本次可核销金额
                         settle_amount = min(balance_d, remaining_amount)
@@ -2,13 +2,14 @@
 合同录入服务 - 完整版
 支持OCR识别、手动录入、查看、编辑、导出
 """
+import copy
+import io
 import os
 import re
 import logging
 import tempfile
 from decimal import Decimal, ROUND_FLOOR, ROUND_HALF_UP
-from typing import List, Dict, Optional, Any, Tuple
-from contextlib import contextmanager
+from typing import List, Dict, Iterator, Optional, Any, Tuple, Union
 from datetime import datetime, timedelta, date
 import cv2  # 新增导入
 import numpy as np
@@ -18,12 +19,11 @@ from PIL import Image, ImageEnhance, ImageFilter
 from pathlib import Path
 
 from app.core.logging import log_price_change
+from app.utils.ocr_pool import RAPIDOCR_AVAILABLE, get_ocr_engine
+from app.utils.ttl_cache import TTLCache
+from core.database import get_conn_tuple
 
-try:
-    from rapidocr_onnxruntime import RapidOCR
-    RAPIDOCR_AVAILABLE = True
-except ImportError:
-    RAPIDOCR_AVAILABLE = False
+if not RAPIDOCR_AVAILABLE:
     raise ImportError("请安装 RapidOCR：pip install rapidocr-onnxruntime")
 
 logger = logging.getLogger(__name__)
@@ -33,32 +33,33 @@ PRODUCT_TYPES = ["电动车", "黑皮", "新能源", "通信", "摩托车", "大
 
 # ============ 数据库 ============
 
-def get_db_config() -> dict:
-    def require_env(name: str) -> str:
-        value = os.getenv(name)
-        if not value:
-            raise ValueError(f"Missing required env var: {name}")
-        return value
-
-    return {
-        "host": require_env("MYSQL_HOST"),
-        "port": int(require_env("MYSQL_PORT")),
-        "user": require_env("MYSQL_USER"),
-        "password": require_env("MYSQL_PASSWORD"),
-        "database": require_env("MYSQL_DATABASE"),
-        "charset": os.getenv("MYSQL_CHARSET", "utf8mb4"),
-        "autocommit": True,
-    }
-
-
-@contextmanager
-def get_conn():
-    config = get_db_config()
-    connection = pymysql.connect(**config)
-    try:
-        yield connection
-    finally:
-        connection.close()
+# 元组游标连接，复用 core.database 的进程内连接池
+get_conn = get_conn_tuple
+
+
+# 品种明细插入语句：配合 executemany，pymysql 会合并为一条多行 INSERT，一次往返
+_INSERT_CONTRACT_PRODUCT_SQL = """
+    INSERT INTO pd_contract_products
+    (contract_id, product_name, unit_price, sort_order)
+    VALUES (%s, %s, %s, %s)
+"""
+
+# 合同详情缓存：id -> 详情；合同编号 -> id。写操作后显式失效，TTL 兜底其它模块的改动
+_CONTRACT_DETAIL_CACHE = TTLCache(maxsize=2048, ttl=60)
+_CONTRACT_NO_CACHE = TTLCache(maxsize=2048, ttl=60)
+# 合同品种单价：(合同编号, 品种) -> 单价（未找到为 None），磅单识别/上传时高频查询
+_CONTRACT_PRICE_CACHE = TTLCache(maxsize=4096, ttl=60)
+
+
+def invalidate_contract_cache(contract_id: Optional[int] = None) -> None:
+    """失效合同详情缓存；不传 contract_id 时全部清空"""
+    if contract_id is None:
+        _CONTRACT_DETAIL_CACHE.clear()
+    else:
+        _CONTRACT_DETAIL_CACHE.pop(contract_id)
+    # 合同编号可能随更新/删除变化，编号映射整体清空
+    _CONTRACT_NO_CACHE.clear()
+    _CONTRACT_PRICE_CACHE.clear()
 
 
 _CONTRACT_DELIVERY_PLAN_ID_ENSURED = False
@@ -256,12 +257,10 @@ class ContractService:
         return current_status or "生效中"
 
     def _init_ocr(self):
-        try:
-            self.ocr = RapidOCR()
-            logger.info("RapidOCR 初始化成功")
-        except Exception as e:
-            logger.error(f"RapidOCR 初始化失败: {e}")
-            raise
+        # 与磅单/回单识别共用进程内同一个 RapidOCR 实例
+        self.ocr = get_ocr_engine()
+        if self.ocr is None:
+            raise RuntimeError("RapidOCR 初始化失败")
 
     def _apply_super_resolution(self, image: Image.Image) -> Image.Image:
         """如果可用，对图像应用超分辨率（2倍放大）"""
@@ -288,10 +287,10 @@ class ContractService:
                 logger.error(f"超分辨率处理失败: {e}")
                 return image
         return image
-    def recognize_contract(self, image_path: str) -> Dict[str, Any]:
-        """OCR识别合同 - 即使不完整也返回结果"""
+    def recognize_contract(self, image: Union[str, bytes, Image.Image]) -> Dict[str, Any]:
+        """OCR识别合同 - 即使不完整也返回结果（image 可以是文件路径、图片字节或 PIL 图像）"""
         try:
-            result, elapse = self.ocr(image_path)
+            result, elapse = self.ocr(image)
             total_elapse = sum(elapse) if isinstance(elapse, list) else float(elapse or 0)
 
             if not result:
@@ -674,25 +673,37 @@ class ContractService:
                 })
         return products, total_quantity
 
-    def preprocess_image(self, image_path: str) -> str:
-        """图片预处理（含超分辨率）"""
-        try:
-            img = Image.open(image_path)
-            if img.mode != "RGB":
-                img = img.convert("RGB")
+    def _enhance_image(self, img: Image.Image) -> Image.Image:
+        """超分辨率、增强对比度、锐化，并把长边限制在 2000 像素以内"""
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        # 新增：超分辨率处理
+        img = self._apply_super_resolution(img)
+
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(1.5)
+        img = img.filter(ImageFilter.SHARPEN)
 
-            # 新增：超分辨率处理
-            img = self._apply_super_resolution(img)
+        max_size = 2000
+        if max(img.size) > max_size:
+            ratio = max_size / max(img.size)
+            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        return img
 
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)
-            img = img.filter(ImageFilter.SHARPEN)
+    def preprocess_image_bytes(self, data: bytes) -> Union[Image.Image, bytes]:
+        """内存中预处理图片，返回可直接交给 OCR 的 PIL 图像；失败时原样返回字节"""
+        try:
+            return self._enhance_image(Image.open(io.BytesIO(data)))
+        except Exception as e:
+            logger.error(f"预处理失败: {e}")
+            return data
 
-            max_size = 2000
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+    def preprocess_image(self, image_path: str) -> str:
+        """图片预处理（含超分辨率）"""
+        try:
+            img = self._enhance_image(Image.open(image_path))
 
             temp_path = tempfile.mktemp(suffix=".jpg")
             img.save(temp_path, "JPEG", quality=95)
@@ -803,17 +814,14 @@ class ContractService:
 
                     contract_id = cur.lastrowid
 
-                    for idx, product in enumerate(products):
-                        cur.execute("""
-                            INSERT INTO pd_contract_products 
-                            (contract_id, product_name, unit_price, sort_order)
-                            VALUES (%s, %s, %s, %s)
-                        """, (
-                            contract_id,
-                            product["product_name"],
-                            product.get("unit_price"),
-                            idx,
-                        ))
+                    if products:
+                        cur.executemany(_INSERT_CONTRACT_PRODUCT_SQL, [
+                            (contract_id, product["product_name"], product.get("unit_price"), idx)
+                            for idx, product in enumerate(products)
+                        ])
+
+                    # 创建前查过的编号映射/单价（含“未找到”）需失效
+                    invalidate_contract_cache(contract_id)
 
                     return {
                         "success": True,
@@ -979,6 +987,7 @@ class ContractService:
                         contract_no_for_log = new_contract_no or old_contract_no or ""
 
                         cur.execute("DELETE FROM pd_contract_products WHERE contract_id = %s", (contract_id,))
+                        product_rows = []
                         for idx, product in enumerate(products):
                             pname = product["product_name"]
                             new_up = product.get("unit_price")
@@ -1018,12 +1027,12 @@ class ContractService:
                                     new_unit_price=float(new_dec),
                                 )
 
-                            cur.execute("""
-                                INSERT INTO pd_contract_products 
-                                (contract_id, product_name, unit_price, sort_order)
-                                VALUES (%s, %s, %s, %s)
-                            """, (contract_id, pname, product.get("unit_price"), idx))
+                            product_rows.append((contract_id, pname, product.get("unit_price"), idx))
+
+                        if product_rows:
+                            cur.executemany(_INSERT_CONTRACT_PRODUCT_SQL, product_rows)
 
+                    invalidate_contract_cache(contract_id)
                     return {
                         "success": True,
                         "message": "合同更新成功",
@@ -1036,10 +1045,20 @@ class ContractService:
 
         except Exception as e:
             logger.error(f"更新合同失败: {e}")
+            invalidate_contract_cache(contract_id)
             return {"success": False, "error": str(e)}
 
     def get_contract_detail(self, contract_id: int) -> Optional[Dict]:
-        """获取合同详情（含品种明细）"""
+        """获取合同详情（含品种明细）；命中缓存时不查库，返回副本"""
+        cached = _CONTRACT_DETAIL_CACHE.get(contract_id)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        detail = self._load_contract_detail(contract_id)
+        if detail is not None:
+            _CONTRACT_DETAIL_CACHE.set(contract_id, copy.deepcopy(detail))
+        return detail
+
+    def _load_contract_detail(self, contract_id: int) -> Optional[Dict]:
         try:
             expire_contracts_after_grace()
             with get_conn() as conn:
@@ -1105,12 +1124,19 @@ class ContractService:
 
     def get_contract_detail_by_no(self, contract_no: str) -> Optional[Dict]:
         """根据合同编号获取详情"""
+        contract_id = _CONTRACT_NO_CACHE.get(contract_no)
+        if contract_id is not None:
+            detail = self.get_contract_detail(contract_id)
+            if detail is not None and detail.get("contract_no") == contract_no:
+                return detail
+            _CONTRACT_NO_CACHE.pop(contract_no)
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
                     cur.execute("SELECT id FROM pd_contracts WHERE contract_no = %s", (contract_no,))
                     row = cur.fetchone()
                     if row:
+                        _CONTRACT_NO_CACHE.set(contract_no, row[0])
                         return self.get_contract_detail(row[0])
                     return None
         except:
@@ -1252,6 +1278,7 @@ class ContractService:
                     
                     # 删除合同
                     cur.execute("DELETE FROM pd_contracts WHERE id = %s", (contract_id,))
+                    invalidate_contract_cache(contract_id)
                     
                     return {
                         "success": True, 
@@ -1264,36 +1291,54 @@ class ContractService:
                     
         except Exception as e:
             logger.error(f"删除合同失败: {e}")
+            invalidate_contract_cache(contract_id)
             return {"success": False, "error": str(e)}
 
-    def export_contracts(self, contract_ids: List[int] = None) -> List[Dict]:
-        """导出合同"""
+    @staticmethod
+    def _export_query(contract_ids: Optional[List[int]]) -> Tuple[str, tuple]:
+        sql = """
+            SELECT c.*, p.product_name, p.unit_price
+            FROM pd_contracts c
+            LEFT JOIN pd_contract_products p ON c.id = p.contract_id
+        """
+        params: tuple = ()
+        if contract_ids:
+            format_ids = ','.join(['%s'] * len(contract_ids))
+            sql += f" WHERE c.id IN ({format_ids})"
+            params = tuple(contract_ids)
+        return sql + " ORDER BY c.seq_no", params
+
+    def iter_export_contracts(
+        self, contract_ids: List[int] = None, batch_size: int = 500
+    ) -> Iterator[tuple]:
+        """
+        流式导出合同：第一个元素为列名元组，之后逐行产出数据元组。
+        使用服务端游标分批读取，不把整个结果集载入内存；查询/读取失败时记录日志后抛出，
+        由调用方中止响应，避免客户端拿到被截断的文件。
+        """
         try:
             with get_conn() as conn:
-                with conn.cursor() as cur:
-                    if contract_ids:
-                        format_ids = ','.join(['%s'] * len(contract_ids))
-                        cur.execute(f"""
-                            SELECT c.*, p.product_name, p.unit_price
-                            FROM pd_contracts c
-                            LEFT JOIN pd_contract_products p ON c.id = p.contract_id
-                            WHERE c.id IN ({format_ids})
-                            ORDER BY c.seq_no
-                        """, tuple(contract_ids))
-                    else:
-                        cur.execute("""
-                            SELECT c.*, p.product_name, p.unit_price
-                            FROM pd_contracts c
-                            LEFT JOIN pd_contract_products p ON c.id = p.contract_id
-                            ORDER BY c.seq_no
-                        """)
-
-                    columns = [desc[0] for desc in cur.description]
-                    return [dict(zip(columns, row)) for row in cur.fetchall()]
+                with conn.cursor(pymysql.cursors.SSCursor) as cur:
+                    cur.execute(*self._export_query(contract_ids))
+
+                    # 同名列（如 c.* 与明细表重名字段）只保留一列，取后出现的值，与 dict(zip(...)) 一致
+                    names = [desc[0] for desc in cur.description]
+                    last_index = {name: idx for idx, name in enumerate(names)}
+                    columns = tuple(last_index)
+                    picks = [last_index[name] for name in columns]
+                    dedup = len(picks) != len(names)
+
+                    yield columns
+                    while True:
+                        rows = cur.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        for row in rows:
+                            yield tuple(row[i] for i in picks) if dedup else row
 
         except Exception as e:
             logger.error(f"导出失败: {e}")
-            return []
+            raise
 
 
 _contract_service = None
@@ -1322,6 +1367,8 @@ def expire_contracts_after_grace(grace_days: int = 4) -> int:
                     """,
                     (grace_days,),
                 )
+                if cur.rowcount:
+                    invalidate_contract_cache()
                 return cur.rowcount
     except Exception as e:
         logger.error(f"合同自动失效失败: {e}")
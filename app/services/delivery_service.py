@@ -6,18 +6,24 @@ import json
 import logging
 import os
 import re
+import shutil
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from openai import OpenAI
 from decimal import Decimal, ROUND_FLOOR
-from typing import Dict, List, Optional, Any
+from typing import BinaryIO, Dict, List, Optional, Any, Union
 from datetime import datetime
 from app.core.paths import UPLOADS_DIR
 from app.services.delivery_contract_price_service import get_delivery_contract_price_service
 from app.utils.product_mapping import convert_to_mill_product
+from app.utils.uploads import UPLOAD_CHUNK_SIZE
 from core.database import get_conn
 
 logger = logging.getLogger(__name__)
 
+# 新建报单时图片落盘与合同匹配等数据库查询并行：图片写入提交到该线程池，插入前再等待完成
+_IMAGE_WRITE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="delivery-image")
+
 _DELIVERY_ORDER_PLAN_COLUMNS_ENSURED = False
 
 
@@ -1046,37 +1052,63 @@ class DeliveryService:
 
         return products
 
-    def _save_delivery_image(self, image_bytes: bytes, vehicle_no: str) -> str:
-        """保存单张联单图片，返回路径"""
+    @staticmethod
+    def _write_image(file_path, image: Union[bytes, BinaryIO]) -> None:
+        """写入图片：bytes 直接写；文件对象（如 UploadFile.file）分块拷贝，不整体读入内存"""
+        with open(file_path, "wb") as f:
+            if isinstance(image, (bytes, bytearray)):
+                f.write(image)
+            else:
+                image.seek(0)
+                shutil.copyfileobj(image, f, UPLOAD_CHUNK_SIZE)
+
+    @staticmethod
+    def _delivery_image_path(vehicle_no: str) -> str:
+        """生成联单图片保存路径（确保目录存在）"""
         safe_name = re.sub(r'[^\w\-]', '_', str(vehicle_no or 'unknown'))
         filename = f"delivery_{safe_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
         file_path = UPLOAD_DIR / filename
         file_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
         return str(file_path)
 
-    def _save_voucher_image(self, image_bytes: bytes, vehicle_no: str, index: int) -> str:
-        """保存单张凭证图片，返回路径"""
+    @staticmethod
+    def _voucher_image_path(vehicle_no: str, index: int) -> str:
+        """生成凭证图片保存路径（确保目录存在）"""
         safe_name = re.sub(r'[^\w\-]', '_', str(vehicle_no or 'unknown'))
         filename = f"voucher_{safe_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{index}_{uuid.uuid4().hex[:4]}.jpg"
         # 存放在 UPLOAD_DIR/vouchers/ 子目录下
         file_path = UPLOAD_DIR / 'vouchers' / filename
         file_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
         return str(file_path)
 
+    def _save_delivery_image(self, image: Union[bytes, BinaryIO], vehicle_no: str) -> str:
+        """保存单张联单图片，返回路径"""
+        file_path = self._delivery_image_path(vehicle_no)
+        self._write_image(file_path, image)
+        return file_path
+
+    def _save_voucher_image(self, image: Union[bytes, BinaryIO], vehicle_no: str, index: int) -> str:
+        """保存单张凭证图片，返回路径"""
+        file_path = self._voucher_image_path(vehicle_no, index)
+        self._write_image(file_path, image)
+        return file_path
+
+    def _submit_image_write(self, file_path: str, image: Union[bytes, BinaryIO]) -> Future:
+        """后台写入图片，返回 Future（调用方在引用该路径前须等待完成）"""
+        return _IMAGE_WRITE_EXECUTOR.submit(self._write_image, file_path, image)
+
     def create_delivery(
             self,
             data: Dict,
-            delivery_order_image: bytes = None,
-            voucher_images: List[bytes] = None,
+            delivery_order_image: Union[bytes, BinaryIO] = None,
+            voucher_images: List[Union[bytes, BinaryIO]] = None,
             current_user: dict = None,
             confirm_flag: bool = False
     ) -> Dict[str, Any]:
         """创建报货订单（支持有联单图片或无联单多张凭证图片）"""
-        temp_files = []  # 记录所有临时文件，用于异常时清理
+        temp_files = []  # 记录所有临时文件，未成功创建时清理
+        pending_writes: List[Future] = []  # 后台图片写入，与下面的校验/合同匹配查询并行
+        created = False
         try:
             # ---------- 参数校验 ----------
             driver_phone = data.get('driver_phone')
@@ -1099,8 +1131,9 @@ class DeliveryService:
                     return {"success": False, "error": "有联单时不能上传凭证图片"}
                 # 联单图片处理
                 if delivery_order_image:
-                    image_path = self._save_delivery_image(delivery_order_image, data.get('vehicle_no'))
+                    image_path = self._delivery_image_path(data.get('vehicle_no'))
                     temp_files.append(image_path)
+                    pending_writes.append(self._submit_image_write(image_path, delivery_order_image))
                     data['delivery_order_image'] = image_path
                     data['upload_status'] = '已上传'
                 else:
@@ -1117,8 +1150,9 @@ class DeliveryService:
                 voucher_paths = []
                 if voucher_images:
                     for idx, img_bytes in enumerate(voucher_images):
-                        path = self._save_voucher_image(img_bytes, data.get('vehicle_no'), idx)
+                        path = self._voucher_image_path(data.get('vehicle_no'), idx)
                         temp_files.append(path)
+                        pending_writes.append(self._submit_image_write(path, img_bytes))
                         voucher_paths.append(path)
                 data['voucher_images'] = voucher_paths if voucher_paths else None
                 # 联单图片字段置空
@@ -1253,7 +1287,10 @@ class DeliveryService:
                         return {"success": False, "error": quota_error}
             # ===================================================
 
-            # ---------- 插入数据库 ----------
+            # ---------- 插入数据库（图片须已落盘） ----------
+            for future in pending_writes:
+                future.result()
+
             with get_conn() as conn:
                 with conn.cursor() as cur:
                     has_products_column = self._delivery_has_products_column()
@@ -1404,25 +1441,34 @@ class DeliveryService:
                 }
                 response_data["message"] += f"（已跳过{len(match_result['skipped_contracts'])}个车数不足的合同）"
 
+            created = True
             return response_data
 
         except Exception as e:
-            # 异常时清理已保存的临时文件
-            for f in temp_files:
-                try:
-                    if os.path.exists(f):
-                        os.remove(f)
-                except:
-                    pass
             logger.exception(f"【DEBUG】创建报货订单异常: {e}")
             return {"success": False, "error": str(e)}
 
+        finally:
+            if not created:
+                # 校验未通过提前返回或异常：等后台写入结束后清理已保存的图片
+                for future in pending_writes:
+                    try:
+                        future.result()
+                    except Exception:
+                        pass
+                for f in temp_files:
+                    try:
+                        if os.path.exists(f):
+                            os.remove(f)
+                    except OSError:
+                        pass
+
     def update_delivery(
             self,
             delivery_id: int,
             data: Dict,
-            delivery_order_image: bytes = None,
-            voucher_images: List[bytes] = None,
+            delivery_order_image: Union[bytes, BinaryIO] = None,
+            voucher_images: List[Union[bytes, BinaryIO]] = None,
             delete_image: bool = False,
             uploaded_by: str = None,
             current_user: dict = None
@@ -1705,7 +1751,7 @@ class DeliveryService:
         if result.get("success") and new_status == "审核未通过":
             self._delete_unuploaded_weighbills_for_delivery(delivery_id)
         return result
-    def add_voucher_images(self, delivery_id: int, image_bytes_list: List[bytes], vehicle_no: str = None) -> Dict[
+    def add_voucher_images(self, delivery_id: int, image_bytes_list: List[Union[bytes, BinaryIO]], vehicle_no: str = None) -> Dict[
         str, Any]:
         """向指定订单追加凭证图片（最多6张）"""
         try:
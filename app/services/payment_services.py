@@ -1,4 +1,6 @@
 # payment_services.py
+import copy
+import functools
 import pandas as pd
 import re
 from typing import Optional, Dict, Any
@@ -9,6 +11,7 @@ from decimal import Decimal, ROUND_HALF_UP
 from core.database import get_conn
 from core.table_access import build_dynamic_select, _quote_identifier
 from core.logging import get_logger
+from app.utils.ttl_cache import TTLCache
 
 logger = get_logger(__name__)
 
@@ -25,6 +28,36 @@ AMOUNT_PATTERNS = {
 }
 
 
+# ========== 合同汇总查询缓存 ==========
+
+# 合同发运进度 / 合同回款汇总为全表聚合，看板会频繁轮询；按查询参数缓存 30 秒，
+# 回款明细写操作后整体清空（磅单/报单等其它模块的写入依赖 TTL 过期）
+_SHIPPING_PROGRESS_CACHE = TTLCache(maxsize=512, ttl=30)
+_PAYMENT_SUMMARY_CACHE = TTLCache(maxsize=512, ttl=30)
+
+
+# 表结构（列名集合）缓存：动态字段判断原先每次请求都要 SHOW COLUMNS 往返数据库；
+# 表结构只在发布迁移时变化，缓存 5 分钟
+_TABLE_COLUMNS_CACHE = TTLCache(maxsize=32, ttl=300)
+
+
+def invalidate_contract_summary_cache() -> None:
+    """清空合同发运进度 / 回款汇总缓存"""
+    _SHIPPING_PROGRESS_CACHE.clear()
+    _PAYMENT_SUMMARY_CACHE.clear()
+
+
+def _invalidates_contract_summary(func):
+    """装饰回款写操作：执行结束（无论成功与否）后清空合同汇总缓存"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            invalidate_contract_summary_cache()
+    return wrapper
+
+
 # ========== 枚举定义 ==========
 
 class PaymentStatus(IntEnum):
@@ -41,6 +74,12 @@ class PaymentStage(IntEnum):
     DELIVERY = 1     # 到货款（90%）
     FINAL = 2        # 尾款（10%）
 
+
+# 枚举值 -> 名称，逐行组装结果时直接查表，不再构造枚举实例
+_STATUS_NAMES = {status.value: status.name for status in PaymentStatus}
+_STAGE_NAMES = {stage.value: stage.name for stage in PaymentStage}
+
+
 class PaymentExcelProcessor:
     """回款Excel处理器"""
     
@@ -299,6 +338,16 @@ class PaymentService:
     TABLE_NAME = "pd_payment_details"
     RECORD_TABLE = "pd_payment_records"
 
+    @staticmethod
+    def _table_columns(cur, table_name: str) -> frozenset:
+        """返回表的列名集合（带缓存）"""
+        columns = _TABLE_COLUMNS_CACHE.get(table_name)
+        if columns is None:
+            cur.execute(f"SHOW COLUMNS FROM {_quote_identifier(table_name)}")
+            columns = frozenset(r["Field"] for r in cur.fetchall())
+            _TABLE_COLUMNS_CACHE.set(table_name, columns)
+        return columns
+
     @staticmethod
     def _service_fee_sql() -> str:
         return "CASE WHEN d.has_delivery_order = '无' THEN COALESCE(d.service_fee, 150) ELSE COALESCE(d.service_fee, 0) END"
@@ -494,6 +543,7 @@ class PaymentService:
                     raise RuntimeError(f"{PaymentService.RECORD_TABLE} 表不存在，请先执行数据库初始化")
 
     @staticmethod
+    @_invalidates_contract_summary
     def create_or_update_by_weighbill(
         weighbill_id: int,
         delivery_id: int,
@@ -665,8 +715,7 @@ class PaymentService:
                     }
 
                     # 动态获取表结构
-                    cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME}")
-                    columns = [r["Field"] for r in cur.fetchall()]
+                    columns = PaymentService._table_columns(cur, PaymentService.TABLE_NAME)
                     data = {k: v for k, v in data.items() if k in columns}
 
                     cols = list(data.keys())
@@ -703,6 +752,7 @@ class PaymentService:
                 return PaymentService.get_payment_detail(payment_id)
 
     @staticmethod
+    @_invalidates_contract_summary
     def create_payment_detail(
         sales_order_id: int,
         smelter_name: str,
@@ -762,8 +812,7 @@ class PaymentService:
                     raise ValueError("该销售订单已存在收款明细")
 
                 # 动态获取表结构
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME}")
-                columns = [r["Field"] for r in cur.fetchall()]
+                columns = PaymentService._table_columns(cur, PaymentService.TABLE_NAME)
 
                 # 准备插入数据
                 data = {
@@ -804,6 +853,7 @@ class PaymentService:
                 return payment_id
 
     @staticmethod
+    @_invalidates_contract_summary
     def record_payment(
         payment_detail_id: int,
         payment_amount: Decimal,
@@ -884,8 +934,7 @@ class PaymentService:
                 }
 
                 # 动态获取记录表结构
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.RECORD_TABLE}")
-                record_columns = [r["Field"] for r in cur.fetchall()]
+                record_columns = PaymentService._table_columns(cur, PaymentService.RECORD_TABLE)
 
                 # 过滤存在的字段
                 record_data = {k: v for k, v in record_data.items() if k in record_columns}
@@ -934,6 +983,7 @@ class PaymentService:
                 }
 
     @staticmethod
+    @_invalidates_contract_summary
     def update_payment_status(
         payment_id: int,
         is_paid: Optional[int] = None,
@@ -1213,17 +1263,14 @@ class PaymentService:
         """
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME}")
-                columns = [r["Field"] for r in cur.fetchall()]
+                columns = PaymentService._table_columns(cur, PaymentService.TABLE_NAME)
                 has_payee = "payee" in columns
                 has_payee_account = "payee_account" in columns
 
-                cur.execute("SHOW COLUMNS FROM pd_weighbills")
-                weighbill_columns = [r["Field"] for r in cur.fetchall()]
+                weighbill_columns = PaymentService._table_columns(cur, "pd_weighbills")
                 has_weighbill_warehouse_name = "warehouse_name" in weighbill_columns
 
-                cur.execute("SHOW COLUMNS FROM pd_balance_details")
-                balance_columns = [r["Field"] for r in cur.fetchall()]
+                balance_columns = PaymentService._table_columns(cur, "pd_balance_details")
                 has_balance_payee_bank_name = "payee_bank_name" in balance_columns
 
                 # 构建WHERE条件 - 必须已排期
@@ -1472,6 +1519,7 @@ class PaymentService:
                 }
 
     @staticmethod
+    @_invalidates_contract_summary
     def update_collection_payment(
             payment_id: int,
             arrival_paid_amount: Optional[float] = None,
@@ -1517,10 +1565,8 @@ class PaymentService:
                 if not detail:
                     raise ValueError("收款明细不存在")
 
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME} LIKE 'updated_at'")
-                has_detail_updated_at = cur.fetchone() is not None
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.RECORD_TABLE} LIKE 'updated_at'")
-                has_record_updated_at = cur.fetchone() is not None
+                has_detail_updated_at = "updated_at" in PaymentService._table_columns(cur, PaymentService.TABLE_NAME)
+                has_record_updated_at = "updated_at" in PaymentService._table_columns(cur, PaymentService.RECORD_TABLE)
 
                 cur.execute(f"""
                     SELECT payment_stage, payment_date
@@ -1662,10 +1708,8 @@ class PaymentService:
                     params.append(datetime.now())
 
                 # 检查并更新日期字段
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME} LIKE 'arrival_payment_date'")
-                has_arrival_date_col = cur.fetchone() is not None
-                cur.execute(f"SHOW COLUMNS FROM {PaymentService.TABLE_NAME} LIKE 'final_payment_date'")
-                has_final_date_col = cur.fetchone() is not None
+                has_arrival_date_col = "arrival_payment_date" in PaymentService._table_columns(cur, PaymentService.TABLE_NAME)
+                has_final_date_col = "final_payment_date" in PaymentService._table_columns(cur, PaymentService.TABLE_NAME)
 
                 if has_arrival_date_col and arrival_date:
                     update_fields.append("arrival_payment_date = %s")
@@ -1879,7 +1923,7 @@ class PaymentService:
                 detail = dict(detail)
                 
                 # 添加状态名称
-                detail['status_name'] = PaymentStatus(detail['status']).name if detail.get('status') is not None else None
+                detail['status_name'] = _STATUS_NAMES.get(detail.get('status'))
                 
                 # 转换时间字段
                 time_fields = [
@@ -1933,7 +1977,7 @@ class PaymentService:
                 payment_records = []
                 for record in records:
                     rec = dict(record)
-                    rec['payment_stage_name'] = PaymentStage(rec['payment_stage']).name if rec.get('payment_stage') is not None else None
+                    rec['payment_stage_name'] = _STAGE_NAMES.get(rec.get('payment_stage'))
                     rec['payment_date'] = str(rec['payment_date']) if rec.get('payment_date') else None
                     rec['created_at'] = str(rec['created_at']) if rec.get('created_at') else None
                     payment_records.append(rec)
@@ -1944,6 +1988,7 @@ class PaymentService:
                 return detail
 
     @staticmethod
+    @_invalidates_contract_summary
     def update_payment_detail(
         payment_id: int,
         smelter_name: Optional[str] = None,
@@ -2028,6 +2073,7 @@ class PaymentService:
                 return True
 
     @staticmethod
+    @_invalidates_contract_summary
     def delete_payment_detail(payment_id: int) -> bool:
         """
         删除收款明细
@@ -2083,9 +2129,23 @@ class PaymentService:
         size: int = 20
     ) -> Dict[str, Any]:
         """
-        获取合同发运进度列表
+        获取合同发运进度列表（带 30 秒查询缓存）
         统计每个合同的车数、吨数、已运/剩余情况
         """
+        key = (contract_no, smelter_name, page, size)
+        cached = _SHIPPING_PROGRESS_CACHE.get(key)
+        if cached is None:
+            cached = PaymentService._load_contract_shipping_progress(contract_no, smelter_name, page, size)
+            _SHIPPING_PROGRESS_CACHE.set(key, cached)
+        return copy.deepcopy(cached)
+
+    @staticmethod
+    def _load_contract_shipping_progress(
+        contract_no: Optional[str],
+        smelter_name: Optional[str],
+        page: int,
+        size: int
+    ) -> Dict[str, Any]:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 # 构建WHERE条件
@@ -2195,8 +2255,23 @@ class PaymentService:
         size: int = 20
     ) -> Dict[str, Any]:
         """
-        获取合同回款汇总列表（按合同编号分组）
+        获取合同回款汇总列表（按合同编号分组，带 30 秒查询缓存）
         """
+        key = (contract_no, smelter_name, status, page, size)
+        cached = _PAYMENT_SUMMARY_CACHE.get(key)
+        if cached is None:
+            cached = PaymentService._load_contract_payment_summary(contract_no, smelter_name, status, page, size)
+            _PAYMENT_SUMMARY_CACHE.set(key, cached)
+        return copy.deepcopy(cached)
+
+    @staticmethod
+    def _load_contract_payment_summary(
+        contract_no: Optional[str],
+        smelter_name: Optional[str],
+        status: Optional[int],
+        page: int,
+        size: int
+    ) -> Dict[str, Any]:
         with get_conn() as conn:
             with conn.cursor() as cur:
                 where_clauses = ["1=1"]
@@ -2385,7 +2460,7 @@ class PaymentService:
             items = []
             for row in rows:
                 item = dict(row)
-                item['status_name'] = PaymentStatus(item['status']).name if item.get('status') is not None else None
+                item['status_name'] = _STATUS_NAMES.get(item.get('status'))
                 item['created_at'] = str(item['created_at']) if item.get('created_at') else None
                 item['weigh_date'] = str(item['weigh_date']) if item.get('weigh_date') else None
                 
@@ -2427,7 +2502,7 @@ class PaymentService:
             payment_records = []
             for record in records:
                 rec = dict(record)
-                rec['payment_stage_name'] = PaymentStage(rec['payment_stage']).name if rec.get('payment_stage') is not None else None
+                rec['payment_stage_name'] = _STAGE_NAMES.get(rec.get('payment_stage'))
                 rec['payment_date'] = str(rec['payment_date']) if rec.get('payment_date') else None
                 rec['created_at'] = str(rec['created_at']) if rec.get('created_at') else None
                 payment_records.append(rec)
@@ -2529,6 +2604,7 @@ class PaymentService:
                 return {'found': False}
             
     @staticmethod
+    @_invalidates_contract_summary
     def update_arrival_paid_amount(weighbill_no: str, amount: float, match_info: dict, company_type: str = 'yuguang') -> dict:
         """
         更新或创建回款记录，写入arrival_paid_amount
@@ -1,9 +1,9 @@
-import bcrypt
 import re
 from typing import Any, Dict, List, Optional
 from enum import IntEnum
 import json
 import pymysql.err
+from app.core.security import hash_password, password_needs_rehash, verify_password
 from core.database import get_conn
 from core.table_access import build_dynamic_select, _quote_identifier
 from core.logging import get_logger
@@ -46,13 +46,13 @@ class UserRole:
 # ========== 工具函数 ==========
 
 def hash_pwd(password: str) -> str:
-    """密码加密"""
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12)).decode()
+    """密码加密（argon2id，见 app.core.security.hash_password）"""
+    return hash_password(password)
 
 
 def verify_pwd(password: str, hashed: str) -> bool:
-    """密码校验"""
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+    """密码校验（结果短时缓存，见 app.core.security.verify_password）"""
+    return verify_password(password, hashed)
 
 
 def validate_account(account: str) -> bool:
@@ -129,6 +129,16 @@ class AuthService:
                 stored_hash = user.pop("password_hash")
                 if not verify_pwd(password, stored_hash):
                     raise ValueError("账号或密码错误")
+
+                # 旧 bcrypt 哈希在登录成功后换成 argon2id；失败不影响本次登录
+                if password_needs_rehash(stored_hash):
+                    try:
+                        cur.execute(
+                            "UPDATE pd_users SET password_hash=%s WHERE id=%s",
+                            (hash_pwd(password), user["id"]),
+                        )
+                    except Exception as e:
+                        logger.warning(f"用户 {user['id']} 密码哈希升级失败: {e}")
                 
                 return user
     
@@ -1,33 +1,32 @@
 """
 磅单服务 - 支持一报单多品种（最多4个）
 """
+import base64
+import io
 import logging
 import os
 import re
-import tempfile
+import shutil
+import threading
 import uuid
 from decimal import Decimal, ROUND_HALF_UP
 import cv2  # 新增导入
 import numpy as np
 from cv2 import dnn_superres
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Any, BinaryIO, Dict, List, Optional, Union
 from datetime import datetime
 
 from PIL import Image, ImageEnhance, ImageFilter
 
-try:
-    from rapidocr_onnxruntime import RapidOCR
-    RAPIDOCR_AVAILABLE = True
-except ImportError:
-    RAPIDOCR_AVAILABLE = False
-
 from pymysql.cursors import DictCursor
 
 from app.core.logging import log_price_change
 from app.core.paths import UPLOADS_DIR
-from app.services.contract_service import get_conn
+from app.services.contract_service import _CONTRACT_PRICE_CACHE, get_conn
+from app.utils.ocr_pool import get_ocr_engine
 from app.utils.product_mapping import convert_to_mill_product
+from app.utils.uploads import UPLOAD_CHUNK_SIZE, remove_file_quietly
 
 logger = logging.getLogger(__name__)
 
@@ -36,20 +35,81 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 _WEIGHBILL_AUDIT_COLS_ENSURED = False
 
+# 单价缓存未命中 / 查询失败的哨兵（None 表示“查到了但无单价”，同样可缓存）
+_PRICE_MISS = object()
+
+# 磅单列表查询的 pd_weighbills 列：不取 ocr_raw_data（OCR 原文，TEXT）；
+# warehouse_name / is_last_truck_for_order_plan / audit_* 为旧库可能缺失的列，按实际字段追加
+_LIST_WEIGHBILL_COLS = (
+    "id", "weigh_date", "delivery_time", "weigh_ticket_no", "contract_no", "contract_id",
+    "delivery_id", "vehicle_no", "product_name", "gross_weight", "tare_weight", "net_weight",
+    "unit_price", "total_amount", "weighbill_image", "upload_status", "ocr_status",
+    "is_manual_corrected", "payment_schedule_date", "uploader_id", "uploader_name",
+    "is_last_truck_for_contract", "uploaded_at", "created_at", "updated_at",
+)
+
+# OCR 文本解析 / 文件名清洗用的正则，模块加载时编译一次
+_SAFE_NAME_RE = re.compile(r"[^\w\-]")
+_VEHICLE_SEP_RE = re.compile(r"[\s　·.]+")
+_DATE_PATTERNS = (
+    re.compile(r"日期[：:]\s*(\d{4}年\d{1,2}月\d{1,2}日)"),
+    re.compile(r"(\d{4}年\d{1,2}月\d{1,2}日)"),
+    re.compile(r"(\d{4}-\d{2}-\d{2})"),
+)
+_TICKET_NO_PATTERNS = (
+    re.compile(r"单据号[：:]\s*(\d+)"),
+    re.compile(r"磅单号[：:]\s*(\d+)"),
+    re.compile(r"单号[：:]\s*(\d+)"),
+)
+_CONTRACT_NO_PATTERNS = (
+    re.compile(r"合同编号[：:]\s*([A-Za-z0-9\-]+)"),
+    re.compile(r"合同号[：:]\s*([A-Za-z0-9\-]+)"),
+)
+# 車牌標準7位：省簡稱+字母+5位（如豫U12345），新能源8位支持{5,6}
+_VEHICLE_NO_PATTERNS = (
+    re.compile(r"车号[：:]\s*([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})"),
+    re.compile(r"车牌[：:]\s*([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})"),
+    re.compile(r"([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})"),
+)
+_PRODUCT_NAME_PATTERNS = (
+    re.compile(r"货物名称[：:]\s*(.+?)(?:\n|$)"),
+    re.compile(r"品名[：:]\s*(.+?)(?:\n|$)"),
+    re.compile(r"货名[：:]\s*(.+?)(?:\n|$)"),
+)
+_GROSS_WEIGHT_RE = re.compile(r"毛重[：:]\s*(\d+\.?\d*)")
+_TARE_WEIGHT_RE = re.compile(r"皮重[：:]\s*(\d+\.?\d*)")
+_NET_WEIGHT_RE = re.compile(r"净重[：:]\s*(\d+\.?\d*)")
+_DELIVERY_UNIT_RE = re.compile(r"送货单位[：:]\s*(.+?)(?:\n|$)")
+_RECEIVE_UNIT_RE = re.compile(r"收货单位[：:]\s*(.+?)(?:\n|$)")
+
+# 超分辨率模型（放在 app/services/models/ 下）；每个 OCR 线程加载一次后复用，
+# cv2.dnn 网络对象不保证线程安全，因此按线程缓存而不是全局共享
+_SUPER_RES_MODEL_PATH = Path(__file__).parent / "models" / "ESPCN_x2.pb"
+_super_res_local = threading.local()
+
+
+def _get_super_res_model():
+    sr = getattr(_super_res_local, "sr", None)
+    if sr is None:
+        sr = dnn_superres.DnnSuperResImpl.create()
+        sr.readModel(str(_SUPER_RES_MODEL_PATH))
+        sr.setModel("fsrcnn", 2)
+        _super_res_local.sr = sr
+    return sr
+
 
 class WeighbillService:
     """磅单服务"""
 
     def __init__(self):
-        self.ocr = None
         self._weighbill_has_warehouse_name = None
         self._weighbill_has_audit_columns = None
-        if RAPIDOCR_AVAILABLE:
-            try:
-                self.ocr = RapidOCR()
-                logger.info("磅单OCR初始化成功")
-            except Exception as e:
-                logger.error(f"磅单OCR初始化失败: {e}")
+        self._weighbill_has_order_plan_last = None
+
+    @property
+    def ocr(self):
+        """RapidOCR 引擎（进程内共享、懒加载，不可用时为 None）"""
+        return get_ocr_engine()
 
     def _has_weighbill_warehouse_name_column(self) -> bool:
         """兼容旧库：动态检查 pd_weighbills 是否已有 warehouse_name 字段。"""
@@ -67,6 +127,33 @@ class WeighbillService:
 
         return self._weighbill_has_warehouse_name
 
+    def _has_weighbill_order_plan_last_column(self) -> bool:
+        """兼容旧库：检查 pd_weighbills 是否已有 is_last_truck_for_order_plan 字段。"""
+        if self._weighbill_has_order_plan_last:
+            return True
+
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SHOW COLUMNS FROM pd_weighbills LIKE 'is_last_truck_for_order_plan'")
+                    self._weighbill_has_order_plan_last = cur.fetchone() is not None
+        except Exception as e:
+            logger.warning(f"检查 pd_weighbills.is_last_truck_for_order_plan 字段失败: {e}")
+            return False
+
+        return self._weighbill_has_order_plan_last
+
+    def _list_weighbill_select(self) -> str:
+        """磅单列表 SELECT 的 pd_weighbills 部分（显式列，见 _LIST_WEIGHBILL_COLS）"""
+        cols = list(_LIST_WEIGHBILL_COLS)
+        if self._has_weighbill_warehouse_name_column():
+            cols.append("warehouse_name")
+        if self._has_weighbill_order_plan_last_column():
+            cols.append("is_last_truck_for_order_plan")
+        if self._has_weighbill_audit_columns():
+            cols += ["audit_status", "audit_remark"]
+        return ", ".join(f"w.{c}" for c in cols)
+
     def _ensure_weighbill_audit_columns(self) -> None:
         """旧库补全 audit_status / audit_remark（仅执行一次成功的 ensure）。"""
         global _WEIGHBILL_AUDIT_COLS_ENSURED
@@ -122,17 +209,12 @@ class WeighbillService:
         """同 contract_service 中的实现"""
         if image.width < 800 or image.height < 600:
             try:
-                # 模型路径可根据项目结构调整，此处放在 app/models/ 下
-                model_path = Path(__file__).parent / "models" / "ESPCN_x2.pb"
-                if not model_path.exists():
+                if not _SUPER_RES_MODEL_PATH.exists():
                     logger.warning("超分辨率模型文件不存在，跳过")
                     return image
 
                 img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                sr = dnn_superres.DnnSuperResImpl.create()
-                sr.readModel(str(model_path))
-                sr.setModel("fsrcnn", 2)
-                result = sr.upsample(img_cv)
+                result = _get_super_res_model().upsample(img_cv)
 
                 result_rgb = cv2.cvtColor(result, cv2.COLOR_BGR2RGB)
                 return Image.fromarray(result_rgb)
@@ -141,37 +223,37 @@ class WeighbillService:
                 return image
         return image
 
-    def preprocess_image(self, image_path: str) -> str:
-        try:
-            img = Image.open(image_path)
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-
-            # 新增超分辨率处理
-            img = self._apply_super_resolution(img)
+    def _enhance_image(self, img: Image.Image) -> Image.Image:
+        """超分辨率、增强对比度、锐化，并把长边限制在 2000 像素以内"""
+        if img.mode != "RGB":
+            img = img.convert("RGB")
 
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)
-            img = img.filter(ImageFilter.SHARPEN)
+        # 新增超分辨率处理
+        img = self._apply_super_resolution(img)
 
-            max_size = 2000
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(1.5)
+        img = img.filter(ImageFilter.SHARPEN)
 
-            temp_path = tempfile.mktemp(suffix=".jpg")
-            img.save(temp_path, "JPEG", quality=95)
-            return temp_path
+        max_size = 2000
+        if max(img.size) > max_size:
+            ratio = max_size / max(img.size)
+            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        return img
 
+    def preprocess_image_bytes(self, data: bytes) -> Union[Image.Image, bytes]:
+        """内存中预处理图片，返回可直接交给 OCR 的 PIL 图像；失败时原样返回字节"""
+        try:
+            return self._enhance_image(Image.open(io.BytesIO(data)))
         except Exception as e:
             logger.error(f"预处理失败: {e}")
-            return image_path
+            return data
 
     # ========== OCR识别 ==========
 
-    def recognize_weighbill(self, image_path: str) -> Dict[str, Any]:
-        """OCR识别磅单"""
+    def recognize_weighbill(self, image: Union[str, bytes, Image.Image]) -> Dict[str, Any]:
+        """OCR识别磅单（image 可以是文件路径、图片字节或 PIL 图像）"""
         if not self.ocr:
             return {
                 "success": True,
@@ -180,7 +262,7 @@ class WeighbillService:
             }
 
         try:
-            result, elapse = self.ocr(image_path)
+            result, elapse = self.ocr(image)
             total_elapse = sum(elapse) if isinstance(elapse, list) else float(elapse or 0)
 
             if not result:
@@ -274,80 +356,59 @@ class WeighbillService:
         }
 
     def _extract_date(self, text: str) -> Optional[str]:
-        patterns = [
-            r"日期[：:]\s*(\d{4}年\d{1,2}月\d{1,2}日)",
-            r"(\d{4}年\d{1,2}月\d{1,2}日)",
-            r"(\d{4}-\d{2}-\d{2})",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
+        for pattern in _DATE_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(1).replace("年", "-").replace("月", "-").replace("日", "")
         return None
 
     def _extract_ticket_no(self, text: str) -> Optional[str]:
-        patterns = [r"单据号[：:]\s*(\d+)", r"磅单号[：:]\s*(\d+)", r"单号[：:]\s*(\d+)"]
-        for pattern in patterns:
-            match = re.search(pattern, text)
+        for pattern in _TICKET_NO_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(1)
         return None
 
     def _extract_contract_no(self, text: str) -> Optional[str]:
-        patterns = [
-            r"合同编号[：:]\s*([A-Za-z0-9\-]+)",
-            r"合同号[：:]\s*([A-Za-z0-9\-]+)",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
+        for pattern in _CONTRACT_NO_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(1).strip()
         return None
 
     def _extract_vehicle_no(self, text: str) -> Optional[str]:
-        # 車牌標準7位：省簡稱+字母+5位（如豫U12345），新能源8位支持{5,6}
-        patterns = [
-            r"车号[：:]\s*([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})",
-            r"车牌[：:]\s*([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})",
-            r"([京津沪渝冀豫云辽黑湘皖鲁新苏浙赣鄂桂甘晋蒙陕吉闽贵粤青藏川宁琼][A-Z][A-Z0-9]{5,6})",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
+        for pattern in _VEHICLE_NO_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(1)
         return None
 
     def _extract_product_name(self, text: str) -> Optional[str]:
-        patterns = [
-            r"货物名称[：:]\s*(.+?)(?:\n|$)",
-            r"品名[：:]\s*(.+?)(?:\n|$)",
-            r"货名[：:]\s*(.+?)(?:\n|$)",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
+        for pattern in _PRODUCT_NAME_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(1).strip()
         return None
 
     def _extract_weights(self, text: str) -> tuple:
         gross = tare = net = None
-        match = re.search(r"毛重[：:]\s*(\d+\.?\d*)", text)
+        match = _GROSS_WEIGHT_RE.search(text)
         if match:
             gross = float(match.group(1))
-        match = re.search(r"皮重[：:]\s*(\d+\.?\d*)", text)
+        match = _TARE_WEIGHT_RE.search(text)
         if match:
             tare = float(match.group(1))
-        match = re.search(r"净重[：:]\s*(\d+\.?\d*)", text)
+        match = _NET_WEIGHT_RE.search(text)
         if match:
             net = float(match.group(1))
         return gross, tare, net
 
     def _extract_units(self, text: str) -> tuple:
         delivery = receive = None
-        match = re.search(r"送货单位[：:]\s*(.+?)(?:\n|$)", text)
+        match = _DELIVERY_UNIT_RE.search(text)
         if match:
             delivery = match.group(1).strip()
-        match = re.search(r"收货单位[：:]\s*(.+?)(?:\n|$)", text)
+        match = _RECEIVE_UNIT_RE.search(text)
         if match:
             receive = match.group(1).strip()
         return delivery, receive
@@ -355,9 +416,21 @@ class WeighbillService:
     # ========== 合同价格查询 ==========
 
     def get_contract_price_by_product(self, contract_no: str, product_name: str) -> Optional[float]:
-        """根据合同编号和品种获取单价（自动套用品种映射）"""
+        """根据合同编号和品种获取单价（自动套用品种映射），结果短期缓存，合同写操作后失效"""
         if not contract_no or not product_name:
             return None
+        key = (contract_no, str(product_name).strip())
+        cached = _CONTRACT_PRICE_CACHE.get(key, _PRICE_MISS)
+        if cached is not _PRICE_MISS:
+            return cached
+        price = self._query_contract_price(contract_no, product_name)
+        if price is not _PRICE_MISS:
+            _CONTRACT_PRICE_CACHE.set(key, price)
+            return price
+        return None
+
+    def _query_contract_price(self, contract_no: str, product_name: str):
+        """查库获取单价；查询异常返回 _PRICE_MISS（不缓存）"""
         mill_product = convert_to_mill_product(str(product_name).strip())
         try:
             with get_conn() as conn:
@@ -394,7 +467,7 @@ class WeighbillService:
                     return None
         except Exception as e:
             logger.error(f"获取品种单价失败: {e}")
-            return None
+            return _PRICE_MISS
 
     # ========== 新增：获取报单信息方法 ==========
     def get_delivery_info(self, delivery_id: int) -> Optional[Dict[str, Any]]:
@@ -426,7 +499,7 @@ class WeighbillService:
         if vehicle_no is None:
             return None
         s = str(vehicle_no).strip().upper()
-        s = re.sub(r"[\s　·.]+", "", s)
+        s = _VEHICLE_SEP_RE.sub("", s)
         return s or None
 
     def match_delivery_info(self, weigh_date: str, vehicle_no: str,
@@ -435,119 +508,109 @@ class WeighbillService:
         """
         按磅单日期±1天 + 车牌匹配报单。
         参与匹配：待审核、审核通过（已明确驳回的不匹配）。
-        若带合同号首次未命中，会再尝试不按合同号匹配（避免 OCR 合同号与系统略有差异）。
+        带合同号时优先返回合同号一致的报单，没有则按车牌+日期匹配（避免 OCR 合同号与系统略有差异）。
         """
         plate_norm = self._normalize_vehicle_no_for_match(vehicle_no)
         plate_raw = str(vehicle_no).strip() if vehicle_no else None
         if not plate_norm and not plate_raw:
             return None
 
-        def _run_query(extra_conditions: str, params: list) -> Optional[Dict]:
-            try:
-                with get_conn() as conn:
-                    with conn.cursor() as cur:
-                        cur.execute(f"""
-                            SELECT * FROM pd_deliveries 
-                            WHERE (
-                                REPLACE(REPLACE(vehicle_no, ' ', ''), '　', '') = %s
-                                OR vehicle_no = %s
-                            )
-                            AND (
-                                report_date = DATE(%s)
-                                OR report_date = DATE_ADD(DATE(%s), INTERVAL 1 DAY)
-                                OR report_date = DATE_SUB(DATE(%s), INTERVAL 1 DAY)
-                            )
-                            AND status IN ('待审核', '审核通过')
-                            {extra_conditions}
-                            ORDER BY ABS(DATEDIFF(report_date, DATE(%s))), created_at ASC
-                            LIMIT 1
-                        """, tuple(params))
-                        row = cur.fetchone()
-                        if not row:
-                            return None
-                        columns = [desc[0] for desc in cur.description]
-                        return dict(zip(columns, row))
-            except Exception as e:
-                logger.error(f"匹配报货订单失败: {e}")
-                return None
-
-        base_params = [
-            plate_norm or plate_raw,
-            plate_raw or plate_norm,
-            weigh_date, weigh_date, weigh_date, weigh_date,
-        ]
+        params: list = [plate_norm or plate_raw, plate_raw or plate_norm, weigh_date, weigh_date, weigh_date]
         extra = ""
         if driver_name:
             extra += " AND driver_name = %s"
-            base_params.append(driver_name)
+            params.append(driver_name)
+        # 合同号只参与排序不参与过滤：命中合同号的报单优先，未命中时退化为车牌+日期匹配
+        # （避免 OCR 合同号与系统略有差异），一次查询代替原先的两次
+        order_by = "ABS(DATEDIFF(report_date, DATE(%s))), created_at ASC"
+        order_params = [weigh_date]
         if contract_no:
-            extra += " AND contract_no = %s"
-            base_params.append(contract_no)
+            order_by = "(contract_no = %s) DESC, " + order_by
+            order_params.insert(0, contract_no)
+        params.extend(order_params)
 
-        found = _run_query(extra, list(base_params))
-        if found:
-            return found
-        if contract_no:
-            # 合同号 OCR 与系统不一致时，用车牌+日期再试
-            retry_extra = ""
-            retry_params = [
-                plate_norm or plate_raw,
-                plate_raw or plate_norm,
-                weigh_date, weigh_date, weigh_date, weigh_date,
-            ]
-            if driver_name:
-                retry_extra += " AND driver_name = %s"
-                retry_params.append(driver_name)
-            return _run_query(retry_extra, retry_params)
-        return None
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT * FROM pd_deliveries 
+                        WHERE (
+                            REPLACE(REPLACE(vehicle_no, ' ', ''), '　', '') = %s
+                            OR vehicle_no = %s
+                        )
+                        AND (
+                            report_date = DATE(%s)
+                            OR report_date = DATE_ADD(DATE(%s), INTERVAL 1 DAY)
+                            OR report_date = DATE_SUB(DATE(%s), INTERVAL 1 DAY)
+                        )
+                        AND status IN ('待审核', '审核通过')
+                        {extra}
+                        ORDER BY {order_by}
+                        LIMIT 1
+                    """, tuple(params))
+                    row = cur.fetchone()
+                    if not row:
+                        return None
+                    columns = [desc[0] for desc in cur.description]
+                    return dict(zip(columns, row))
+        except Exception as e:
+            logger.error(f"匹配报货订单失败: {e}")
+            return None
 
     def auto_fill_data(self, ocr_data: Dict) -> Dict:
         result = ocr_data.copy()
+        result.update(self.match_delivery_fields(ocr_data))
+        result.update(self.contract_price_fields(ocr_data))
+        return result
+
+    def match_delivery_fields(self, ocr_data: Dict) -> Dict:
+        """auto_fill_data 的报单匹配部分：返回需合并到识别结果中的字段"""
         weigh_date = ocr_data.get("weigh_date")
         vehicle_no = ocr_data.get("vehicle_no")
+        if not (weigh_date and vehicle_no):
+            return {}
+
+        # 匹配报货订单（传入可选合同号）
+        delivery = self.match_delivery_info(
+            weigh_date, vehicle_no,
+            contract_no=ocr_data.get("contract_no")  # 司机姓名暂未解析，可后续扩展
+        )
+        if not delivery:
+            return {"match_message": "未找到匹配的报货订单，请手动填写"}
+        return {
+            "matched_delivery_id": delivery["id"],
+            "warehouse": delivery.get("warehouse"),
+            "target_factory_name": delivery.get("target_factory_name"),
+            "driver_name": delivery.get("driver_name"),
+            "driver_phone": delivery.get("driver_phone"),
+            "driver_id_card": delivery.get("driver_id_card"),
+            "match_message": "已匹配报货订单",
+        }
+
+    def contract_price_fields(self, ocr_data: Dict) -> Dict:
+        """auto_fill_data 的合同单价部分：与报单匹配互不依赖，可并发查询"""
         contract_no = ocr_data.get("contract_no")
         product_name = ocr_data.get("product_name")
         net_weight = ocr_data.get("net_weight")
-
-        # 匹配报货订单（传入可选合同号）
-        if weigh_date and vehicle_no:
-            delivery = self.match_delivery_info(
-                weigh_date, vehicle_no,
-                contract_no=contract_no  # 司机姓名暂未解析，可后续扩展
-            )
-            if delivery:
-                result["matched_delivery_id"] = delivery["id"]
-                result["warehouse"] = delivery.get("warehouse")
-                result["target_factory_name"] = delivery.get("target_factory_name")
-                result["driver_name"] = delivery.get("driver_name")
-                result["driver_phone"] = delivery.get("driver_phone")
-                result["driver_id_card"] = delivery.get("driver_id_card")
-                result["match_message"] = "已匹配报货订单"
-            else:
-                result["match_message"] = "未找到匹配的报货订单，请手动填写"
+        if not contract_no:
+            return {}
 
         # 获取合同单价（套用品种映射，合同品种为冶炼厂标准名）
-        if contract_no and product_name:
+        if product_name:
             mill_product = convert_to_mill_product(product_name)
             price = self.get_contract_price_by_product(contract_no, mill_product)
-            if price:
-                result["unit_price"] = price
-                if net_weight:
-                    result["total_amount"] = round(price * net_weight, 2)
-                result["price_message"] = f"已获取合同单价（品种：{mill_product}）"
-            else:
-                result["price_message"] = "未找到合同单价，请手动填写"
-        elif contract_no:
+            found_message = f"已获取合同单价（品种：{mill_product}）"
+        else:
             price = self.get_contract_price_by_product(contract_no, "废电瓶")
-            if price:
-                result["unit_price"] = price
-                if net_weight:
-                    result["total_amount"] = round(price * net_weight, 2)
-                result["price_message"] = "已获取合同默认单价"
-            else:
-                result["price_message"] = "未找到合同单价，请手动填写"
+            found_message = "已获取合同默认单价"
+        if not price:
+            return {"price_message": "未找到合同单价，请手动填写"}
 
-        return result
+        fields: Dict[str, Any] = {"unit_price": price}
+        if net_weight:
+            fields["total_amount"] = round(price * net_weight, 2)
+        fields["price_message"] = found_message
+        return fields
 
     # ========== 核心：上传/修改磅单 ==========
 
@@ -618,29 +681,10 @@ class WeighbillService:
             return None
 
     def _recognize_from_bytes(self, image_bytes: bytes) -> Dict[str, Any]:
-        """从字节流识别磅单"""
-        temp_path = None
+        """从字节流识别磅单（内存中预处理，不落盘临时文件）"""
         try:
-            # 保存临时文件
-            temp_path = tempfile.mktemp(suffix=".jpg")
-            with open(temp_path, "wb") as f:
-                f.write(image_bytes)
-
-            # 预处理并识别
-            processed_path = self.preprocess_image(temp_path)
-            result = self.recognize_weighbill(processed_path)
-
-            # 清理临时文件
-            if processed_path != temp_path and os.path.exists(processed_path):
-                os.remove(processed_path)
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
-            return result
-
+            return self.recognize_weighbill(self.preprocess_image_bytes(image_bytes))
         except Exception as e:
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
             return {"success": False, "error": str(e)}
 
     def _match_delivery_by_ocr(self, ocr_data: Dict) -> Optional[Dict]:
@@ -732,7 +776,7 @@ class WeighbillService:
             delivery_id: int,
             product_name: str,
             data: Dict[str, Any],
-            image_file: bytes = None,
+            image_file: Union[bytes, BinaryIO] = None,
             current_user: dict = None,
             is_manual: bool = False
     ) -> Dict[str, Any]:
@@ -784,14 +828,19 @@ class WeighbillService:
                             existing = dict(zip(columns, existing_row))
 
                     if image_file:
-                        safe_product = re.sub(r"[^\w\-]", "_", normalized_product) or "product"
+                        safe_product = _SAFE_NAME_RE.sub("_", normalized_product) or "product"
                         filename = (
                             f"weighbill_{delivery_id}_{safe_product}_"
                             f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
                         )
                         file_path = UPLOAD_DIR / filename
                         with open(file_path, "wb") as f:
-                            f.write(image_file)
+                            if isinstance(image_file, (bytes, bytearray)):
+                                f.write(image_file)
+                            else:
+                                # 文件对象（如 UploadFile.file）分块拷贝，不整体读入内存
+                                image_file.seek(0)
+                                shutil.copyfileobj(image_file, f, UPLOAD_CHUNK_SIZE)
                         temp_file_path = str(file_path)
                         old_image_path = existing.get("weighbill_image") if existing else None
 
@@ -993,9 +1042,11 @@ class WeighbillService:
             if final_warehouse_name is None and existing:
                 final_warehouse_name = existing.get("warehouse_name")
 
-            if temp_file_path and old_image_path and old_image_path != temp_file_path and os.path.exists(old_image_path):
+            if temp_file_path and old_image_path and old_image_path != temp_file_path:
                 try:
                     os.remove(old_image_path)
+                except FileNotFoundError:
+                    pass
                 except Exception as e:
                     logger.warning(f"删除旧磅单图片失败: {e}")
 
@@ -1016,15 +1067,12 @@ class WeighbillService:
                     "warehouse_name": final_warehouse_name,
                     "warehouse": final_warehouse,
                     "payee": final_payee,
+                    "target_factory_name": delivery_info.get("target_factory_name"),
                 }
             }
 
         except Exception as e:
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                except Exception:
-                    pass
+            remove_file_quietly(temp_file_path)
             logger.error(
                 "上传/修改磅单失败 delivery_id=%s product_name=%s user_id=%s: %s",
                 delivery_id,
@@ -1296,6 +1344,19 @@ class WeighbillService:
 
     # ========== 查询 ==========
 
+    def get_weighbill_key(self, weighbill_id: int) -> Optional[Dict[str, Any]]:
+        """只取磅单的报单ID/品种/合同编号（修改磅单定位用，不联表）"""
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT delivery_id, product_name, contract_no FROM pd_weighbills WHERE id = %s",
+                    (weighbill_id,),
+                )
+                row = cur.fetchone()
+        if not row:
+            return None
+        return {"delivery_id": row[0], "product_name": row[1], "contract_no": row[2]}
+
     def get_weighbill(self, weighbill_id: int) -> Optional[Dict]:
         """获取磅单详情（包含报单信息）"""
         try:
@@ -1457,6 +1518,22 @@ class WeighbillService:
                 weighbill_map[delivery_id] = []
             weighbill_map[delivery_id].append(wb)
 
+    @staticmethod
+    def encode_list_cursor(created_at: Any, delivery_id: int) -> str:
+        """磅单列表游标：上一页最后一条报单的 (created_at, id)，base64url 编码"""
+        raw = f"{created_at}|{delivery_id}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def decode_list_cursor(cursor: str) -> tuple:
+        """解析 encode_list_cursor 生成的游标，格式不对时抛 ValueError"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            created_at, delivery_id = raw.rsplit("|", 1)
+            return datetime.fromisoformat(created_at), int(delivery_id)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ValueError("无效的分页游标") from exc
+
     def list_weighbills_grouped(
             self,
             exact_shipper: str = None,
@@ -1476,12 +1553,17 @@ class WeighbillService:
             exact_payout_status: int = None,  # 新增：打款状态 0=待打款,1=已打款
             exact_collection_status: int = None,  # 新增：回款状态 0=待回款,1=已回首笔,2=已回款
             page: int = 1,
-            page_size: int = 20
+            page_size: int = 20,
+            after: Optional[tuple] = None,
+            with_total: bool = True,
     ) -> Dict[str, Any]:
         """
         查询磅单列表（按报单ID分组）
         返回嵌套结构：报单信息 + 该报单下的所有磅单列表
 
+        分页：默认按 page/page_size（OFFSET）；传 after=(created_at, id)（由 decode_list_cursor 解析
+        上一页返回的 next_cursor）时改为游标分页，不再扫描前面的页。with_total=False 时跳过 COUNT，total 返回 None。
+
         司机姓名 / 身份证 / 车牌：与报单 pd_deliveries 关联。
         - driver_name、driver_id_card、vehicle_no 非空时按 LIKE %关键词% 模糊匹配；
         - 对应字段未传模糊参数时，可使用 exact_driver_name、exact_driver_id_card、exact_vehicle_no 精确匹配。
@@ -1530,37 +1612,67 @@ class WeighbillService:
                     delivery_sql = " AND ".join(delivery_where)
 
                     # 查询报单总数
+                    total = None
+                    if with_total:
+                        cur.execute(f"""
+                            SELECT COUNT(*) 
+                            FROM pd_deliveries d
+                            WHERE {delivery_sql}
+                        """, tuple(delivery_params))
+                        total = cur.fetchone()[0]
+
+                    # 分页查询报单ID（多取一条判断是否还有下一页；id 作为同一时间的次序键，保证翻页稳定）
+                    page_sql = delivery_sql
+                    page_params = list(delivery_params)
+                    if after is not None:
+                        page_sql += " AND (d.created_at < %s OR (d.created_at = %s AND d.id < %s))"
+                        page_params += [after[0], after[0], after[1]]
+                        limit_sql = "LIMIT %s"
+                        page_params.append(page_size + 1)
+                    else:
+                        limit_sql = "LIMIT %s OFFSET %s"
+                        page_params += [page_size + 1, (page - 1) * page_size]
                     cur.execute(f"""
-                        SELECT COUNT(DISTINCT d.id) 
-                        FROM pd_deliveries d
-                        WHERE {delivery_sql}
-                    """, tuple(delivery_params))
-                    total = cur.fetchone()[0]
-
-                    # 分页查询报单ID
-                    offset = (page - 1) * page_size
-                    cur.execute(f"""
-                        SELECT DISTINCT d.id,d.created_at
+                        SELECT d.id, d.created_at
                         FROM pd_deliveries d
-                        WHERE {delivery_sql}
-                        ORDER BY d.created_at DESC
-                        LIMIT %s OFFSET %s
-                    """, tuple(delivery_params + [page_size, offset]))
-                    delivery_ids = [row[0] for row in cur.fetchall()]
+                        WHERE {page_sql}
+                        ORDER BY d.created_at DESC, d.id DESC
+                        {limit_sql}
+                    """, tuple(page_params))
+                    page_rows = cur.fetchall()
+                    has_more = len(page_rows) > page_size
+                    page_rows = page_rows[:page_size]
+                    delivery_ids = [row[0] for row in page_rows]
+                    next_cursor = None
+                    if has_more:
+                        last_id, last_created_at = page_rows[-1]
+                        next_cursor = self.encode_list_cursor(last_created_at, last_id)
 
                     if not delivery_ids:
-                        return {"success": True, "data": [], "total": 0, "page": page, "page_size": page_size}
+                        return {
+                            "success": True, "data": [], "total": 0 if with_total else None,
+                            "page": page, "page_size": page_size, "has_more": False, "next_cursor": None,
+                        }
 
                     # 查询报单详细信息
                     format_ids = ','.join(['%s'] * len(delivery_ids))
+                    # 磅单数/已上传数：对本页报单一次分组统计，代替每个报单两条相关子查询
                     cur.execute(f"""
                         SELECT d.*,
-                               (SELECT COUNT(*) FROM pd_weighbills WHERE delivery_id = d.id) as total_weighbills,
-                               (SELECT COUNT(*) FROM pd_weighbills WHERE delivery_id = d.id AND upload_status = '已上传') as uploaded_weighbills
+                               COALESCE(wc.total_weighbills, 0) AS total_weighbills,
+                               COALESCE(wc.uploaded_weighbills, 0) AS uploaded_weighbills
                         FROM pd_deliveries d
+                        LEFT JOIN (
+                            SELECT delivery_id,
+                                   COUNT(*) AS total_weighbills,
+                                   COUNT(CASE WHEN upload_status = '已上传' THEN 1 END) AS uploaded_weighbills
+                            FROM pd_weighbills
+                            WHERE delivery_id IN ({format_ids})
+                            GROUP BY delivery_id
+                        ) wc ON wc.delivery_id = d.id
                         WHERE d.id IN ({format_ids})
-                        ORDER BY d.created_at DESC
-                    """, tuple(delivery_ids))
+                        ORDER BY d.created_at DESC, d.id DESC
+                    """, tuple(delivery_ids) * 2)
 
                     delivery_columns = [desc[0] for desc in cur.description]
                     delivery_rows = cur.fetchall()
@@ -1606,9 +1718,10 @@ class WeighbillService:
                         weighbill_where.append("(w.audit_status IN ('待审核', '审核通过') OR w.audit_status IS NULL)")
 
                     weighbill_sql = " AND ".join(weighbill_where)
+                    weighbill_cols = self._list_weighbill_select()
 
                     cur.execute(f"""
-                        SELECT w.*, 
+                        SELECT {weighbill_cols},
                                d.report_date, d.warehouse, d.target_factory_name,
                                d.driver_name, d.driver_phone, d.driver_id_card,
                                d.has_delivery_order, d.shipper, d.payee, d.reporter_name,
@@ -1708,7 +1821,7 @@ class WeighbillService:
                         weighbill_sql_bf = " AND ".join(weighbill_where_bf)
                         cur.execute(
                             f"""
-                        SELECT w.*, 
+                        SELECT {weighbill_cols},
                                d.report_date, d.warehouse, d.target_factory_name,
                                d.driver_name, d.driver_phone, d.driver_id_card,
                                d.has_delivery_order, d.shipper, d.payee, d.reporter_name,
@@ -1857,7 +1970,9 @@ class WeighbillService:
                         "data": result_data,
                         "total": total,
                         "page": page,
-                        "page_size": page_size
+                        "page_size": page_size,
+                        "has_more": has_more,
+                        "next_cursor": next_cursor,
                     }
 
         except Exception as e:
@@ -2016,6 +2131,76 @@ class WeighbillService:
             logger.error("磅单审核失败: %s", e)
             return {"success": False, "error": str(e)}
 
+    def batch_confirm_weighbills(self, weighbill_ids: List[int]) -> Dict[str, Any]:
+        """
+        批量确认磅单：已上传、“待确认”且单价/净重齐全的磅单改为“已确认”，总价按 单价×净重 在库内重算；
+        “已修正”（人工修正标记需保留）等其它状态、缺单价的磅单不受影响。
+        一次加锁查询 + 一条 UPDATE，不逐条读改写；返回总价发生变化的磅单，供调用方同步收款明细。
+        """
+        ids = sorted({int(i) for i in weighbill_ids})
+        if not ids:
+            return {"success": False, "error": "磅单ID列表不能为空"}
+
+        placeholders = ",".join(["%s"] * len(ids))
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    conn.begin()
+                    cur.execute(
+                        f"""
+                        SELECT id, delivery_id, contract_no, product_name, unit_price, net_weight, total_amount
+                        FROM pd_weighbills
+                        WHERE id IN ({placeholders})
+                          AND upload_status = '已上传'
+                          AND ocr_status = '待确认'
+                          AND unit_price IS NOT NULL
+                          AND net_weight IS NOT NULL
+                        FOR UPDATE
+                        """,
+                        tuple(ids),
+                    )
+                    rows = cur.fetchall()
+
+                    changed = []
+                    if rows:
+                        target_ids = [row[0] for row in rows]
+                        cur.execute(
+                            f"""
+                            UPDATE pd_weighbills
+                            SET total_amount = ROUND(unit_price * net_weight, 2),
+                                ocr_status = '已确认',
+                                updated_at = NOW()
+                            WHERE id IN ({",".join(["%s"] * len(target_ids))})
+                            """,
+                            tuple(target_ids),
+                        )
+                        # 与库内 ROUND(DECIMAL) 一致：十进制精确乘法后四舍五入到分
+                        for bill_id, delivery_id, contract_no, product_name, unit_price, net_weight, old_total in rows:
+                            new_total = (Decimal(str(unit_price)) * Decimal(str(net_weight))).quantize(
+                                Decimal("0.01"), rounding=ROUND_HALF_UP
+                            )
+                            old_total = None if old_total is None else Decimal(str(old_total))
+                            if new_total != old_total:
+                                changed.append({
+                                    "weighbill_id": bill_id,
+                                    "delivery_id": delivery_id,
+                                    "contract_no": contract_no,
+                                    "product_name": product_name,
+                                    "unit_price": unit_price,
+                                    "net_weight": net_weight,
+                                    "total_amount": new_total,
+                                })
+                    conn.commit()
+
+                    return {
+                        "success": True,
+                        "message": f"已确认 {len(rows)} 条磅单",
+                        "data": {"requested": len(ids), "confirmed": len(rows), "total_changed": changed},
+                    }
+        except Exception as e:
+            logger.error("批量确认磅单失败: %s", e)
+            return {"success": False, "error": str(e)}
+
     # ========== 修改磅单合同（级联） ==========
 
     def update_weighbill_contract(
@@ -0,0 +1 @@
+"""Celery 任务（业务模块，与智能预测共用 celery_app / Worker）。"""
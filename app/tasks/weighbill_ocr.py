@@ -0,0 +1,56 @@
+"""Celery：磅单 OCR 异步识别。"""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Dict
+
+from app.core.logging import get_logger
+from app.core.paths import TEMP_UPLOADS_DIR
+from app.intelligent_prediction.tasks.celery_app import celery_app
+
+logger = get_logger(__name__)
+
+# 待识别图片落盘在 uploads/temp 的文件名前缀；任务超过 OCR_JOB_EXPIRES_SECONDS 未开始执行即作废
+OCR_JOB_IMAGE_PREFIX = "weighbill_job_"
+OCR_JOB_EXPIRES_SECONDS = 30 * 60
+# 任务过期/被撤销/被清出队列/Worker 崩溃时图片不会被任务删除，由定时清理兜底；
+# 阈值留足过期时长外的识别耗时，避免删掉仍在识别的图片
+_OCR_JOB_IMAGE_MAX_AGE_SECONDS = 2 * OCR_JOB_EXPIRES_SECONDS
+
+
+@celery_app.task(name="weighbills.recognize_weighbill")
+def recognize_weighbill_task(image_path: str, auto_match: bool = True) -> Dict[str, Any]:
+    """识别已落盘的磅单图片（识别完删除），返回值与 WeighbillService.recognize_weighbill 相同"""
+    from app.services.weighbill_service import get_weighbill_service
+
+    service = get_weighbill_service()
+    try:
+        with open(image_path, "rb") as fh:
+            content = fh.read()
+        result = service.recognize_weighbill(service.preprocess_image_bytes(content))
+        if result["success"] and auto_match:
+            result["data"] = service.auto_fill_data(result["data"])
+        return result
+    finally:
+        try:
+            os.remove(image_path)
+        except OSError:
+            logger.warning("weighbill ocr temp file cleanup failed: %s", image_path)
+
+
+def sweep_stale_ocr_job_images(max_age_seconds: float = _OCR_JOB_IMAGE_MAX_AGE_SECONDS) -> int:
+    """删除 uploads/temp 下超过 max_age_seconds 仍未被任务处理的磅单图片，返回删除数"""
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for path in TEMP_UPLOADS_DIR.glob(f"{OCR_JOB_IMAGE_PREFIX}*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info("weighbill ocr stale temp files removed: %s", removed)
+    return removed
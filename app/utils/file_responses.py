@@ -0,0 +1,119 @@
+"""
+图片/附件下载响应（路由层共用）
+
+在 FileResponse 基础上补充条件请求：按文件 mtime+size 生成 ETag，
+客户端携带 If-None-Match / If-Modified-Since 且文件未变化时直接返回 304，
+不再读取文件。stat 在线程池中执行，避免慢盘/NFS 阻塞事件循环。
+
+热点小图片可开启 cache_in_memory：内容按 (路径, mtime, size) 缓存在进程内 LRU 中，
+文件被覆盖或删除后 stat 结果变化即自然失效，无需上传/删除接口显式清理。
+"""
+import asyncio
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Mapping, Optional, Union
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from app.utils.ttl_cache import TTLCache
+
+DEFAULT_CACHE_CONTROL = "private, max-age=3600"
+
+# 仅缓存不超过该大小的文件；最多 256 个条目
+MEMORY_CACHE_MAX_FILE_SIZE = 512 * 1024
+_MEMORY_CACHE = TTLCache(maxsize=256, ttl=600)
+
+
+def _make_etag(stat_result: os.stat_result) -> str:
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def _not_modified(request: Request, etag: str, stat_result: os.stat_result) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since
+    return False
+
+
+def _content_disposition(disposition_type: str, filename: str) -> str:
+    """与 FileResponse 相同的 Content-Disposition 生成规则（非 ASCII 文件名走 filename*）"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition_type}; filename*=utf-8''{quoted}"
+    return f'{disposition_type}; filename="{filename}"'
+
+
+def _read_if_unchanged(path: Union[str, Path], size: int) -> Optional[bytes]:
+    """读取文件内容；读到的长度与 stat 不一致（读取期间被覆盖）时返回 None"""
+    with open(path, "rb") as fh:
+        data = fh.read(size + 1)
+    return data if len(data) == size else None
+
+
+async def conditional_file_response(
+    request: Request,
+    path: Union[str, Path],
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    content_disposition_type: str = "inline",
+    headers: Optional[Mapping[str, str]] = None,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+    not_found_detail: str = "文件不存在",
+    cache_in_memory: bool = False,
+) -> Response:
+    """
+    返回支持 ETag/Last-Modified 条件请求的文件响应；文件不存在时抛 404。
+    cache_in_memory=True 时小文件内容缓存在进程内，命中后直接返回 bytes，不再打开文件。
+    """
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail=not_found_detail)
+
+    etag = _make_etag(stat_result)
+    cache_headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+    }
+    if _not_modified(request, etag, stat_result):
+        return Response(status_code=304, headers=cache_headers)
+
+    if cache_in_memory and stat_result.st_size <= MEMORY_CACHE_MAX_FILE_SIZE:
+        key = (str(path), stat_result.st_mtime_ns, stat_result.st_size)
+        content = _MEMORY_CACHE.get(key)
+        if content is None:
+            try:
+                content = await asyncio.to_thread(_read_if_unchanged, path, stat_result.st_size)
+            except (FileNotFoundError, NotADirectoryError):
+                raise HTTPException(status_code=404, detail=not_found_detail)
+            if content is not None:
+                _MEMORY_CACHE.set(key, content)
+        if content is not None:
+            response_headers = {**cache_headers, **(headers or {})}
+            if filename is not None:
+                response_headers.setdefault(
+                    "Content-Disposition", _content_disposition(content_disposition_type, filename)
+                )
+            return Response(content=content, media_type=media_type, headers=response_headers)
+
+    return FileResponse(
+        path=str(path),
+        media_type=media_type,
+        filename=filename,
+        content_disposition_type=content_disposition_type,
+        stat_result=stat_result,
+        headers={**cache_headers, **(headers or {})},
+    )
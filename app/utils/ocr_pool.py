@@ -0,0 +1,87 @@
+"""
+OCR 专用线程池
+
+图片预处理与 RapidOCR 推理都在 C 扩展中执行并释放 GIL，放到独立线程池里跑，
+避免阻塞事件循环，同时不占用 FastAPI 默认线程池。池大小由 OCR_CONCURRENCY 控制。
+
+识别调用另经 run_ocr_limited 限流：信号量限制同时在途的识别任务数
+（OCR_MAX_CONCURRENCY），可选的最小调用间隔（OCR_MIN_INTERVAL_SECONDS）平滑突发流量。
+
+get_ocr_engine 返回进程内共享的 RapidOCR 实例（首次调用时加载模型），
+磅单、支付回单、合同识别共用一份，避免重复加载模型占用内存。
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from app.core.config import settings
+
+try:
+    from rapidocr_onnxruntime import RapidOCR
+
+    RAPIDOCR_AVAILABLE = True
+except ImportError:
+    RAPIDOCR_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+OCR_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.ocr_concurrency,
+    thread_name_prefix="ocr",
+)
+
+_OCR_SEMAPHORE = asyncio.Semaphore(settings.ocr_max_concurrency)
+_RATE_LOCK = asyncio.Lock()
+_last_call = 0.0
+
+
+_ocr_engine = None
+_ocr_init_failed = False
+_ocr_lock = threading.Lock()
+
+
+def get_ocr_engine():
+    """进程内共享的 RapidOCR 引擎（懒加载；未安装或初始化失败时为 None）"""
+    global _ocr_engine, _ocr_init_failed
+    if _ocr_engine is not None or _ocr_init_failed or not RAPIDOCR_AVAILABLE:
+        return _ocr_engine
+    with _ocr_lock:
+        if _ocr_engine is None and not _ocr_init_failed:
+            try:
+                _ocr_engine = RapidOCR()
+                logger.info("RapidOCR 初始化成功")
+            except Exception as e:
+                _ocr_init_failed = True
+                logger.error(f"RapidOCR 初始化失败: {e}")
+    return _ocr_engine
+
+
+async def run_ocr(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """在 OCR 线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(OCR_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+async def _wait_min_interval() -> None:
+    global _last_call
+    interval = settings.ocr_min_interval_seconds
+    if interval <= 0:
+        return
+    async with _RATE_LOCK:
+        wait = interval - (time.monotonic() - _last_call)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        _last_call = time.monotonic()
+
+
+async def run_ocr_limited(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """限流执行 OCR 识别：并发上限 + 最小间隔"""
+    async with _OCR_SEMAPHORE:
+        await _wait_min_interval()
+        return await run_ocr(func, *args, **kwargs)
@@ -0,0 +1,178 @@
+"""
+上传文件落盘工具（路由层共用）
+
+UploadFile.file 是同步的 SpooledTemporaryFile，直接 shutil.copyfileobj 会在
+async 路由里阻塞事件循环；这里统一把读写放到线程池执行。
+"""
+import asyncio
+import hashlib
+import io
+import itertools
+import os
+import secrets
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional, Union
+
+from fastapi import UploadFile
+
+# 单次读取块大小：1 MiB
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# 文件名唯一后缀：进程启动时生成一次随机前缀 + 进程内自增计数，每次上传无需读取系统随机数
+_NAME_PREFIX = f"{os.getpid():x}{secrets.token_hex(2)}"
+_name_counter = itertools.count()
+
+
+def unique_name_suffix() -> str:
+    """生成进程内唯一、跨重启不重复的文件名后缀"""
+    return f"{_NAME_PREFIX}{next(_name_counter):x}"
+
+
+# 文件头魔数 -> MIME（按实际内容判定类型，不信任客户端声明的 content_type）
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"BM", "image/bmp"),
+)
+_SNIFF_SIZE = 12
+
+
+async def sniff_image_mime(upload: UploadFile) -> Optional[str]:
+    """读取文件头判定图片类型，返回 MIME；无法识别返回 None。读取后指针复位到开头"""
+    header = await upload.read(_SNIFF_SIZE)
+    await upload.seek(0)
+    for signature, mime in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def upload_stream(upload: Optional[UploadFile]) -> Optional[BinaryIO]:
+    """
+    取上传文件的底层文件对象交给服务层分块落盘（不整体 read() 进内存）；
+    未上传或空文件返回 None，与空 bytes 视为未上传的判断一致
+    """
+    if upload is None or upload.size == 0:
+        return None
+    return upload.file
+
+
+def _copy_and_hash(src: BinaryIO, dest: Union[str, Path], chunk_size: int) -> str:
+    hasher = hashlib.sha256()
+    src.seek(0)
+    with open(dest, "wb") as fh:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            fh.write(chunk)
+    return hasher.hexdigest()
+
+
+def _sendfile_copy(src: BinaryIO, dest: Union[str, Path]) -> bool:
+    """
+    源文件已落盘（SpooledTemporaryFile 超过内存阈值后转为真实文件）时用 os.sendfile
+    在内核态完成拷贝；源仍在内存中或平台/文件系统不支持时返回 False，由调用方回退。
+    """
+    if not hasattr(os, "sendfile"):
+        return False
+    # 仍在内存中的 SpooledTemporaryFile 调用 fileno() 会强制转存到磁盘，先行判断
+    if not getattr(src, "_rolled", True):
+        return False
+    try:
+        src.flush()
+        in_fd = src.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+
+    size = os.fstat(in_fd).st_size
+    with open(dest, "wb") as fh:
+        offset = 0
+        try:
+            while offset < size:
+                sent = os.sendfile(fh.fileno(), in_fd, offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError:
+            if offset:
+                raise
+            return False
+    return True
+
+
+def _copy(src: BinaryIO, dest: Union[str, Path], chunk_size: int) -> None:
+    if not _sendfile_copy(src, dest):
+        src.seek(0)
+        with open(dest, "wb") as fh:
+            shutil.copyfileobj(src, fh, chunk_size)
+
+
+async def save_upload_file(
+    upload: UploadFile,
+    dest: Union[str, Path],
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    compute_hash: bool = True,
+) -> Optional[str]:
+    """
+    将上传文件分块写入 dest，不阻塞事件循环。
+    写入同时计算 SHA-256，返回十六进制摘要（用于重复上传判定，无需再读一遍文件）。
+    compute_hash=False 时不计算摘要（返回 None），源文件已落盘则走 os.sendfile 零拷贝。
+
+    整个 读-哈希-写 循环在一次线程池调用中完成：逐块 await 读写时每块要往返线程池两次，
+    大文件时调度开销明显。
+    """
+    if compute_hash:
+        return await asyncio.to_thread(_copy_and_hash, upload.file, dest, chunk_size)
+    await asyncio.to_thread(_copy, upload.file, dest, chunk_size)
+    return None
+
+
+def remove_file_quietly(path: Union[str, Path, None]) -> None:
+    """删除文件；文件不存在或删除失败时忽略"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_all(paths: Iterable[Union[str, Path, None]]) -> None:
+    for path in paths:
+        remove_file_quietly(path)
+
+
+async def remove_files(*paths: Union[str, Path, None]) -> None:
+    """在线程池中删除文件（unlink 在慢盘上可能阻塞）"""
+    await asyncio.to_thread(_remove_all, paths)
+
+
+class UploadGuard:
+    """
+    上传文件清理守卫：with 块内未调用 commit() 即退出（异常或提前返回）时删除文件。
+
+        with UploadGuard(path) as guard:
+            await save_upload_file(file, path)
+            ...写库...
+            guard.commit()
+    """
+
+    def __init__(self, path: Union[str, Path, None]):
+        self.path = path
+        self.committed = False
+
+    def commit(self) -> None:
+        self.committed = True
+
+    def __enter__(self) -> "UploadGuard":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if not self.committed:
+            remove_file_quietly(self.path)
+        return False
@@ -6,6 +6,7 @@ import jwt
 from fastapi import Header, HTTPException, status
 
 from app.core.config import settings
+from app.core.security import decode_token
 from core.database import get_conn
 
 
@@ -39,7 +40,7 @@ def create_access_token(
 
 def _decode_token(token: str) -> Dict[str, Any]:
     try:
-        return jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
+        return decode_token(token, settings.jwt_secret, settings.jwt_algorithm)
     except jwt.ExpiredSignatureError as exc:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired") from exc
     except jwt.InvalidTokenError as exc:
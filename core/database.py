@@ -1,7 +1,11 @@
 import os
+import queue
+import time
 from contextlib import contextmanager
+from typing import Callable
 
 import pymysql
+from pymysql.constants import SERVER_STATUS
 
 
 def _require_env(name: str) -> str:
@@ -24,22 +28,91 @@ def _get_db_config() -> dict:
     }
 
 
-@contextmanager
-def get_conn():
-    config = _get_db_config()
-    connection = pymysql.connect(**config)
+def _get_tuple_db_config() -> dict:
+    """元组游标（row[0] 等）连接配置：去掉 DictCursor，其余与 get_conn 相同"""
+    return {k: v for k, v in _get_db_config().items() if k != "cursorclass"}
+
+
+# ============ 连接池 ============
+# get_conn 每次新建 TCP 连接 + 认证的开销远大于一次简单查询；这里在进程内复用空闲连接。
+# 池满时多余连接直接关闭；with 块内抛异常的连接状态不确定，同样关闭不回池。
+# DictCursor 与元组游标的连接分池存放，互不混用。
+
+_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "10"))
+# 空闲超过该秒数的连接复用前先 ping，避免拿到已被服务端 wait_timeout 断开的连接
+_POOL_PING_INTERVAL = 60.0
+
+_pool: "queue.LifoQueue[tuple]" = queue.LifoQueue(maxsize=_POOL_SIZE)
+_tuple_pool: "queue.LifoQueue[tuple]" = queue.LifoQueue(maxsize=_POOL_SIZE)
+# 建池时的进程号：fork 出的子进程（如 Celery prefork worker）继承的空闲连接与父进程共用套接字，不能复用
+_pool_pid = os.getpid()
+
+
+def _check_fork() -> None:
+    global _pool, _tuple_pool, _pool_pid
+    pid = os.getpid()
+    if pid == _pool_pid:
+        return
+    # 只丢弃继承来的连接、不 close：close 会向服务端发送 COM_QUIT，断开父进程仍在使用的连接
+    _pool = queue.LifoQueue(maxsize=_POOL_SIZE)
+    _tuple_pool = queue.LifoQueue(maxsize=_POOL_SIZE)
+    _pool_pid = pid
+
+
+def _close_quietly(connection) -> None:
     try:
-        yield connection
-    finally:
         connection.close()
+    except Exception:
+        pass
+
+
+def _acquire(pool: queue.LifoQueue, config: Callable[[], dict]):
+    try:
+        last_used, connection = pool.get_nowait()
+    except queue.Empty:
+        return pymysql.connect(**config())
+
+    if time.monotonic() - last_used > _POOL_PING_INTERVAL:
+        try:
+            connection.ping(reconnect=True)
+        except pymysql.MySQLError:
+            _close_quietly(connection)
+            return pymysql.connect(**config())
+    return connection
+
+
+def _release(pool: queue.LifoQueue, connection) -> None:
+    if not connection.open:
+        return
+    try:
+        # 调用方开启事务后未提交：回滚，并恢复默认的 autocommit（均按本地状态位判断，无额外往返）
+        if connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            connection.rollback()
+        if not connection.get_autocommit():
+            connection.autocommit(True)
+        pool.put_nowait((time.monotonic(), connection))
+    except (queue.Full, pymysql.MySQLError):
+        _close_quietly(connection)
 
 
 @contextmanager
-def get_conn_tuple():
-    """与 DictCursor 的 get_conn 并列：TL 比价迁移代码使用元组游标（row[0] 等）。"""
-    config = {k: v for k, v in _get_db_config().items() if k != "cursorclass"}
-    connection = pymysql.connect(**config)
+def _pooled(pool: queue.LifoQueue, config: Callable[[], dict]):
+    connection = _acquire(pool, config)
     try:
         yield connection
-    finally:
-        connection.close()
+    except BaseException:
+        _close_quietly(connection)
+        raise
+    else:
+        _release(pool, connection)
+
+
+def get_conn():
+    _check_fork()
+    return _pooled(_pool, _get_db_config)
+
+
+def get_conn_tuple():
+    """与 DictCursor 的 get_conn 并列：TL 比价迁移代码、合同/磅单服务使用元组游标（row[0] 等）。"""
+    _check_fork()
+    return _pooled(_tuple_pool, _get_tuple_db_config)
@@ -202,7 +202,8 @@ TABLE_STATEMENTS = [
 		INDEX idx_shipper (shipper),
 		INDEX idx_has_delivery_order (has_delivery_order),
 		INDEX idx_upload_status (upload_status),
-		INDEX idx_driver_phone_created_at (driver_phone, created_at)
+		INDEX idx_driver_phone_created_at (driver_phone, created_at),
+		INDEX idx_created_at_id (created_at, id)
 	) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='销售台账/报货订单';
 	""",
 	"""
@@ -459,12 +460,14 @@ TABLE_STATEMENTS = [
 		ocr_status TINYINT DEFAULT 0 COMMENT '0=待确认, 1=已确认, 2=已核销',
 		is_manual_corrected TINYINT DEFAULT 0 COMMENT '0=自动, 1=人工修正',
 		ocr_raw_data TEXT COMMENT 'OCR原始识别文本',
+		receipt_image_hash CHAR(64) DEFAULT NULL COMMENT '主回单图片SHA-256（重复上传判定）',
 		created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
 		updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
 		INDEX idx_payee_amount (payee_name, amount),
 		INDEX idx_payment_date (payment_date),
 		INDEX idx_ocr_status (ocr_status),
-		INDEX idx_receipt_no (receipt_no)
+		INDEX idx_receipt_no (receipt_no),
+		INDEX idx_receipt_image_hash (receipt_image_hash)
 	) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='支付回单表';
 	""",
 	"""
@@ -500,7 +503,9 @@ TABLE_STATEMENTS = [
 		INDEX idx_payee_name (payee_name),
 		INDEX idx_schedule_date (schedule_date),
 		INDEX idx_schedule_status (schedule_status),
-		INDEX idx_payout_status (payout_status)
+		INDEX idx_payout_status (payout_status),
+		INDEX idx_balance_match (payment_status, driver_name, payable_amount, created_at),
+		INDEX idx_status_created (payment_status, created_at)
 	) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='磅单结余明细表';
 	""",
 	"""
@@ -1275,6 +1280,75 @@ def ensure_pd_ip_delivery_records_smelter_column():
 		connection.close()
 
 
+def ensure_pd_payment_receipts_image_hash_column():
+	"""旧库为支付回单表补全 receipt_image_hash（主图片 SHA-256）列。"""
+	config = get_mysql_config()
+	connection = pymysql.connect(**config)
+	try:
+		with connection.cursor() as cursor:
+			cursor.execute("SHOW COLUMNS FROM pd_payment_receipts LIKE 'receipt_image_hash'")
+			if cursor.fetchone() is not None:
+				return
+			cursor.execute("""
+				ALTER TABLE pd_payment_receipts
+				ADD COLUMN receipt_image_hash CHAR(64) DEFAULT NULL COMMENT '主回单图片SHA-256（重复上传判定）'
+				AFTER ocr_raw_data
+			""")
+			try:
+				cursor.execute(
+					"ALTER TABLE pd_payment_receipts ADD INDEX idx_receipt_image_hash (receipt_image_hash)"
+				)
+			except Exception:
+				pass
+			print("pd_payment_receipts 已添加 receipt_image_hash 列")
+		connection.commit()
+	finally:
+		connection.close()
+
+
+def ensure_pd_deliveries_created_at_index():
+	"""旧库为报单表补全 (created_at, id) 索引：磅单/报单列表按创建时间倒序分页。"""
+	config = get_mysql_config()
+	connection = pymysql.connect(**config)
+	try:
+		with connection.cursor() as cursor:
+			cursor.execute("SHOW INDEX FROM pd_deliveries WHERE Key_name = 'idx_created_at_id'")
+			if cursor.fetchone() is not None:
+				return
+			try:
+				cursor.execute("ALTER TABLE pd_deliveries ADD INDEX idx_created_at_id (created_at, id)")
+				print("pd_deliveries 已添加 idx_created_at_id 索引")
+			except Exception as exc:
+				print(f"添加 pd_deliveries.idx_created_at_id 索引失败: {exc}")
+		connection.commit()
+	finally:
+		connection.close()
+
+
+def ensure_pd_balance_details_indexes():
+	"""旧库为结余明细表补全组合索引：待支付匹配（状态+司机+金额+时间）、按状态筛选并按创建时间倒序的列表。"""
+	indexes = {
+		"idx_balance_match": "(payment_status, driver_name, payable_amount, created_at)",
+		"idx_status_created": "(payment_status, created_at)",
+	}
+	config = get_mysql_config()
+	connection = pymysql.connect(**config)
+	try:
+		with connection.cursor() as cursor:
+			for name, columns in indexes.items():
+				cursor.execute("SHOW INDEX FROM pd_balance_details WHERE Key_name = %s", (name,))
+				if cursor.fetchone() is not None:
+					continue
+				try:
+					cursor.execute(f"ALTER TABLE pd_balance_details ADD INDEX {name} {columns}")
+					print(f"pd_balance_details 已添加 {name} 索引")
+				except Exception as exc:
+					print(f"添加 pd_balance_details.{name} 索引失败: {exc}")
+		connection.commit()
+	finally:
+		connection.close()
+
+
 def create_tables() -> None:
 	# 第1步：先创建数据库（如果不存在）
 	create_database_if_not_exists()
@@ -1300,6 +1374,9 @@ def create_tables() -> None:
 		ensure_pd_allocation_predictions_regional_manager_column()
 		ensure_pd_ip_delivery_records_smelter_column()
 		ensure_pd_ip_prediction_results_smelter_column()
+		ensure_pd_payment_receipts_image_hash_column()
+		ensure_pd_deliveries_created_at_index()
+		ensure_pd_balance_details_indexes()
 		migrate_delivery_status_to_audit()
 		try:
 			ensure_tl_quote_details_price_field_sources_column()
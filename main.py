@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+import mimetypes
 import os
 
 import time
@@ -35,10 +36,13 @@ from apscheduler.triggers.cron import CronTrigger
 from database_setup import create_tables
 from app.api.v1.api import api_router, public_api_router
 from app.core.config import settings
+from app.core.paths import ensure_upload_dirs
 from app.api.v1.user.routes import register_pd_auth_routes
 from core.auth import get_user_identity_from_authorization
 from app.services.contract_service import expire_contracts_after_grace
+from app.utils.ocr_pool import get_ocr_engine
 from app.api.v1.routes.allocation import run_test_prediction
+from app.tasks.weighbill_ocr import sweep_stale_ocr_job_images
 from app.intelligent_prediction.services.scheduled_prediction import (
     run_scheduled_intelligent_prediction_sync,
 )
@@ -51,6 +55,10 @@ async def lifespan(app: FastAPI):
         logger.warning(
             "JWT_SECRET 未配置或为默认值，生产环境请务必设置强随机密钥并妥善保管"
         )
+    ensure_upload_dirs()
+    # 预加载 MIME 数据库：FileResponse/guess_type 首次调用会读取系统 mime.types
+    if not mimetypes.inited:
+        mimetypes.init()
     print("正在检查数据库初始化...")
     try:
         create_tables()
@@ -59,6 +67,12 @@ async def lifespan(app: FastAPI):
         print(f"数据库初始化失败: {e}")
         logger.exception("database init failed")
 
+    # 预加载共享的 RapidOCR 模型（磅单/回单/合同识别共用），避免首个识别请求承担加载耗时
+    try:
+        get_ocr_engine()
+    except Exception as e:
+        logger.warning("ocr engine warmup failed: %s", e)
+
     expired_count = expire_contracts_after_grace()
     logger.info("contract expire sync finished updated=%s", expired_count)
 
@@ -93,6 +107,14 @@ async def lifespan(app: FastAPI):
         id="daily_prediction",
         replace_existing=True,
     )
+    # 异步 OCR 任务过期/丢失后遗留在 uploads/temp 的磅单图片
+    scheduler.add_job(
+        func=sweep_stale_ocr_job_images,
+        trigger="interval",
+        minutes=30,
+        id="sweep_ocr_job_images",
+        replace_existing=True,
+    )
     if settings.intelligent_prediction_schedule_enabled:
         scheduler.add_job(
             func=run_scheduled_intelligent_prediction_sync,
@@ -110,6 +132,7 @@ async def lifespan(app: FastAPI):
         )
     scheduler.start()
     logger.info("scheduler started")
+    logger.info("routes registered count=%s", len(app.routes))
     try:
         from app.intelligent_prediction.services.cache_manager import get_cache_manager
 
@@ -0,0 +1,212 @@
+"""BalanceService（不连真实 MySQL）：结余批量生成与核销、回单识别缓存与小图免预处理、共享 OCR 引擎、回单重复上传判定。"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+from contextlib import contextmanager
+from decimal import Decimal
+
+import pytest
+from PIL import Image
+
+from app.services import balance_service
+from app.services.balance_service import BalanceService
+
+
+class _FakeCursor:
+    def __init__(self, results: list) -> None:
+        self.results = results
+        self.executed: list[tuple[str, object]] = []
+        self.many: list[tuple[str, list]] = []
+        self.description = None
+        self._rows: list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def execute(self, sql: str, params=None) -> None:
+        self.executed.append((sql, params))
+        self.description, self._rows = self.results.pop(0)
+
+    def executemany(self, sql: str, rows) -> None:
+        self.many.append((sql, list(rows)))
+
+    def fetchall(self) -> list:
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+class _FakeConn:
+    def __init__(self, cursor: _FakeCursor) -> None:
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self) -> _FakeCursor:
+        return self._cursor
+
+    def begin(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        self.commits += 1
+
+
+@pytest.fixture()
+def service() -> BalanceService:
+    svc = BalanceService.__new__(BalanceService)
+    svc._balance_has_payee_bank_name = False
+    svc._weighbill_has_warehouse_name = True
+    svc._receipt_has_image_hash = False
+    return svc
+
+
+def _use_cursor(monkeypatch, cursor: _FakeCursor) -> _FakeConn:
+    conn = _FakeConn(cursor)
+
+    @contextmanager
+    def get_conn():
+        yield conn
+
+    monkeypatch.setattr(balance_service, "get_conn", get_conn)
+    return conn
+
+
+def test_generate_balance_details_inserts_in_one_batch(monkeypatch, service) -> None:
+    columns = [(name,) for name in (
+        "weighbill_id", "contract_no", "delivery_id", "vehicle_no", "product_name", "net_weight",
+        "unit_price", "warehouse_name", "driver_name", "driver_phone", "payee",
+    )]
+    weighbills = [
+        (11, "HT-1", 1, "粤A1", "电解铅", Decimal("10.000"), Decimal("1048.00"), "一号库", "张三", "1", "李四"),
+        (12, "HT-1", 2, "粤A2", "电解铅", Decimal("5.000"), Decimal("1048.00"), "一号库", "王五", "2", "李四"),
+    ]
+    cursor = _FakeCursor([
+        (columns, weighbills),
+        ([("id",)], []),  # 仓库收款人匹配：同一仓库+收款人只查一次
+        (None, [(11, 101), (12, 102)]),
+    ])
+    conn = _use_cursor(monkeypatch, cursor)
+
+    result = service.generate_balance_details(contract_no="HT-1")
+
+    assert result["success"] is True
+    assert len(cursor.many) == 1
+    inserted = cursor.many[0][1]
+    assert [row[2] for row in inserted] == [11, 12]
+    assert [row[10] for row in inserted] == [Decimal("10000.00"), Decimal("5000.00")]
+    assert [item["balance_id"] for item in result["data"]] == [101, 102]
+    assert conn.commits == 1
+    assert cursor.results == []
+
+
+def test_receipt_ocr_cache_returns_copies_of_successful_results() -> None:
+    balance_service._RECEIPT_OCR_CACHE.clear()
+    BalanceService.cache_receipt_ocr("h-fail", {"success": True, "ocr_success": False, "data": {}})
+    assert BalanceService.get_cached_receipt_ocr("h-fail") is None
+
+    BalanceService.cache_receipt_ocr("h-ok", {"success": True, "ocr_success": True, "data": {"amount": 1.0}})
+    first = BalanceService.get_cached_receipt_ocr("h-ok")
+    first["data"]["amount"] = 2.0
+    assert BalanceService.get_cached_receipt_ocr("h-ok")["data"]["amount"] == 1.0
+    assert BalanceService.get_cached_receipt_ocr(None) is None
+
+
+def test_ocr_engine_is_shared_with_weighbill_service(monkeypatch) -> None:
+    from app.services.weighbill_service import WeighbillService
+    from app.utils import ocr_pool
+
+    engine = object()
+    monkeypatch.setattr(ocr_pool, "_ocr_engine", engine)
+    assert BalanceService().ocr is engine
+    assert WeighbillService().ocr is engine
+
+
+def _jpeg(size: tuple[int, int]) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, "white").save(out, "JPEG")
+    return out.getvalue()
+
+
+@pytest.mark.parametrize(
+    ("size", "confidence", "passes"),
+    [((800, 600), 0.95, ["raw"]), ((800, 600), 0.5, ["raw", "prep"]), ((3000, 600), 0.95, ["prep"])],
+)
+def test_receipt_bytes_skip_preprocess_for_small_clean_images(
+        monkeypatch, service, size, confidence, passes
+) -> None:
+    seen: list[str] = []
+
+    def recognize(image):
+        seen.append("raw" if isinstance(image, bytes) else "prep")
+        return {"success": True, "ocr_success": True, "ocr_confidence": confidence, "data": {"amount": 1.0}}
+
+    monkeypatch.setattr(service, "recognize_payment_receipt", recognize)
+    service.recognize_payment_receipt_bytes(_jpeg(size))
+    assert seen == passes
+
+
+def test_verify_payment_writes_all_items_in_constant_statements(monkeypatch, service) -> None:
+    cursor = _FakeCursor([
+        (None, [(Decimal("1500.00"), service.OCR_STATUS_CONFIRMED)]),
+        (None, [(1, Decimal("1000.00"), Decimal("0.00")), (2, Decimal("800.00"), Decimal("300.00"))]),
+        (None, []),
+        (None, []),
+    ])
+    conn = _use_cursor(monkeypatch, cursor)
+
+    result = service.verify_payment(7, [
+        {"balance_id": 1, "amount": 1000},
+        {"balance_id": 2, "amount": 900},
+        {"balance_id": 3, "amount": 50},
+    ])
+
+    assert result["success"] is True
+    assert result["data"]["items"] == [
+        {"balance_id": 1, "settled_amount": 1000.0, "status": service.PAY_STATUS_SETTLED},
+        {"balance_id": 2, "settled_amount": 500.0, "status": service.PAY_STATUS_SETTLED},
+    ]
+    assert result["data"]["receipt_status"] == service.OCR_STATUS_VERIFIED
+    assert len(cursor.executed) == 4
+    assert cursor.many[0][1] == [(7, 1, Decimal("1000")), (7, 2, Decimal("500.00"))]
+    assert conn.commits == 1
+
+
+def test_receipt_hash_column_check_is_not_cached_on_error(monkeypatch, service) -> None:
+    service._receipt_has_image_hash = None
+
+    @contextmanager
+    def broken_conn():
+        raise RuntimeError("db down")
+        yield
+
+    monkeypatch.setattr(balance_service, "get_conn", broken_conn)
+    assert service._has_receipt_image_hash_column() is False
+    assert service._receipt_has_image_hash is None
+
+    _use_cursor(monkeypatch, _FakeCursor([(None, [("receipt_image_hash",)])]))
+    assert service._has_receipt_image_hash_column() is True
+
+
+def test_duplicate_receipt_requires_all_images_to_match(monkeypatch, service, tmp_path) -> None:
+    main, second = tmp_path / "main.jpg", tmp_path / "second.jpg"
+    main.write_bytes(b"main")
+    second.write_bytes(b"second")
+    hashes = [hashlib.sha256(p.read_bytes()).hexdigest() for p in (main, second)]
+    row = (7, "R-1", "张三", Decimal("100.00"), "2026-10-01", json.dumps([str(main), str(second)]))
+    service._receipt_has_image_hash = True
+
+    _use_cursor(monkeypatch, _FakeCursor([(None, [row])]))
+    assert service.find_payment_receipt_by_image_hashes(hashes)["id"] == 7
+
+    # 主图片相同但其余图片不同 / 张数不同：不算重复
+    _use_cursor(monkeypatch, _FakeCursor([(None, [row])]))
+    assert service.find_payment_receipt_by_image_hashes([hashes[0], "0" * 64]) is None
+    _use_cursor(monkeypatch, _FakeCursor([(None, [row])]))
+    assert service.find_payment_receipt_by_image_hashes(hashes[:1]) is None
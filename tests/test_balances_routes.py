@@ -0,0 +1,37 @@
+"""结余管理路由注册检查：防止 balances 路由被重复注册。"""
+
+from __future__ import annotations
+
+from collections import Counter
+
+from fastapi.routing import APIRoute
+
+from app.api.v1.api import api_router
+from app.api.v1.routes import balances
+
+# balances.py 中声明的接口数；新增/删除接口时同步调整
+EXPECTED_BALANCES_ROUTE_COUNT = 18
+
+
+def _balances_routes() -> list[APIRoute]:
+    return [
+        r for r in api_router.routes
+        if isinstance(r, APIRoute) and r.path.startswith("/balances")
+    ]
+
+
+def test_balances_routes_registered_once() -> None:
+    routes = _balances_routes()
+    assert len(routes) == EXPECTED_BALANCES_ROUTE_COUNT
+    assert len(routes) == len(balances.router.routes)
+
+
+def test_balances_routes_have_no_duplicate_path_method() -> None:
+    counter = Counter((r.path, method) for r in _balances_routes() for method in r.methods)
+    duplicates = [key for key, count in counter.items() if count > 1]
+    assert duplicates == []
+
+
+def test_balance_detail_catch_all_is_last() -> None:
+    # /{balance_id} 必须最后注册，否则会遮蔽 /grouped、/payment-receipts 等固定路径
+    assert _balances_routes()[-1].path == "/balances/{balance_id}"
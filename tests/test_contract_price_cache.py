@@ -0,0 +1,98 @@
+"""磅单合同单价查询缓存：命中不查库、合同新建/变更后失效、查询异常不缓存。"""
+
+from __future__ import annotations
+
+import pytest
+
+from app.services import contract_service, weighbill_service
+from app.services.weighbill_service import WeighbillService
+
+
+@pytest.fixture()
+def service(monkeypatch):
+    calls: list[tuple] = []
+    results: list = []
+
+    def query(self, contract_no, product_name):
+        calls.append((contract_no, product_name))
+        return results.pop(0)
+
+    monkeypatch.setattr(WeighbillService, "_query_contract_price", query)
+    contract_service.invalidate_contract_cache()
+    svc = WeighbillService.__new__(WeighbillService)
+    svc.calls, svc.results = calls, results
+    yield svc
+    contract_service.invalidate_contract_cache()
+
+
+def test_price_lookup_is_cached_until_contract_invalidated(service) -> None:
+    service.results.extend([580.0, 600.0])
+    assert service.get_contract_price_by_product("HT-1", " 电解铅 ") == 580.0
+    assert service.get_contract_price_by_product("HT-1", "电解铅") == 580.0
+    assert len(service.calls) == 1
+
+    contract_service.invalidate_contract_cache(1)
+    assert service.get_contract_price_by_product("HT-1", "电解铅") == 600.0
+    assert len(service.calls) == 2
+
+
+def test_missing_price_cached_but_query_error_not(service) -> None:
+    service.results.extend([None, weighbill_service._PRICE_MISS, 10.0])
+    assert service.get_contract_price_by_product("HT-2", "铅") is None
+    assert service.get_contract_price_by_product("HT-2", "铅") is None
+    assert service.get_contract_price_by_product("HT-2", "锌") is None
+    assert service.get_contract_price_by_product("HT-2", "锌") == 10.0
+    assert len(service.calls) == 3
+
+
+class _FakeCursor:
+    lastrowid = 42
+
+    def __init__(self) -> None:
+        self.rows = [(7,), None, None]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        return 1
+
+    def executemany(self, sql, rows):
+        return len(rows)
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+
+def test_create_contract_invalidates_cached_missing_price(service, monkeypatch) -> None:
+    cursor = _FakeCursor()
+
+    class _FakeConn:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def cursor(self):
+            return cursor
+
+    monkeypatch.setattr(contract_service, "get_conn", _FakeConn)
+    monkeypatch.setattr(contract_service, "_ensure_contract_delivery_plan_id_column", lambda: None)
+    monkeypatch.setattr(contract_service, "_validate_delivery_plan_has_approved_order_plan", lambda pid: None)
+    monkeypatch.setattr(contract_service, "_validate_contract_qty_vs_planned_tonnage", lambda pid, qty: None)
+    monkeypatch.setattr(contract_service.ContractService, "_find_duplicate_contract", lambda self, d, p: None)
+
+    service.results.extend([None, 580.0])
+    assert service.get_contract_price_by_product("HT-3", "电解铅") is None
+
+    result = contract_service.ContractService().create_contract(
+        {"contract_no": "HT-3", "plan_no": "JH-1"},
+        [{"product_name": "电解铅", "unit_price": 580.0}],
+    )
+    assert result["success"] is True
+    assert service.get_contract_price_by_product("HT-3", "电解铅") == 580.0
+    assert len(service.calls) == 2
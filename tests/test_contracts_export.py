@@ -0,0 +1,116 @@
+"""合同导出冒烟测试（依赖覆盖，不连真实 MySQL）。"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from app.services import contract_service
+from app.services.contract_service import ContractService, get_contract_service
+from main import app
+
+
+class _FakeCursor:
+    description = [("id",), ("contract_no",), ("unit_price",), ("product_name",), ("unit_price",)]
+
+    def __init__(self, rows: list[tuple]) -> None:
+        self._rows = list(rows)
+
+    def __enter__(self) -> "_FakeCursor":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        return None
+
+    def execute(self, sql: str, params: tuple = ()) -> None:
+        return None
+
+    def fetchmany(self, size: int) -> list[tuple]:
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+
+class _FakeConn:
+    def __init__(self, rows: list[tuple]) -> None:
+        self._rows = rows
+
+    def cursor(self, *args: object) -> _FakeCursor:
+        return _FakeCursor(self._rows)
+
+
+def test_iter_export_contracts_uses_cursor_columns() -> None:
+    rows = [(1, "HT-1", None, "电动车", 8500), (2, "HT-2", None, "黑皮", 9000)]
+
+    @contextmanager
+    def fake_conn():
+        yield _FakeConn(rows)
+
+    service = ContractService.__new__(ContractService)
+    with patch.object(contract_service, "get_conn", fake_conn):
+        out = list(service.iter_export_contracts(batch_size=1))
+
+    # 同名列只保留一列（位置取首次出现，值取后出现），与旧版 dict(zip(...)) 结果一致
+    assert out[0] == ("id", "contract_no", "unit_price", "product_name")
+    assert out[1:] == [(1, "HT-1", 8500, "电动车"), (2, "HT-2", 9000, "黑皮")]
+
+
+class _FakeExportService:
+    def __init__(self, rows: list[tuple]) -> None:
+        self._rows = rows
+
+    def iter_export_contracts(self, contract_ids=None):
+        yield from self._rows
+
+
+def _export(rows: list[tuple], contract_ids=None):
+    app.dependency_overrides[get_contract_service] = lambda: _FakeExportService(rows)
+    try:
+        return TestClient(app).post("/api/v1/contracts/export", json=contract_ids)
+    finally:
+        app.dependency_overrides.pop(get_contract_service, None)
+
+
+def test_export_contracts_streams_csv_with_single_contract_filename() -> None:
+    resp = _export([("id", "contract_no"), (1, "HT/2024-001")], [1])
+    assert resp.status_code == 200
+    assert resp.headers["content-disposition"] == 'attachment; filename="HT_2024-001.csv"'
+    assert resp.content.decode("utf-8-sig").splitlines() == ["id,contract_no", "1,HT/2024-001"]
+
+
+def test_export_contracts_empty_result() -> None:
+    resp = _export([])
+    assert resp.status_code == 200
+    assert resp.headers["content-disposition"] == 'attachment; filename="contracts_export.csv"'
+    assert resp.content == b"\xef\xbb\xbf"
+
+
+class _FailingExportService:
+    def __init__(self, rows_before_error: list[tuple]) -> None:
+        self._rows = rows_before_error
+
+    def iter_export_contracts(self, contract_ids=None):
+        yield from self._rows
+        raise RuntimeError("db down")
+
+
+def test_export_contracts_query_failure_returns_500() -> None:
+    app.dependency_overrides[get_contract_service] = lambda: _FailingExportService([])
+    try:
+        resp = TestClient(app).post("/api/v1/contracts/export", json=None)
+    finally:
+        app.dependency_overrides.pop(get_contract_service, None)
+    assert resp.status_code == 500
+
+
+def test_export_contracts_mid_stream_failure_aborts_response() -> None:
+    rows = [("id", "contract_no"), (1, "HT-1"), (2, "HT-2")]
+    app.dependency_overrides[get_contract_service] = lambda: _FailingExportService(rows)
+    try:
+        with pytest.raises(RuntimeError):
+            TestClient(app).post("/api/v1/contracts/export", json=None)
+    finally:
+        app.dependency_overrides.pop(get_contract_service, None)
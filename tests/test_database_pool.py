@@ -0,0 +1,106 @@
+"""core.database 连接池：复用、异常丢弃、未提交事务回滚、fork 后不复用父进程连接（不连真实 MySQL）。"""
+
+from __future__ import annotations
+
+import queue
+from unittest.mock import patch
+
+import pytest
+from pymysql.constants import SERVER_STATUS
+
+from core import database
+
+
+class _FakeConnection:
+    def __init__(self) -> None:
+        self.open = True
+        self.server_status = SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT
+        self.rollbacks = 0
+
+    def close(self) -> None:
+        self.open = False
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+        self.server_status &= ~SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def get_autocommit(self) -> bool:
+        return bool(self.server_status & SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT)
+
+    def autocommit(self, value: bool) -> None:
+        self.server_status |= SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT
+
+    def ping(self, reconnect: bool = True) -> None:
+        return None
+
+
+@pytest.fixture()
+def fake_connect():
+    created: list[_FakeConnection] = []
+
+    def connect(**kwargs):
+        created.append(_FakeConnection())
+        created[-1].config = kwargs
+        return created[-1]
+
+    with patch.object(database, "_pool", queue.LifoQueue(maxsize=2)), \
+            patch.object(database, "_tuple_pool", queue.LifoQueue(maxsize=2)), \
+            patch.object(database, "_get_db_config", lambda: {"cursorclass": "dict"}), \
+            patch.object(database.pymysql, "connect", connect):
+        yield created
+
+
+def test_get_conn_reuses_released_connection(fake_connect) -> None:
+    with database.get_conn() as first:
+        pass
+    with database.get_conn() as second:
+        pass
+    assert first is second
+    assert len(fake_connect) == 1
+
+
+def test_get_conn_discards_connection_on_error(fake_connect) -> None:
+    with pytest.raises(RuntimeError):
+        with database.get_conn():
+            raise RuntimeError("boom")
+    assert not fake_connect[0].open
+    with database.get_conn() as conn:
+        pass
+    assert conn is not fake_connect[0]
+
+
+def test_get_conn_rolls_back_open_transaction(fake_connect) -> None:
+    with database.get_conn() as conn:
+        conn.server_status = SERVER_STATUS.SERVER_STATUS_IN_TRANS
+    assert conn.rollbacks == 1
+    assert conn.get_autocommit()
+    assert database._pool.qsize() == 1
+
+
+def test_tuple_connections_use_separate_pool(fake_connect) -> None:
+    with database.get_conn_tuple() as tuple_conn:
+        pass
+    with database.get_conn() as dict_conn:
+        pass
+    assert tuple_conn is not dict_conn
+    assert "cursorclass" not in tuple_conn.config
+    with database.get_conn_tuple() as again:
+        pass
+    assert again is tuple_conn
+
+
+def test_forked_process_does_not_reuse_parent_connections(fake_connect) -> None:
+    with database.get_conn() as parent_conn:
+        pass
+    with database.get_conn_tuple() as parent_tuple_conn:
+        pass
+    with patch.object(database, "_pool_pid", -1):
+        with database.get_conn() as child_conn:
+            pass
+        with database.get_conn_tuple() as child_tuple_conn:
+            pass
+        assert database._pool_pid == database.os.getpid()
+    assert child_conn is not parent_conn
+    assert child_tuple_conn is not parent_tuple_conn
+    # 继承来的连接只丢弃不关闭，避免断开父进程的会话
+    assert parent_conn.open and parent_tuple_conn.open
@@ -0,0 +1,48 @@
+"""conditional_file_response：条件请求 304 与小文件内存缓存（文件变化后失效）。"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+
+from starlette.requests import Request
+
+from app.utils import file_responses
+
+
+def _request(headers: dict | None = None) -> Request:
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+
+def _serve(path, headers: dict | None = None):
+    return asyncio.run(
+        file_responses.conditional_file_response(
+            _request(headers), path, media_type="image/jpeg", filename="a.jpg", cache_in_memory=True
+        )
+    )
+
+
+def test_cached_response_refreshes_when_file_changes(tmp_path) -> None:
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"old")
+    file_responses._MEMORY_CACHE.clear()
+
+    first = _serve(path)
+    assert first.body == b"old"
+    assert first.headers["content-disposition"] == 'inline; filename="a.jpg"'
+
+    path.write_bytes(b"newer")
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 1_000_000))
+    second = _serve(path)
+    assert second.body == b"newer"
+    assert second.headers["etag"] != first.headers["etag"]
+
+
+def test_matching_etag_returns_not_modified(tmp_path) -> None:
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"data")
+
+    etag = _serve(path).headers["etag"]
+    response = _serve(path, {"If-None-Match": etag})
+    assert response.status_code == 304
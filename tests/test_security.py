@@ -0,0 +1,127 @@
+"""app.core.security：argon2id 哈希与旧 bcrypt 兼容（登录后升级）、密码校验结果缓存（命中跳过 checkpw、改密后失效）；JWT 解码缓存。"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import bcrypt
+import jwt
+import pytest
+
+from app.core import security
+from app.services import user_services
+
+
+def test_verify_password_caches_result_per_hash() -> None:
+    security._VERIFY_CACHE.clear()
+    hashed = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=4)).decode()
+    calls = []
+    real_checkpw = bcrypt.checkpw
+
+    def counting_checkpw(password, hashed_password):
+        calls.append(password)
+        return real_checkpw(password, hashed_password)
+
+    with patch.object(security.bcrypt, "checkpw", counting_checkpw):
+        assert security.verify_password("secret", hashed)
+        assert security.verify_password("secret", hashed)
+        assert not security.verify_password("wrong", hashed)
+        assert len(calls) == 2
+
+        new_hash = bcrypt.hashpw(b"other", bcrypt.gensalt(rounds=4)).decode()
+        assert not security.verify_password("secret", new_hash)
+        assert len(calls) == 3
+
+
+def test_verify_password_rejects_unknown_hash_format() -> None:
+    security._VERIFY_CACHE.clear()
+    assert not security.verify_password("secret", "not-a-hash")
+
+
+def test_hash_password_uses_argon2_and_bcrypt_hashes_need_rehash() -> None:
+    security._VERIFY_CACHE.clear()
+    hashed = security.hash_password("secret")
+    assert hashed.startswith("$argon2id$")
+    assert security.verify_password("secret", hashed)
+    assert not security.verify_password("wrong", hashed)
+    assert not security.password_needs_rehash(hashed)
+
+    legacy = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=4)).decode()
+    assert security.verify_password("secret", legacy)
+    assert security.password_needs_rehash(legacy)
+    assert not security.password_needs_rehash("not-a-hash")
+
+
+def test_decode_token_caches_until_exp() -> None:
+    security._DECODE_CACHE.clear()
+    token = security.create_access_token("7", "k", "HS256", expires_in_seconds=60)
+    calls = []
+    real_decode = security.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return real_decode(*args, **kwargs)
+
+    with patch.object(security.jwt, "decode", counting_decode):
+        first = security.decode_token(token, "k", "HS256")
+        first["sub"] = "mutated"
+        assert security.decode_token(token, "k", "HS256")["sub"] == "7"
+        assert len(calls) == 1
+
+        # 缓存的 payload 过期后不再直接返回，交给 jwt.decode 重新校验
+        with patch.object(security.time, "time", lambda: first["exp"] + 1):
+            security.decode_token(token, "k", "HS256")
+        assert len(calls) == 2
+
+        with pytest.raises(jwt.InvalidSignatureError):
+            security.decode_token(token, "other", "HS256")
+
+
+class _FakeUserCursor:
+    def __init__(self, user: dict) -> None:
+        self.user = user
+        self.executed: list[tuple[str, tuple]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def execute(self, sql: str, params=None) -> None:
+        self.executed.append((sql, params))
+
+    def fetchone(self) -> dict:
+        return dict(self.user)
+
+
+def _authenticate(monkeypatch, stored_hash: str) -> _FakeUserCursor:
+    cursor = _FakeUserCursor({"id": 5, "account": "u", "password_hash": stored_hash})
+
+    class _Conn:
+        def cursor(self):
+            return cursor
+
+    @contextmanager
+    def get_conn():
+        yield _Conn()
+
+    monkeypatch.setattr(user_services, "get_conn", get_conn)
+    monkeypatch.setattr(user_services, "build_dynamic_select", lambda *a, **kw: "SELECT")
+    user_services.AuthService.authenticate("u", "secret")
+    return cursor
+
+
+def test_login_rehashes_legacy_bcrypt_to_argon2(monkeypatch) -> None:
+    security._VERIFY_CACHE.clear()
+    legacy = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=4)).decode()
+    updates = [e for e in _authenticate(monkeypatch, legacy).executed if e[0].startswith("UPDATE")]
+    assert len(updates) == 1
+    new_hash, user_id = updates[0][1]
+    assert user_id == 5 and new_hash.startswith("$argon2id$")
+    assert security.verify_password("secret", new_hash)
+
+    current = security.hash_password("secret")
+    updates = [e for e in _authenticate(monkeypatch, current).executed if e[0].startswith("UPDATE")]
+    assert updates == []
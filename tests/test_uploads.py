@@ -0,0 +1,30 @@
+"""app.utils.uploads：仍在内存中的上传文件不走 sendfile，且不被强制转存到磁盘。"""
+
+from __future__ import annotations
+
+from tempfile import SpooledTemporaryFile
+
+from app.utils import uploads
+
+
+def test_in_memory_spooled_file_is_copied_without_rollover(tmp_path) -> None:
+    src = SpooledTemporaryFile(max_size=1024)
+    src.write(b"small upload")
+    dest = tmp_path / "out.bin"
+
+    assert uploads._sendfile_copy(src, dest) is False
+    assert src._rolled is False
+
+    uploads._copy(src, dest, 4)
+    assert dest.read_bytes() == b"small upload"
+    assert src._rolled is False
+
+
+def test_rolled_over_file_is_copied(tmp_path) -> None:
+    src = SpooledTemporaryFile(max_size=4)
+    src.write(b"rolled over upload")
+    assert src._rolled is True
+    dest = tmp_path / "out.bin"
+
+    uploads._copy(src, dest, 4)
+    assert dest.read_bytes() == b"rolled over upload"
@@ -0,0 +1,80 @@
+"""磅单批量确认（不连真实 MySQL）：只确认已上传、待确认且有单价的磅单，返回总价有变化的磅单。"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from decimal import Decimal
+
+from app.services import weighbill_service
+from app.services.weighbill_service import WeighbillService
+
+
+class _FakeCursor:
+    def __init__(self, rows: list) -> None:
+        self.rows = rows
+        self.executed: list[tuple[str, tuple]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def execute(self, sql: str, params=None) -> int:
+        self.executed.append((sql, params))
+        return len(params or ())
+
+    def fetchall(self) -> list:
+        return self.rows
+
+
+class _FakeConn:
+    def __init__(self, cursor: _FakeCursor) -> None:
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self) -> _FakeCursor:
+        return self._cursor
+
+    def begin(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        self.commits += 1
+
+
+def test_batch_confirm_updates_eligible_rows_and_reports_changed_totals(monkeypatch) -> None:
+    # 库中满足条件（已上传 + 待确认 + 有单价）的只有 1、2（3 已修正，被 WHERE 过滤）；1 的总价是旧值
+    cursor = _FakeCursor([
+        (1, 10, "HT-1", "电解铅", Decimal("16800.00"), Decimal("30.125"), Decimal("505000.00")),
+        (2, 11, "HT-1", "电解铅", Decimal("16800.00"), Decimal("20.000"), Decimal("336000.00")),
+    ])
+    conn = _FakeConn(cursor)
+
+    @contextmanager
+    def get_conn():
+        yield conn
+
+    monkeypatch.setattr(weighbill_service, "get_conn", get_conn)
+    result = WeighbillService.__new__(WeighbillService).batch_confirm_weighbills([3, 2, 1, 2])
+
+    select_sql, select_params = cursor.executed[0]
+    assert "ocr_status = '待确认'" in select_sql and "'已修正'" not in select_sql
+    assert "unit_price IS NOT NULL" in select_sql and "FOR UPDATE" in select_sql
+    assert select_params == (1, 2, 3)
+    update_sql, update_params = cursor.executed[1]
+    assert "ocr_status = '已确认'" in update_sql
+    assert update_params == (1, 2)
+    assert conn.commits == 1
+
+    assert result["data"]["requested"] == 3
+    assert result["data"]["confirmed"] == 2
+    assert result["data"]["total_changed"] == [{
+        "weighbill_id": 1,
+        "delivery_id": 10,
+        "contract_no": "HT-1",
+        "product_name": "电解铅",
+        "unit_price": Decimal("16800.00"),
+        "net_weight": Decimal("30.125"),
+        "total_amount": Decimal("506100.00"),
+    }]
@@ -0,0 +1,21 @@
+"""磅单列表游标分页：next_cursor 编解码与非法游标。"""
+
+from __future__ import annotations
+
+from datetime import datetime
+
+import pytest
+
+from app.services.weighbill_service import WeighbillService
+
+
+def test_list_cursor_round_trip() -> None:
+    created_at = datetime(2024, 3, 5, 8, 30, 15)
+    cursor = WeighbillService.encode_list_cursor(created_at, 42)
+    assert WeighbillService.decode_list_cursor(cursor) == (created_at, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "MjAyNA"])
+def test_invalid_list_cursor_raises_value_error(cursor: str) -> None:
+    with pytest.raises(ValueError):
+        WeighbillService.decode_list_cursor(cursor)
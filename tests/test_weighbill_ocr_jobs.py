@@ -0,0 +1,24 @@
+"""磅单异步 OCR：过期/丢失任务遗留的临时图片由定时清理删除，未到期的保留。"""
+
+from __future__ import annotations
+
+import os
+import time
+
+from app.tasks import weighbill_ocr
+
+
+def test_sweep_removes_only_stale_job_images(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(weighbill_ocr, "TEMP_UPLOADS_DIR", tmp_path)
+    stale = tmp_path / "weighbill_job_old.jpg"
+    fresh = tmp_path / "weighbill_job_new.jpg"
+    other = tmp_path / "other_old.jpg"
+    for path in (stale, fresh, other):
+        path.write_bytes(b"x")
+    old = time.time() - 3 * weighbill_ocr.OCR_JOB_EXPIRES_SECONDS
+    os.utime(stale, (old, old))
+    os.utime(other, (old, old))
+
+    assert weighbill_ocr.sweep_stale_ocr_job_images() == 1
+    assert not stale.exists()
+    assert fresh.exists() and other.exists()